@@ -20,5 +20,8 @@ def get_level(level):
 
 
 from .logger import getLogger, get_logger, setup_logging, Logger
-from .filters import LowerLogLevelFilter
+from .meta import meta_context, current_meta, MetaView, LazyMeta
+from .filters import LowerLogLevelFilter, RateLimitFilter, SamplingFilter, \
+    RepeatSuppressionFilter
 from .formatters import LogColorFormatter
+from .handlers import FlightRecorderHandler
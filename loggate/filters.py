@@ -1,6 +1,13 @@
 import logging
+import random
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from threading import Lock
 
 from . import get_level
+from .logger import get_logger
 
 
 class LowerLogLevelFilter(logging.Filter):
@@ -12,3 +19,167 @@ class LowerLogLevelFilter(logging.Filter):
 
     def filter(self, record):
         return record.levelno < self.level
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    The token bucket per logger (or per message template). Every record takes
+    one token, the bucket is refilled by `rate` tokens per second up to
+    `burst`. The records without token are dropped, the number of dropped
+    records is added to the next accepted record of the same bucket
+    (`meta.suppressed`).
+    Use it as the filter of the logger, so the records are dropped before
+    they are copied for handlers and formatted.
+    """
+
+    KEY_LOGGER = 'logger'
+    KEY_TEMPLATE = 'template'
+
+    def __init__(self, rate: float = 10, burst: int = None,
+                 key: str = KEY_LOGGER, level=None, max_keys: int = 1000):
+        """
+        :param rate: float - number of records per second
+        :param burst: int - size of the bucket (default `rate`)
+        :param key: str - `logger` (bucket per logger) or `template`
+                    (bucket per logger and message template)
+        :param level: int|str - the records of this and higher levels are
+                      not limited (default: all records are limited)
+        :param max_keys: int - max number of buckets, the least recently used
+                         buckets are forgotten
+        """
+        if key not in (self.KEY_LOGGER, self.KEY_TEMPLATE):
+            raise ValueError(f'The rate limit key "{key}" is not supported.')
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(1, rate))
+        self.key = key
+        self.level = get_level(level) if level is not None else None
+        self.max_keys = max_keys
+        self.__buckets = OrderedDict()
+        self.__lock = Lock()
+
+    def filter(self, record):
+        if self.level is not None and record.levelno >= self.level:
+            return True
+        if self.key == self.KEY_TEMPLATE:
+            msg = record.msg
+            key = (record.name, msg if isinstance(msg, str) else str(msg))
+        else:
+            key = record.name
+        now = time.monotonic()
+        with self.__lock:
+            bucket = self.__buckets.get(key)
+            if bucket is None:
+                # [tokens, last refill, suppressed records]
+                bucket = self.__buckets[key] = [self.burst, now, 0]
+                if len(self.__buckets) > self.max_keys:
+                    self.__buckets.popitem(last=False)
+            else:
+                self.__buckets.move_to_end(key)
+                bucket[0] = min(self.burst,
+                                bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed and isinstance(getattr(record, 'meta', None),
+                                     MutableMapping):
+            record.meta['suppressed'] = suppressed
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    This accepts only the part of records of the level (e.g. 10% of DEBUG
+    records). With `key` the decision is deterministic by the value of
+    the metadata (e.g. all records of the sampled trace are accepted).
+    """
+
+    def __init__(self, rates: dict = None, key: str = None):
+        """
+        :param rates: dict - level: accepted part (0.0 - 1.0), the levels
+                      which are not listed are not sampled
+                      (e.g. {DEBUG: 0.1, INFO: 0.5})
+        :param key: str - name of metadata for the deterministic sampling
+                    (e.g. trace_id), the records without it are sampled
+                    randomly
+        """
+        self.rates = {get_level(level): float(rate)
+                      for level, rate in (rates or {}).items()}
+        self.key = key
+        # The hash (crc32) of the key has to be lower than the threshold.
+        self.__thresholds = {level: rate * 0x100000000
+                             for level, rate in self.rates.items()}
+
+    def filter(self, record):
+        threshold = self.__thresholds.get(record.levelno)
+        if threshold is None:
+            return True
+        if self.key:
+            val = getattr(record, 'meta', {}).get(self.key)
+            if val is not None:
+                return zlib.crc32(str(val).encode('utf-8')) < threshold
+        return random.random() * 0x100000000 < threshold
+
+
+class RepeatSuppressionFilter(logging.Filter):
+    """
+    This collapses identical consecutive records of the logger (the same
+    level, message template and arguments). The first record is accepted,
+    the repeats are dropped and they are reported by the record
+    "Last message repeated N times" (`meta.repeated`) before the next
+    different record, or together with the repeat after `max_interval`.
+    Use it as the filter of the logger, the report is sent to the handlers
+    of the logger.
+    """
+
+    message = 'Last message repeated %s times'
+
+    def __init__(self, max_interval: float = 30):
+        """
+        :param max_interval: float - max time (in seconds) of suppression,
+                             then the repeat is reported and accepted
+        """
+        self.max_interval = max_interval
+        # logger name: [signature, first record, repeats, first time]
+        self.__last = {}
+        self.__lock = Lock()
+
+    @staticmethod
+    def __signature(record):
+        return record.levelno, record.msg, record.args
+
+    @staticmethod
+    def __same(first, second) -> bool:
+        try:
+            return bool(first == second)
+        except Exception:
+            return False
+
+    def filter(self, record):
+        signature = self.__signature(record)
+        now = time.monotonic()
+        with self.__lock:
+            last = self.__last.get(record.name)
+            if last and self.__same(last[0], signature) and \
+                    now - last[3] < self.max_interval:
+                last[2] += 1
+                return False
+            self.__last[record.name] = [signature, record, 0, now]
+        if last and last[2]:
+            self.report(last[1], last[2])
+        return True
+
+    def report(self, record, repeats: int):
+        """
+        Send the record about suppressed repeats to the handlers of logger.
+        """
+        logger = get_logger(record.name)
+        meta = dict(getattr(record, 'meta', None) or {})
+        meta['repeated'] = repeats
+        summary = logger.makeRecord(
+            record.name, record.levelno, record.pathname, record.lineno,
+            self.message, (repeats,), None, record.funcName, meta=meta
+        )
+        logger.callHandlers(summary)
@@ -0,0 +1,157 @@
+import copy
+import logging
+from collections import OrderedDict, deque
+from typing import Union
+
+from . import get_level
+
+_exception_formatter = logging.Formatter()
+
+
+class FlightRecorderHandler(logging.Handler):
+    """
+    The flight recorder keeps the recent records in the ring buffer (per
+    logger or per value of metadata, e.g. request_id) and sends nothing.
+    When the record of `trigger_level` (or higher) arrives, the buffered
+    records of the same ring (the context leading up to the error) and
+    the record itself are sent to the target handler.
+    The buffered records are compact snapshots: the message is merged with
+    its arguments and the exception is rendered to the text, so they do not
+    keep the arguments and tracebacks (with their frames) alive.
+    """
+
+    # The estimated size (in bytes) of the snapshot without its texts
+    record_overhead = 500
+
+    def __init__(self, target: Union[str, logging.Handler],
+                 trigger_level='ERROR', capacity: int = 100,
+                 key: str = None, max_keys: int = 100,
+                 max_bytes: int = 1_000_000):
+        """
+        :param target: str|logging.Handler - the handler (or the name of
+                       handler from the profile) which gets the records
+        :param trigger_level: int|str - the level which sends the buffer
+        :param capacity: int - max number of records in one ring
+        :param key: str - name of metadata, the records are buffered per its
+                    value (default: per logger)
+        :param max_keys: int - max number of rings, the least recently used
+                         rings are forgotten
+        :param max_bytes: int - max estimated size of all buffered records,
+                          the oldest records of the least recently used rings
+                          are forgotten first
+        """
+        super().__init__()
+        self.target = target
+        self.trigger_level = get_level(trigger_level)
+        self.capacity = capacity
+        self.key = key
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        # key: deque([(size, snapshot)])
+        self.__rings = OrderedDict()
+        self.__bytes = 0
+
+    def get_target(self) -> logging.Handler:
+        if isinstance(self.target, str):
+            # The target can be defined after this handler in the profile.
+            from .logger import Logger
+            target = Logger.manager.get_handler(self.target)
+            if target is None:
+                raise ValueError(f'The handler "{self.target}" does not '
+                                 f'exist.')
+            self.target = target
+        return self.target
+
+    def __ring_key(self, record):
+        if self.key:
+            val = getattr(record, 'meta', {}).get(self.key)
+            if val is not None:
+                return val
+        return record.name
+
+    def snapshot(self, record) -> tuple:
+        """
+        Return the compact copy of the record and its estimated size.
+        """
+        snapshot = copy.copy(record)
+        snapshot.msg = record.getMessage()
+        snapshot.args = None
+        if record.exc_info:
+            if not snapshot.exc_text:
+                fmt = self.formatter or _exception_formatter
+                snapshot.exc_text = fmt.formatException(record.exc_info)
+            snapshot.exc_info = None
+        size = self.record_overhead + len(snapshot.msg)
+        for text in (snapshot.exc_text, snapshot.stack_info):
+            if text:
+                size += len(text)
+        return size, snapshot
+
+    def __forget(self, key):
+        for size, _ in self.__rings.pop(key):
+            self.__bytes -= size
+
+    def __buffer(self, key, record):
+        ring = self.__rings.get(key)
+        if ring is None:
+            ring = self.__rings[key] = deque()
+            if len(self.__rings) > self.max_keys:
+                self.__forget(next(iter(self.__rings)))
+        else:
+            self.__rings.move_to_end(key)
+        if len(ring) >= self.capacity:
+            self.__bytes -= ring.popleft()[0]
+        item = self.snapshot(record)
+        ring.append(item)
+        self.__bytes += item[0]
+        # The budget: the oldest records of the least recently used rings
+        # are forgotten (the new record is kept).
+        while self.__bytes > self.max_bytes:
+            oldest_key = next(iter(self.__rings))
+            oldest = self.__rings[oldest_key]
+            if oldest is ring and len(ring) == 1:
+                break
+            self.__bytes -= oldest.popleft()[0]
+            if not oldest:
+                del self.__rings[oldest_key]
+
+    def emit(self, record):
+        try:
+            key = self.__ring_key(record)
+            if record.levelno < self.trigger_level:
+                self.__buffer(key, record)
+                return
+            target = self.get_target()
+            ring = self.__rings.get(key)
+            if ring is not None:
+                self.__forget(key)
+                for _, buffered in ring:
+                    target.handle(buffered)
+            target.handle(record)
+        except Exception:
+            self.handleError(record)
+
+    def buffered(self) -> int:
+        """Number of buffered records."""
+        return sum(len(ring) for ring in self.__rings.values())
+
+    def buffered_bytes(self) -> int:
+        """Estimated size of buffered records."""
+        return self.__bytes
+
+    def flush(self):
+        """
+        The buffered records are sent only by the trigger record, this
+        flushes only the target.
+        """
+        if not isinstance(self.target, str):
+            self.target.flush()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.__rings.clear()
+            self.__bytes = 0
+        finally:
+            self.release()
+        super().close()
@@ -1,11 +1,36 @@
 import abc
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
+
+
+class ApiResponse(tuple):
+    """
+    The response of Api call. It is tuple (status_code, msg), so it can be
+    unpacked as before, and the response headers are in the attribute
+    `headers` (dict with lower-case keys).
+    """
+
+    def __new__(cls, status_code: Optional[int], msg: str,
+                headers: dict = None):
+        obj = super().__new__(cls, (status_code, msg))
+        obj.headers = {key.lower(): val
+                       for key, val in (headers or {}).items()}
+        return obj
+
+    @property
+    def status_code(self) -> Optional[int]:
+        return self[0]
+
+    @property
+    def msg(self) -> str:
+        return self[1]
 
 
 class HttpApiCallInterface(abc.ABC):
     """
     This is only class Interface for Api call.
+    The attribute `timeout` is the limit (in seconds) of one request.
     """
+    timeout = None
 
     @abc.abstractmethod
     def __init__(self, auth: Optional[Tuple[str, str]] = None,
@@ -13,5 +38,18 @@ class HttpApiCallInterface(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def send_json(self, url: str, data: dict, method='POST') -> (int, str):
+    def send_json(self, url: str, data: Union[dict, bytes],
+                  method='POST', headers: dict = None) -> (int, str):
+        """
+        :param data: dict|bytes - bytes are already encoded json
+        :param headers: dict - extra request headers (e.g. X-Scope-OrgID)
+        :return: ApiResponse|(status_code, msg)
+        """
+        pass
+
+    def after_fork(self):
+        """
+        Forget the state inherited from the parent process (e.g. open
+        connections). It is called in the child process after `os.fork`.
+        """
         pass
@@ -4,9 +4,9 @@ import ssl
 import aiohttp
 import aiohttp.client_exceptions
 
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 
-from loggate.http import HttpApiCallInterface
+from loggate.http import HttpApiCallInterface, ApiResponse
 
 
 class AIOApiCall(HttpApiCallInterface):
@@ -17,9 +17,8 @@ class AIOApiCall(HttpApiCallInterface):
 
     def __init__(self, auth: Optional[Tuple[str, str]] = None,
                  timeout: int = None, ssl_verify=True):
-        self.__timeout = aiohttp.ClientTimeout(
-            total=int(timeout) if timeout else 5
-        )
+        self.timeout = int(timeout) if timeout else 5
+        self.__timeout = aiohttp.ClientTimeout(total=self.timeout)
 
         self.headers = {
             'Content-Type': 'application/json; charset=utf-8'
@@ -33,8 +32,8 @@ class AIOApiCall(HttpApiCallInterface):
             self.ctx.check_hostname = False
             self.ctx.verify_mode = ssl.CERT_NONE
 
-    async def send_json(self, url: str, data: dict,
-                        method='POST') -> (int, str):
+    async def send_json(self, url: str, data: Union[dict, bytes],
+                        method='POST', headers: dict = None) -> (int, str):
         """
         This makes asyncio request to server
         """
@@ -47,8 +46,15 @@ class AIOApiCall(HttpApiCallInterface):
                 fce = session.get
             else:
                 return 0, "The method is not supported"
+            if isinstance(data, bytes):
+                kwargs = {'data': data}
+            else:
+                kwargs = {'json': data}
+            if headers:
+                kwargs['headers'] = headers
             try:
-                async with fce(url, json=data, ssl=self.ctx) as resp:
-                    return resp.status, await resp.text()
+                async with fce(url, ssl=self.ctx, **kwargs) as resp:
+                    return ApiResponse(resp.status, await resp.text(),
+                                       getattr(resp, 'headers', None))
             except aiohttp.client_exceptions.ClientError as ex:
-                return 1000, str(ex)
+                return ApiResponse(1000, str(ex))
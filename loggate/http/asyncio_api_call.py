@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import json
+import ssl
+from typing import Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from loggate.http import HttpApiCallInterface, ApiResponse
+
+
+class AsyncioApiCall(HttpApiCallInterface):
+    """
+    The asyncio API call without any other dependencies.
+    This is minimal HTTP/1.1 client built on `asyncio.open_connection`,
+    it keeps idle connections alive (pool per host) and never blocks
+    the event loop.
+    """
+
+    # Max number of idle connections per host
+    max_idle_connections = 4
+
+    def __init__(self, auth: Optional[Tuple[str, str]] = None,
+                 timeout: int = None, ssl_verify=True):
+        self.timeout = float(timeout) if timeout else 5
+        self.headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Connection': 'keep-alive',
+        }
+        if auth:
+            auth64 = base64.b64encode(f'{auth[0]}:{auth[1]}'
+                                      .encode('utf8')).decode()
+            self.headers['Authorization'] = f'Basic {auth64}'
+        self.ctx = ssl.create_default_context()
+        if not ssl_verify:
+            self.ctx.check_hostname = False
+            self.ctx.verify_mode = ssl.CERT_NONE
+        # {(scheme, host, port): [(reader, writer)]}
+        self.__idle = {}
+        self.__loop = None
+
+    def __pool(self, key) -> list:
+        loop = asyncio.get_running_loop()
+        if self.__loop is not loop:
+            # Connections can not be shared between loops.
+            self.__idle = {}
+            self.__loop = loop
+        return self.__idle.setdefault(key, [])
+
+    async def __connect(self, key):
+        scheme, host, port = key
+        return await asyncio.open_connection(
+            host, port,
+            ssl=self.ctx if scheme == 'https' else None
+        )
+
+    @staticmethod
+    def __close_connection(writer):
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close all idle connections."""
+        for connections in self.__idle.values():
+            for _, writer in connections:
+                self.__close_connection(writer)
+        self.__idle = {}
+
+    def after_fork(self):
+        # The connections belong to the parent, we must not close them.
+        self.__idle = {}
+        self.__loop = None
+
+    @staticmethod
+    async def __read_body(reader, method: str, status_code: int,
+                          headers: dict) -> Tuple[bytes, bool]:
+        """
+        Read the body of response (RFC 7230 section 3.3.3).
+        :return: (body, the body is delimited - the connection can be reused)
+        """
+        if method == 'HEAD' or status_code < 200 or \
+                status_code in (204, 304):
+            # The response without body (e.g. Loki responds 204 without
+            # Content-Length).
+            return b'', True
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # trailer
+                    while (await reader.readline()) not in (b'\r\n', b''):
+                        pass
+                    return body, True
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+        if 'content-length' in headers:
+            length = int(headers['content-length'])
+            return await reader.readexactly(length), True
+        # The body is delimited by closing of the connection.
+        return await reader.read(), False
+
+    async def __request(self, reader, writer, method: str, request: bytes):
+        """
+        :return: (status_code, body, headers, keep_alive)
+        """
+        writer.write(request)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        version, status_code = status_line.decode('latin-1').split(' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, val = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = val.strip()
+        status_code = int(status_code)
+        body, delimited = await self.__read_body(reader, method, status_code,
+                                                 headers)
+        keep_alive = delimited and version == 'HTTP/1.1' and \
+            headers.get('connection', '').lower() != 'close'
+        return status_code, body, headers, keep_alive
+
+    async def __send(self, key, method: str, request: bytes) -> ApiResponse:
+        pool = self.__pool(key)
+        while True:
+            reused = bool(pool)
+            if reused:
+                reader, writer = pool.pop()
+            else:
+                reader, writer = await self.__connect(key)
+            try:
+                status_code, body, headers, keep_alive = \
+                    await self.__request(reader, writer, method, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.__close_connection(writer)
+                if reused:
+                    # The idle connection was closed by server, try new one.
+                    continue
+                raise
+            except BaseException:
+                self.__close_connection(writer)
+                raise
+            if keep_alive and len(pool) < self.max_idle_connections:
+                pool.append((reader, writer))
+            else:
+                self.__close_connection(writer)
+            return ApiResponse(status_code,
+                               body.decode('utf-8', errors='replace'),
+                               headers)
+
+    async def send_json(self, url: str, data: Union[dict, bytes],
+                        method='POST', headers: dict = None) -> (int, str):
+        """
+        This makes asyncio request to server
+        """
+        if method not in ('POST', 'GET'):
+            return ApiResponse(0, "The method is not supported")
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        headers = dict(self.headers, **(headers or {}))
+        headers['Host'] = parts.netloc.rpartition('@')[2]
+        headers['Content-Length'] = str(len(data))
+        request = f'{method} {path} HTTP/1.1\r\n' + \
+            ''.join(f'{key}: {val}\r\n' for key, val in headers.items()) + \
+            '\r\n'
+        try:
+            return await asyncio.wait_for(
+                self.__send((scheme, parts.hostname, port), method,
+                            request.encode('latin-1') + data),
+                timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            return ApiResponse(1000, "Timeout")
+        except (OSError, asyncio.IncompleteReadError, ValueError) as ex:
+            return ApiResponse(1000, str(ex))
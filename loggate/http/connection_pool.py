@@ -0,0 +1,116 @@
+import http.client
+import os
+import socket
+import ssl
+from threading import Lock
+from urllib.parse import urlsplit
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP connections (`http.client`).
+    The idle connections are shared per host, one connection is used only
+    by one thread at the same time.
+    """
+
+    # Max number of idle connections per host
+    max_idle_connections = 4
+
+    def __init__(self):
+        # {(scheme, host, port, verify_mode, check_hostname): [connection]}
+        self.__idle = {}
+        self.__lock = Lock()
+
+    @staticmethod
+    def __key(parts, ctx: ssl.SSLContext):
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        if scheme != 'https':
+            return scheme, parts.hostname, port, None, None
+        return scheme, parts.hostname, port, ctx.verify_mode, \
+            ctx.check_hostname
+
+    def __acquire(self, key, timeout, ctx):
+        with self.__lock:
+            connections = self.__idle.get(key)
+            if connections:
+                connection = connections.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        scheme, host, port = key[:3]
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=timeout,
+                                               context=ctx), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def __release(self, key, connection):
+        with self.__lock:
+            connections = self.__idle.setdefault(key, [])
+            if len(connections) < self.max_idle_connections:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def request(self, method: str, url: str, body: bytes, headers: dict,
+                timeout: float, ctx: ssl.SSLContext):
+        """
+        :return: (status_code, body, headers)
+        """
+        parts = urlsplit(url)
+        key = self.__key(parts, ctx)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        while True:
+            connection, reused = self.__acquire(key, timeout, ctx)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                connection.close()
+                if reused:
+                    # The idle connection was closed by server, try new one.
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self.__release(key, connection)
+            return response.status, data, dict(response.getheaders())
+
+    def after_fork(self):
+        """
+        Forget the connections inherited from the parent process (they are
+        still used by the parent) and the lock (it can be held by a thread,
+        which does not exist in the child).
+        """
+        self.__lock = Lock()
+        self.clear(close=False)
+
+    def clear(self, close: bool = True):
+        """
+        Drop all idle connections.
+        :param close: bool - False only forgets them (e.g. inherited sockets)
+        """
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+        if close:
+            for connections in idle.values():
+                for connection in connections:
+                    try:
+                        connection.close()
+                    except (OSError, socket.error):
+                        pass
+
+
+# The pool shared by all keep-alive API clients in the process.
+shared_pool = ConnectionPool()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=shared_pool.after_fork)
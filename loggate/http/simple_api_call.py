@@ -3,20 +3,24 @@ import json
 import ssl
 import socket
 import urllib.request
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 
-from loggate.http import HttpApiCallInterface
+from loggate.http import HttpApiCallInterface, ApiResponse
+from loggate.http.connection_pool import shared_pool
 
 
 class SimpleApiCall(HttpApiCallInterface):
     """
     This is the simplest way how we can do API call without any other
     dependencies.
+    With `keep_alive` the connections are kept open in the pool shared
+    per host by all clients in the process.
     """
 
     def __init__(self, auth: Optional[Tuple[str, str]] = None,
-                 timeout: int = None, ssl_verify=True):
+                 timeout: int = None, ssl_verify=True, keep_alive=False):
         self.timeout = int(timeout) if timeout else 10
+        self.keep_alive = keep_alive
         # auth
         self.__auth = None
         if auth:
@@ -27,23 +31,56 @@ class SimpleApiCall(HttpApiCallInterface):
             self.ctx.check_hostname = False
             self.ctx.verify_mode = ssl.CERT_NONE
 
-    def send_json(self, url: str, data: dict, method='POST') -> (int, str):
-        json_data = json.dumps(data).encode('utf-8')
+    def send_json(self, url: str, data: Union[dict, bytes],
+                  method='POST', headers: dict = None) -> (int, str):
+        if isinstance(data, bytes):
+            json_data = data
+        else:
+            json_data = json.dumps(data).encode('utf-8')
+        if self.keep_alive:
+            return self.__send_keep_alive(url, json_data, method, headers)
         request = urllib.request.Request(url, data=json_data, method=method)
         request.add_header('Content-Type', 'application/json; charset=utf-8')
         request.add_header('Content-Length', len(json_data))
         if self.__auth:
             request.add_header("Authorization", "Basic %s" % self.__auth)
+        for key, val in (headers or {}).items():
+            request.add_header(key, val)
         try:
             resp = urllib.request.urlopen(
                 request,
                 timeout=self.timeout,
                 context=self.ctx
             )
-            return resp.status, resp.read().decode()
+            return ApiResponse(resp.status, resp.read().decode(),
+                               getattr(resp, 'headers', None))
         except urllib.error.HTTPError as ex:
-            return ex.status, ex.read().decode()
+            return ApiResponse(ex.status, ex.read().decode(), ex.headers)
         except socket.timeout:
-            return 1000, "Timeout"
+            return ApiResponse(1000, "Timeout")
         except Exception as ex:
-            return None, "Unknown error: {0}".format(ex)
+            return ApiResponse(None, "Unknown error: {0}".format(ex))
+
+    def after_fork(self):
+        if self.keep_alive:
+            shared_pool.after_fork()
+
+    def __send_keep_alive(self, url: str, data: bytes, method: str,
+                          extra_headers: dict = None):
+        headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Content-Length': str(len(data)),
+        }
+        if self.__auth:
+            headers['Authorization'] = "Basic %s" % self.__auth
+        if extra_headers:
+            headers.update(extra_headers)
+        try:
+            status_code, body, headers = shared_pool.request(
+                method, url, data, headers, self.timeout, self.ctx
+            )
+            return ApiResponse(status_code, body.decode(), headers)
+        except socket.timeout:
+            return ApiResponse(1000, "Timeout")
+        except Exception as ex:
+            return ApiResponse(None, "Unknown error: {0}".format(ex))
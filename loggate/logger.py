@@ -3,8 +3,10 @@ import importlib
 import logging
 import os
 import sys
+import time
 
 from . import get_level
+from .meta import MetaView, MetaLayer, _context_meta
 
 _srcfile = os.path.normcase(logging.addLevelName.__code__.co_filename)
 
@@ -66,14 +68,20 @@ class LogRecord(logging.LogRecord):
     """
     Overwrite original logging.LogRecord.
     :param meta: dict - metadata parameter
+    The attribute `created_ns` is the creation time in nanoseconds
+    (`created` is float and loses the precision).
     """
     def __init__(self, name, level, pathname, lineno, msg, args, exc_info,
                  func=None, sinfo=None, meta=None, **kwargs):
+        created_ns = time.time_ns()
         super(LogRecord, self).__init__(
             name, level, pathname, lineno,
             msg, args, exc_info, func, sinfo, **kwargs
         )
-        self.meta = meta if meta else {}
+        self.created_ns = created_ns
+        self.created = created_ns / 1e9
+        self.msecs = (created_ns % 1_000_000_000) // 1_000_000 + 0.0
+        self.meta = meta if meta is not None else {}
 
     def __copy__(self):
         cp = type(self)(level=self.levelno, **self.__dict__)
@@ -96,7 +104,19 @@ class Logger(logging.Logger):
 
     def __init__(self, name, level=logging.NOTSET, meta=None):
         super(Logger, self).__init__(name, level)
-        self.meta = meta if meta else {}
+        self.meta = meta
+
+    @property
+    def meta(self) -> MetaLayer:
+        """
+        The metadata of the logger. The records share its read-only
+        snapshot, the change creates new one.
+        """
+        return self.__meta
+
+    @meta.setter
+    def meta(self, meta: dict):
+        self.__meta = MetaLayer(meta)
 
     def makeRecord(self, name, level, fn, lno, msg, args, exc_info,
                    func=None, extra=None, sinfo=None, meta=None, **kwargs):
@@ -139,10 +159,10 @@ class Logger(logging.Logger):
                 exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
             elif not isinstance(exc_info, tuple):
                 exc_info = sys.exc_info()
-        merge_meta = self.manager.meta.copy()
-        merge_meta.update(self.meta)
-        if meta:
-            merge_meta.update(meta)
+        # The layers are not merged (the metadata of the call is the top).
+        merge_meta = MetaView(_context_meta.get(), self.meta.frozen,
+                              self.manager.meta.frozen,
+                              top=dict(meta) if meta else None)
         record = self.makeRecord(self.name, level, fn, lno, msg, args,
                                  exc_info, func, extra, sinfo, meta=merge_meta,
                                  **kwargs)
@@ -185,13 +205,22 @@ class Manager(logging.Manager):
 
     def __init__(self, rootnode):
         super(Manager, self).__init__(rootnode)
-        self.meta = {}
+        self.meta = None
         self.__profiles = {}
         self.__filters = {}
         self.__formatters = {}
         self.__handlers = {}
         self.__current_profile_name = None
 
+    @property
+    def meta(self) -> MetaLayer:
+        """The metadata of all loggers (see `Logger.meta`)."""
+        return self.__meta
+
+    @meta.setter
+    def meta(self, meta: dict):
+        self.__meta = MetaLayer(meta)
+
     def getLogger(self, name: str, meta: dict = None) -> Logger:
         """
         We can update logger metadata by optional parameter meta.
@@ -238,12 +267,14 @@ class Manager(logging.Manager):
                 root.propagate = True
                 root.disabled = False
                 root.handlers = []
+                root.filters = []
                 for logger in self.loggerDict.values():
                     if not isinstance(logger, logging.PlaceHolder):
                         logger.setLevel(logging.NOTSET)
                         logger.propagate = True
                         logger.disabled = False
                         logger.handlers = []
+                        logger.filters = []
         finally:
             logging._lock.release()
 
@@ -270,17 +301,18 @@ class Manager(logging.Manager):
                 _formatter_class = dynamic_import(_formatter_class)
                 handler.setFormatter(_formatter_class(**attr_formatter))
         for attr_filter in attr_filters:
-            if isinstance(attr_filter, str):
-                # reference to filter
-                handler.addFilter(self.__filters[attr_filter])
-            else:
-                # one shot formatter
-                _filter_class = \
-                    attr_formatter.pop('class', 'logging.Filter')
-                _filter_class = dynamic_import(_filter_class)
-                handler.addFilter(_filter_class(**attr_filter))
+            handler.addFilter(self.__get_filter(attr_filter))
         return handler
 
+    def __get_filter(self, attr_filter):
+        if isinstance(attr_filter, str):
+            # reference to filter
+            return self.__filters[attr_filter]
+        # one shot filter
+        _filter_class = attr_filter.pop('class', 'logging.Filter')
+        _filter_class = dynamic_import(_filter_class)
+        return _filter_class(**attr_filter)
+
     def __setup_logger(self, logger, attrs):
         if 'level' in attrs:
             logger.setLevel(get_level(attrs.get('level')))
@@ -291,6 +323,10 @@ class Manager(logging.Manager):
         meta = attrs.get('meta')
         if meta:
             logger.meta = meta
+        # The filters of logger reject records before they are copied
+        # for handlers and formatted.
+        for attr_filter in attrs.get('filters', []):
+            logger.addFilter(self.__get_filter(attr_filter))
         for handler in attrs.get('handlers', []):
             if isinstance(handler, dict):
                 logger.addHandler(self.__create_handler_from_schema(handler))
@@ -1,5 +1,9 @@
-from .handlers import LokiThreadHandler, LokiAsyncioHandler, LokiHandler
+from .handlers import LokiThreadHandler, LokiAsyncioHandler, LokiHandler, \
+    LokiProcessHandler, LokiDatagramHandler, LokiTenantHandler
 from .formatters import LokiLogFormatter
 from .emitters import LOKI_DEPLOY_STRATEGIES, \
     LOKI_DEPLOY_STRATEGY_ALL, LOKI_DEPLOY_STRATEGY_RANDOM, \
     LOKI_DEPLOY_STRATEGY_FALLBACK
+from .backpressure import OVERFLOW_POLICIES, OVERFLOW_DROP_NEWEST, \
+    OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK, OVERFLOW_LEVEL_AWARE, \
+    OVERFLOW_DOWNSAMPLE
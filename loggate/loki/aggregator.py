@@ -0,0 +1,339 @@
+import json
+import logging
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+import weakref
+from threading import Thread, Lock, Event
+
+from loggate.logger import LoggingException, LogRecord
+
+try:
+    import fcntl
+except ImportError:     # pragma: no cover
+    fcntl = None
+
+# The frame is the encoded Loki payload prefixed by its length.
+FRAME_HEADER = struct.Struct('!I')
+
+
+class LokiAggregatorError(LoggingException): pass       # noqa: E701
+
+
+# Living aggregators, they are reset in the child process after fork.
+_aggregators = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for aggregator in list(_aggregators):
+        aggregator.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class LokiAggregator:
+    """
+    Host-wide aggregation of Loki pushes over the Unix domain socket.
+    One process on the host receives the encoded entries of all other
+    processes and pushes them to Loki in big batches. It is the standalone
+    loggate process (`python -m loggate.loki.aggregator`) or the worker
+    elected by the lock file (`<path>.lock`), the lock is released by
+    the death of the process, so another worker takes over.
+    The other processes only forward their batches. When the aggregator
+    is not available, they push to Loki directly.
+    """
+
+    # Max size of one frame (in bytes)
+    max_frame_size = 16 * 1024 * 1024
+    # How long (in seconds) the worker waits for the aggregator
+    send_timeout = 1
+    # Min pause (in seconds) between attempts to connect or to be elected
+    retry_interval = 1
+
+    def __init__(self, path: str, handler, elect: bool = True):
+        """
+        :param path: str - path of the Unix domain socket
+        :param handler: LokiHandlerBase - the received records are pushed
+                        by this handler (when this process is aggregator)
+        :param elect: bool - this process can become the aggregator
+        """
+        self.path = path
+        self.handler = handler
+        self.elect = elect
+        self.is_server = False
+        # Number of batches forwarded to the aggregator
+        self.forwarded = 0
+        # Number of records received from other processes
+        self.received = 0
+        self.__lock = Lock()
+        self.__sock = None
+        self.__next_try = 0
+        self.__listener = None
+        self.__lock_fd = None
+        self.__thread = None
+        self.__stop = Event()
+        _aggregators.add(self)
+
+    def forward(self, data: bytes) -> bool:
+        """
+        Send the encoded payload to the aggregator.
+        :return: bool - False if the caller has to push it to Loki itself
+        """
+        frame = FRAME_HEADER.pack(len(data)) + data
+        with self.__lock:
+            reconnect = self.__sock is not None
+            while not self.is_server:
+                if self.__sock is None and not self.__connect():
+                    return False
+                try:
+                    self.__sock.sendall(frame)
+                    self.forwarded += 1
+                    return True
+                except OSError:
+                    # The aggregator is gone (or too slow), the frame can be
+                    # incomplete, so the connection is not usable anymore.
+                    self.__disconnect()
+                if not reconnect:
+                    break
+                # The new aggregator can be there (or we can be elected).
+                reconnect = False
+                self.__next_try = 0
+            return False
+
+    def __connect(self) -> bool:
+        now = time.monotonic()
+        if now < self.__next_try:
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.send_timeout)
+        try:
+            sock.connect(self.path)
+            self.__sock = sock
+            return True
+        except OSError:
+            sock.close()
+        if self.elect and self.__acquire_lock():
+            self.__serve()
+            return False
+        self.__next_try = now + self.retry_interval
+        return False
+
+    def __disconnect(self):
+        if self.__sock is not None:
+            try:
+                self.__sock.close()
+            except OSError:
+                pass
+            self.__sock = None
+            self.__next_try = time.monotonic() + self.retry_interval
+
+    def __acquire_lock(self) -> bool:
+        if fcntl is None:
+            return False
+        fd = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.__lock_fd = fd
+        return True
+
+    def serve(self):
+        """
+        Make this process the aggregator (e.g. the standalone process).
+        """
+        with self.__lock:
+            if self.is_server:
+                return
+            if not self.__acquire_lock():
+                raise LokiAggregatorError(
+                    f'The aggregator of {self.path} is already running.'
+                )
+            self.__disconnect()
+            self.__serve()
+
+    def __serve(self):
+        try:
+            # The socket file of the previous (dead) aggregator.
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(128)
+        listener.setblocking(False)
+        self.__listener = listener
+        self.is_server = True
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, args=(listener,),
+                               name='loggate-aggregator', daemon=True)
+        self.__thread.start()
+
+    def __run(self, listener):
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        buffers = {}
+        try:
+            while not self.__stop.is_set():
+                for key, _ in selector.select(timeout=1):
+                    if key.fileobj is listener:
+                        try:
+                            conn, _ = listener.accept()
+                        except OSError:
+                            continue
+                        conn.setblocking(False)
+                        selector.register(conn, selectors.EVENT_READ)
+                        buffers[conn] = bytearray()
+                        continue
+                    conn = key.fileobj
+                    try:
+                        chunk = conn.recv(65536)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        chunk = b''
+                    buffer = buffers[conn]
+                    buffer += chunk
+                    if not chunk or not self.__frames(buffer):
+                        selector.unregister(conn)
+                        del buffers[conn]
+                        conn.close()
+        finally:
+            for conn in buffers:
+                conn.close()
+            selector.close()
+
+    def __frames(self, buffer: bytearray) -> bool:
+        """
+        Receive all complete frames from the buffer.
+        :return: bool - False if the stream is broken
+        """
+        while len(buffer) >= FRAME_HEADER.size:
+            size, = FRAME_HEADER.unpack_from(buffer)
+            if size > self.max_frame_size:
+                if sys.stderr:
+                    sys.stderr.write(f"[LOKI ERROR]\nThe aggregator frame is "
+                                     f"too large ({size} B).\n")
+                return False
+            end = FRAME_HEADER.size + size
+            if len(buffer) < end:
+                break
+            frame = bytes(buffer[FRAME_HEADER.size:end])
+            del buffer[:end]
+            try:
+                self.__receive(json.loads(frame))
+            except (ValueError, TypeError, KeyError, IndexError) as ex:
+                if sys.stderr:
+                    sys.stderr.write(f"[LOKI ERROR]\nThe aggregator frame is "
+                                     f"invalid: {ex}\n")
+        return True
+
+    def __receive(self, payload: dict):
+        for stream in payload['streams']:
+            labels = stream['stream']
+            level = logging.getLevelName(
+                str(labels.get(self.handler.level_tag, 'info')).upper()
+            )
+            for value in stream['values']:
+                record = LogRecord(
+                    labels.get(self.handler.logger_tag, 'loggate.aggregator'),
+                    level if isinstance(level, int) else logging.INFO,
+                    '', 0, value[1], (), None
+                )
+                record.created_ns = int(value[0])
+                record.created = record.created_ns / 1e9
+                # The entry is already prepared by the sender.
+                record.loki_entry = {'stream': labels, 'values': [value]}
+                self.received += 1
+                self.handler.emit(record)
+
+    def close(self):
+        """Stop the aggregator (or disconnect from it)."""
+        with self.__lock:
+            self.__disconnect()
+            if not self.is_server:
+                return
+            self.__stop.set()
+            try:
+                # Wake up the server thread.
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+            except OSError:
+                pass
+            if self.__thread:
+                self.__thread.join()
+                self.__thread = None
+            self.__listener.close()
+            self.__listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            os.close(self.__lock_fd)
+            self.__lock_fd = None
+            self.is_server = False
+
+    def after_fork(self):
+        """
+        The child process is not the aggregator, even if the parent is.
+        It closes its copies of the inherited sockets and of the lock file
+        (the parent keeps them).
+        """
+        self.__lock = Lock()
+        self.__stop = Event()
+        self.__thread = None
+        for sock in (self.__sock, self.__listener):
+            if sock is not None:
+                sock.close()
+        self.__sock = None
+        self.__listener = None
+        if self.__lock_fd is not None:
+            os.close(self.__lock_fd)
+            self.__lock_fd = None
+        self.is_server = False
+        self.__next_try = 0
+
+
+def main(argv=None):
+    """
+    The standalone aggregator:
+    `python -m loggate.loki.aggregator SOCKET URL [URL ...]`
+    """
+    import argparse
+    from loggate.loki.handlers import LokiThreadHandler
+
+    parser = argparse.ArgumentParser(
+        prog='python -m loggate.loki.aggregator',
+        description='Push log records of all local processes to Loki.'
+    )
+    parser.add_argument('socket', help='path of the Unix domain socket')
+    parser.add_argument('urls', nargs='+', help='Loki entrypoints')
+    parser.add_argument('--strategy', default=None)
+    parser.add_argument('--send-interval', type=float, default=1)
+    parser.add_argument('--max-records-in-one-request', type=int, default=0)
+    args = parser.parse_args(argv)
+    handler = LokiThreadHandler(
+        urls=args.urls,
+        strategy=args.strategy,
+        send_interval=args.send_interval,
+        max_records_in_one_request=args.max_records_in_one_request,
+        aggregator_socket=args.socket,
+    )
+    handler.emitter.aggregator.serve()
+    try:
+        Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        handler.flush()
+        handler.close()
+
+
+if __name__ == '__main__':
+    main()
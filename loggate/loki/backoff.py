@@ -0,0 +1,62 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, List
+
+# Limit of honored Retry-After header (in seconds)
+MAX_RETRY_AFTER = 3600
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    Parse Retry-After header value (delay in seconds or HTTP date).
+    :return: float|None - number of seconds
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+    return min(max(0.0, seconds), MAX_RETRY_AFTER)
+
+
+class Backoff:
+    """
+    Full jitter exponential backoff.
+    The n-th wait is random value from interval <0, ceiling>, where ceiling is
+    `base * 2^n` (limited by `cap`) or n-th item of `schedule`
+    (the last item is used for all next attempts).
+    The jitter spreads retries of many processes, so recovered Loki is not
+    knocked over again.
+    """
+
+    def __init__(self, base: float = 1, cap: float = 120,
+                 schedule: List[float] = None):
+        self.base = base
+        self.cap = cap
+        self.schedule = schedule
+        self.attempt = 0
+
+    def ceiling(self) -> float:
+        if self.schedule:
+            return self.schedule[min(self.attempt, len(self.schedule) - 1)]
+        return min(self.cap, self.base * 2 ** min(self.attempt, 32))
+
+    def next(self, retry_after: float = None) -> float:
+        """
+        Return the next wait (in seconds).
+        :param retry_after: the server demands this minimal delay
+        """
+        delay = random.uniform(0, self.ceiling())
+        self.attempt += 1
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def reset(self):
+        self.attempt = 0
@@ -0,0 +1,186 @@
+import itertools
+import time
+from collections import deque
+from threading import Condition
+
+from loggate.loki.confirmation_queue import ConfirmatrionQueue
+
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_LEVEL_AWARE = 'level-aware'
+OVERFLOW_DOWNSAMPLE = 'downsample'
+
+OVERFLOW_POLICIES = [
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_BLOCK,
+    OVERFLOW_LEVEL_AWARE,
+    OVERFLOW_DOWNSAMPLE
+]
+
+# Lanes: DEBUG, INFO, WARNING, ERROR, CRITICAL and privileged records
+LANE_PRIVILEGED = 5
+
+
+def level_lane(levelno: int) -> int:
+    return min(4, max(0, levelno // 10 - 1))
+
+
+def record_lane(record, privileged=False) -> int:
+    if privileged:
+        return LANE_PRIVILEGED
+    return level_lane(getattr(record, 'levelno', 0))
+
+
+class BackpressureQueue(ConfirmatrionQueue):
+    """
+    The confirmation queue with the overflow policy:
+      - drop-newest: the new record is dropped (as `ConfirmatrionQueue`)
+      - drop-oldest: the oldest queued record is dropped
+      - block: the producer waits (max `block_timeout`) for free space,
+               then the new record is dropped
+      - level-aware: the oldest record of the lowest level, which is not
+                     higher than the level of the new record, is dropped
+                     (DEBUG before INFO before WARNING ...), the new record
+                     is dropped only if all queued records have got higher
+                     level
+      - downsample: over the watermark only every n-th record below WARNING
+                    is accepted, the full queue drops the new record
+    The records are kept in lanes per level (privileged records have got
+    own lane and they are never evicted), the order of records is kept by
+    the sequence number. With `priority_level` the records of this and
+    higher levels (and privileged records) jump ahead of the backlog.
+    All operations cost O(1) (number of lanes is constant).
+    """
+
+    # The downsampling starts at this fill of the queue
+    downsample_watermark = 0.8
+    # Over the watermark only every n-th record is accepted
+    downsample_rate = 10
+
+    def __init__(self, queue_size=0, policy: str = OVERFLOW_DROP_NEWEST,
+                 block_timeout: float = 1, priority_level: int = None):
+        """
+        :param queue_size: int - max size of queue (0 = unlimited)
+        :param policy: str - the overflow policy (see OVERFLOW_POLICIES)
+        :param block_timeout: float - the max wait of the producer
+                              (policy `block`)
+        :param priority_level: int - the records of this and higher levels
+                               are sent before the others (default: FIFO)
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'The overflow policy "{policy}" is not '
+                             f'supported.')
+        super().__init__(queue_size)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.__priority_lanes = None
+        if priority_level is not None:
+            self.__priority_lanes = range(level_lane(priority_level),
+                                          LANE_PRIVILEGED + 1)
+        self.__lanes = [deque() for _ in range(LANE_PRIVILEGED + 1)]
+        self.__size = 0
+        self.__sequence = itertools.count()
+        self.__sampled = 0
+        self.__cond = Condition()
+
+    def __head(self, lanes) -> int:
+        """Return the lane with the oldest record, or None."""
+        oldest = None
+        for lane in lanes:
+            items = self.__lanes[lane]
+            if not items:
+                continue
+            if oldest is None or items[0][0] < self.__lanes[oldest][0][0]:
+                oldest = lane
+        return oldest
+
+    def __evict(self, lane: int) -> bool:
+        if lane is None:
+            return False
+        _, item = self.__lanes[lane].popleft()
+        self.__size -= 1
+        self._drop(item)
+        return True
+
+    def __make_space(self, lane: int, limit: int) -> bool:
+        """
+        The queue is full, the policy makes space for the new record.
+        :return: bool - False if the new record has to be dropped
+        """
+        if self.policy == OVERFLOW_DROP_OLDEST:
+            return self.__evict(self.__head(range(LANE_PRIVILEGED)))
+        if self.policy == OVERFLOW_LEVEL_AWARE:
+            for it in range(min(lane + 1, LANE_PRIVILEGED)):
+                if self.__lanes[it]:
+                    return self.__evict(it)
+            return False
+        if self.policy == OVERFLOW_BLOCK:
+            deadline = time.monotonic() + self.block_timeout
+            while self.__size + len(self._in_process) >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.__cond.wait(remaining)
+            return True
+        return False
+
+    def put(self, item, privileged=False, block=True):
+        lane = record_lane(item, privileged)
+        limit = self._queue_privileged_size if privileged \
+            else self._queue_size
+        with self.__cond:
+            if limit > 0:
+                size = self.__size + len(self._in_process)
+                if size >= limit:
+                    if not self.__make_space(lane, limit):
+                        self._drop(item)
+                        return False
+                elif self.policy == OVERFLOW_DOWNSAMPLE and \
+                        lane < 2 and \
+                        size >= limit * self.downsample_watermark:
+                    self.__sampled += 1
+                    if self.__sampled % self.downsample_rate:
+                        self._drop(item)
+                        return False
+            self.__lanes[lane].append((next(self.__sequence), item))
+            self.__size += 1
+            self.__cond.notify_all()
+        return True
+
+    def gets(self, number: int = 1, block: bool = True,
+             timeout: bool = None) -> list:
+        with self.__cond:
+            if self._in_process:
+                return self._in_process.copy()
+            if block and not self.__size:
+                self.__cond.wait_for(lambda: self.__size, timeout)
+            if self.__priority_lanes:
+                self.__take(self.__priority_lanes, number)
+            self.__take(range(LANE_PRIVILEGED + 1), number)
+            return self._in_process.copy()
+
+    def __take(self, lanes, number: int):
+        """Move the oldest records of the lanes to the batch."""
+        while self.__size and len(self._in_process) < number:
+            lane = self.__head(lanes)
+            if lane is None:
+                return
+            _, item = self.__lanes[lane].popleft()
+            self.__size -= 1
+            self._in_process.append(item)
+
+    def confirm(self):
+        with self.__cond:
+            self._in_process = []
+            self.__cond.notify_all()
+
+    def clear(self):
+        self.__cond = Condition()
+        self.__lanes = [deque() for _ in range(LANE_PRIVILEGED + 1)]
+        self.__size = 0
+        self._in_process = []
+
+    def qsize(self):
+        return self.__size + len(self._in_process)
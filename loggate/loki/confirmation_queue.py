@@ -11,6 +11,8 @@ class ConfirmatrionQueue:
         if self._queue_privileged_size > 0 and \
                 self._queue_privileged_size == queue_size:
             self._queue_privileged_size += 2
+        # Number of dropped records per level name
+        self.dropped = {}
 
     @property
     def max_size(self):
@@ -19,10 +21,15 @@ class ConfirmatrionQueue:
     def put(self, item, privileged=False, block=True):
         qs = self._queue_privileged_size if privileged else self._queue_size
         if qs > 0 and self.qsize() >= qs:
+            self._drop(item)
             return False
         self.__queue.put(item, block=block)
         return True
 
+    def _drop(self, item):
+        level = getattr(item, 'levelname', 'NOTSET')
+        self.dropped[level] = self.dropped.get(level, 0) + 1
+
     def put_nowait(self, item, privileged=False):
         return self.put(item, privileged=privileged, block=False)
 
@@ -40,8 +47,17 @@ class ConfirmatrionQueue:
                     break
         return self._in_process.copy()
 
+    def clear(self):
+        """Drop all records (e.g. the copy inherited after fork)."""
+        self.__queue = SimpleQueue()
+        self._in_process = []
+
     def confirm(self):
         self._in_process = []
 
+    def is_ready(self, number: int) -> bool:
+        """Return True if there are records for the full batch."""
+        return self.qsize() >= number
+
     def qsize(self):
         return self.__queue.qsize() + len(self._in_process)
@@ -0,0 +1,187 @@
+import datetime
+import json
+import os
+import re
+import socket
+import time
+from threading import Thread, Event
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+DATAGRAM_FORMAT_RFC5424 = 'rfc5424'
+DATAGRAM_FORMAT_JSON = 'json'
+
+DATAGRAM_FORMATS = [
+    DATAGRAM_FORMAT_RFC5424,
+    DATAGRAM_FORMAT_JSON
+]
+
+# Structured data ID of the labels (32473 is the example enterprise number)
+DEFAULT_SD_ID = 'loki@32473'
+
+# facility user-level messages
+SYSLOG_FACILITY = 1
+
+_RFC5424 = re.compile(
+    rb'<(?P<pri>\d{1,3})>1 (?P<timestamp>\S+) (?P<host>\S+) (?P<app>\S+) '
+    rb'(?P<procid>\S+) (?P<msgid>\S+) (?P<sd>-|(?:\[(?:[^\]"\\]|"(?:[^"\\]|'
+    rb'\\.)*")*\])+)(?: (?P<msg>.*))?$',
+    re.DOTALL
+)
+_SD_PARAM = re.compile(rb'(\S+?)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_address(address: str) -> Tuple[int, object]:
+    """
+    Parse the address of the local agent.
+    :param address: str - `udp://host:port` or `unix:///path/to/socket`
+    :return: (socket family, socket address)
+    """
+    parts = urlsplit(address)
+    scheme = parts.scheme.lower()
+    if scheme == 'udp':
+        family, _, _, _, sockaddr = socket.getaddrinfo(
+            parts.hostname, parts.port, type=socket.SOCK_DGRAM
+        )[0]
+        return family, sockaddr
+    if scheme in ('unix', 'unixgram'):
+        return socket.AF_UNIX, parts.path
+    raise ValueError(f'The datagram address "{address}" is not supported.')
+
+
+def syslog_severity(levelno: int) -> int:
+    if levelno >= 50:
+        return 2
+    if levelno >= 40:
+        return 3
+    if levelno >= 30:
+        return 4
+    if levelno >= 20:
+        return 6
+    return 7
+
+
+def _sd_escape(val) -> str:
+    return str(val).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace(']', '\\]')
+
+
+def _sd_unescape(val: str) -> str:
+    return re.sub(r'\\(.)', r'\1', val)
+
+
+def encode_rfc5424(labels: dict, timestamp_ns: int, line: str,
+                   levelno: int = 20, hostname: str = '-',
+                   app_name: str = '-', procid=None,
+                   sd_id: str = DEFAULT_SD_ID) -> bytes:
+    """
+    Encode the entry to the syslog message (RFC 5424), the labels are
+    the structured data.
+    """
+    pri = SYSLOG_FACILITY * 8 + syslog_severity(levelno)
+    timestamp = datetime.datetime.fromtimestamp(
+        timestamp_ns // 1_000_000_000, tz=datetime.timezone.utc
+    ).replace(microsecond=timestamp_ns // 1000 % 1_000_000) \
+        .strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    sd = '-'
+    if labels:
+        sd = '[' + sd_id + ''.join(f' {key}="{_sd_escape(val)}"'
+                                   for key, val in labels.items()) + ']'
+    header = f'<{pri}>1 {timestamp} {hostname or "-"} {app_name or "-"} ' \
+             f'{procid or "-"} - {sd} '
+    return header.encode('utf-8') + line.encode('utf-8')
+
+
+def encode_json(labels: dict, timestamp_ns: int, line: str) -> bytes:
+    """Encode the entry to the JSON (the stream of Loki push API)."""
+    return json.dumps({'stream': labels,
+                       'values': [[str(timestamp_ns), line]]}).encode('utf-8')
+
+
+def decode_datagram(data: bytes) -> Tuple[dict, int, str]:
+    """
+    Decode the datagram (RFC 5424 or JSON).
+    :return: (labels, timestamp in ns, line)
+    """
+    if data.startswith(b'{'):
+        entry = json.loads(data)
+        timestamp, line = entry['values'][0]
+        return entry['stream'], int(timestamp), line
+    match = _RFC5424.match(data)
+    if not match:
+        raise ValueError('The datagram is not RFC 5424 syslog message.')
+    labels = {}
+    if match['sd'] != b'-':
+        labels = {key.decode(): _sd_unescape(val.decode())
+                  for key, val in _SD_PARAM.findall(match['sd'])}
+    timestamp = datetime.datetime.strptime(
+        match['timestamp'].decode(), '%Y-%m-%dT%H:%M:%S.%fZ'
+    ).replace(tzinfo=datetime.timezone.utc)
+    timestamp_ns = int(timestamp.timestamp()) * 1_000_000_000 + \
+        timestamp.microsecond * 1000
+    return labels, timestamp_ns, (match['msg'] or b'').decode('utf-8')
+
+
+class LocalDatagramReceiver:
+    """
+    The minimal local agent (for tests and benchmarks). It receives
+    datagrams of `LokiDatagramHandler` and keeps decoded entries
+    [(labels, timestamp in ns, line)].
+    """
+
+    def __init__(self, address: str = 'udp://127.0.0.1:0',
+                 keep_entries: bool = True):
+        """
+        :param address: str - `udp://host:port` or `unix:///path`
+        :param keep_entries: bool - False only counts the datagrams
+        """
+        family, sockaddr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.bind(sockaddr)
+        self.sock.settimeout(.2)
+        if family == socket.AF_UNIX:
+            self.address = f'unix://{sockaddr}'
+        else:
+            host, port = self.sock.getsockname()[:2]
+            self.address = f'udp://{host}:{port}'
+        self.keep_entries = keep_entries
+        self.entries: List[Tuple[dict, int, str]] = []
+        self.received = 0
+        self.errors = 0
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__run, daemon=True,
+                               name='loggate-datagram-receiver')
+        self.__thread.start()
+
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if self.keep_entries:
+                try:
+                    self.entries.append(decode_datagram(data))
+                except (ValueError, KeyError, IndexError, TypeError):
+                    self.errors += 1
+            self.received += 1
+
+    def wait_for(self, number: int, timeout: float = 2) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.received < number:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(.005)
+        return True
+
+    def close(self):
+        self.__stop.set()
+        self.__thread.join()
+        self.sock.close()
+        if self.sock.family == socket.AF_UNIX:
+            try:
+                os.unlink(urlsplit(self.address).path)
+            except OSError:
+                pass
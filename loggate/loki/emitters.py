@@ -1,15 +1,24 @@
 import asyncio
+import json
+import logging
+import os
 import time
+import weakref
 
 import random
-from threading import Thread, Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+from threading import Thread, Event, Lock, get_ident
 
 import sys
-from typing import List
+from typing import List, Tuple
 
-from loggate.http import HttpApiCallInterface
+from loggate.http import HttpApiCallInterface, ApiResponse
 from loggate.logger import LoggingException, LogRecord
+from loggate.loki.backoff import Backoff, parse_retry_after
 from loggate.loki.confirmation_queue import ConfirmatrionQueue
+from loggate.loki.health import EndpointHealth
 
 LOKI_DEPLOY_STRATEGY_ALL = 'all'
 LOKI_DEPLOY_STRATEGY_RANDOM = 'random'
@@ -21,9 +30,34 @@ LOKI_DEPLOY_STRATEGIES = [
     LOKI_DEPLOY_STRATEGY_FALLBACK
 ]
 
+# Living emitters, they are reset in the child process after fork.
+_emitters = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for emitter in list(_emitters):
+        emitter.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
 
 class LokiWrongDeployStrategy(LoggingException): pass       # noqa: E701
-class LokiServerError(LoggingException): pass  # noqa: E701
+
+
+class LokiServerError(LoggingException):
+    def __init__(self, msg, status_code=None, retry_after=None):
+        """
+        :param status_code: int|None - status code of the Loki response
+        :param retry_after: float|None - the delay demanded by the server
+        """
+        super().__init__(msg)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LokiRateLimitError(LokiServerError): pass                # noqa: E701
 
 
 class LokiEmitterV1:
@@ -34,26 +68,35 @@ class LokiEmitterV1:
 
     success_response_code = 204
     timeout_response_code = 1000
-
-    def __get_new_generator(self):
-        def generator():
-            for value in self.send_retry:
-                yield value
-
-            while True:
-                yield self.send_retry[-1]
-        return generator()
+    # Max number of batches kept for entrypoints which are behind the others
+    # (strategy `all`). The oldest batches are dropped for them.
+    max_journal_size = 100
+    rate_limit_response_code = 429
+    # Loki rejects these requests because of their content (entry too large,
+    # invalid labels, timestamp too old, ...), the batch is split to find
+    # the poison records.
+    poison_response_codes = (400, 413)
+    # Max number of streams with remembered last timestamp.
+    max_tracked_streams = 10000
+    # The limit (in seconds) of the extra pause between two sends,
+    # it grows when Loki responds 429.
+    max_throttle = 30
 
     def __init__(self, handler, urls, api: HttpApiCallInterface,
                  queue: ConfirmatrionQueue, strategy: str = None,
-                 send_retry=None):
+                 send_retry=None, dead_letter=None):
         """
         Loki Handler
         :param handler: LokiHandler
         :param urls: [str]|str loki entrypoints
                      (e.g. [http://127.0.0.1/loki/api/v1/push])
         :param strategy: str ('random', 'fallback', 'all')
-        :param send_retry: list|str interval of send retry (in seconds)
+        :param send_retry: list|str ceilings of send retry (in seconds),
+                           default is exponential backoff 1, 2, 4 ... 120s,
+                           the real wait is randomized (full jitter)
+        :param dead_letter: callable(record, reason)|logging.Handler - sink
+                            of the records rejected by Loki, they are only
+                            reported to stderr by default
         """
         if isinstance(urls, str):
             urls = [urls]
@@ -69,14 +112,56 @@ class LokiEmitterV1:
         self.handler = handler
         self.queue: ConfirmatrionQueue = queue
         self.api = api
-        if send_retry is None:
-            self.send_retry = [5, 5, 10, 10, 30, 30, 60, 60, 120]
-        elif isinstance(send_retry, str):
-            self.send_retry = [int(it) for it in send_retry.split(',')]
-        else:
-            self.send_retry = send_retry
+        if isinstance(send_retry, str):
+            send_retry = [float(it) for it in send_retry.split(',')]
+        self.send_retry = send_retry
+        self.backoff = Backoff(schedule=self.send_retry)
+        # The extra pause between two sends (reaction to 429)
+        self.throttle = 0.0
         self.thread = None
         self.thread_stop = Event()
+        self.__thread_wakeup = Event()
+        # One batch is sent by the worker or by the flush, never by both.
+        self.__lock = Lock()
+        self.__async_lock = None
+        # The shared delivery reactor (instead of own thread)
+        self.reactor = None
+        # The extra request headers (e.g. X-Scope-OrgID of the tenant)
+        self.headers = None
+        # The host-wide aggregator (LokiAggregator), the batches are
+        # forwarded to it instead of Loki.
+        self.aggregator = None
+        # asyncio mode: the task is bound lazily to the running loop
+        self.__asyncio_mode = False
+        self.__loop = None
+        self.__loop_thread = None
+        self.__task = None
+        self.__wakeup = None
+        self.__idle = False
+        self.__urgent = False
+        # The sending is restarted by the first record after fork.
+        self.__restart = None
+        # The pool of the fan-out threads (strategy `all`), it is created
+        # on the first use.
+        self.__executor = None
+        # The running send of each entrypoint {url: future}, the next send
+        # to the entrypoint waits until it is finished.
+        self.__in_flight = {}
+        # Delivery state: each entrypoint has got own cursor, it is sequence
+        # number of the last batch accepted by this entrypoint.
+        self.__sequence = 0
+        self.cursors = {url: 0 for url in self.urls}
+        # Batches accepted by some entrypoint, but not by all of them yet
+        # [(sequence, data)] (strategy `all`).
+        self.__journal = deque()
+        self.journal_dropped = 0
+        self.health = {url: EndpointHealth(url) for url in self.urls}
+        self.dead_letter = dead_letter
+        self.rejected = 0
+        # The last timestamp (in ns) of each stream, the timestamps of one
+        # stream have to strictly increase.
+        self.__last_timestamps = {}
+        _emitters.add(self)
 
     @property
     def entrypoint(self):
@@ -85,131 +170,829 @@ class LokiEmitterV1:
     def rotate_entrypoints(self):
         self.urls.append(self.urls.pop(0))
 
+    @property
+    def endpoint_timeout(self):
+        """The hard limit (in seconds) for one delivery to one entrypoint."""
+        return getattr(self.api, 'timeout', None)
+
+    def __timestamp(self, record, stream: dict) -> str:
+        """
+        Return the timestamp (in ns) of the record. The timestamps of one
+        stream are strictly increasing, even if records were created
+        in the same nanosecond or they were queued out of order
+        by more threads.
+        """
+        timestamp = getattr(record, 'created_ns', None) or \
+            int(record.created * 1e9)
+        try:
+            key = frozenset(stream.items())
+        except TypeError:
+            key = repr(sorted(stream.items()))
+        last = self.__last_timestamps.get(key)
+        if last is not None and timestamp <= last:
+            timestamp = last + 1
+        elif len(self.__last_timestamps) >= self.max_tracked_streams:
+            self.__last_timestamps.clear()
+        self.__last_timestamps[key] = timestamp
+        return str(timestamp)
+
+    def prepare_entry(self, record: LogRecord) -> dict:
+        """
+        Return the stream entry of the record. It is prepared only once,
+        the retries and the batch bisection reuse it.
+        """
+        entry = getattr(record, 'loki_entry', None)
+        if entry is None:
+            stream = self.handler.build_tags(record)
+            value = (self.__timestamp(record, stream),
+                     self.handler.format(record))
+            structured_metadata = self.handler.build_structured_metadata(
+                record
+            )
+            if structured_metadata:
+                # Loki 3: [timestamp, line, structured metadata]
+                value += (structured_metadata,)
+            entry = {
+                'stream': stream,
+                'values': [value]
+            }
+            record.loki_entry = entry
+        return entry
+
     def prepare_payload(self, records: List[LogRecord]):
-        data = []
-        for record in records:
-            data.append({
-                'stream': self.handler.build_tags(record),
-                'values': [(str(int(record.created * 1e9)),
-                            self.handler.format(record))]
-            })
-        return {'streams': data}
+        return {'streams': [self.prepare_entry(record)
+                            for record in records]}
+
+    @staticmethod
+    def encode_payload(payload: dict) -> bytes:
+        """
+        Serialize the payload only once, the result is shared by all sends.
+        """
+        return json.dumps(payload).encode('utf-8')
+
+    @property
+    def lagging_entrypoints(self) -> List[str]:
+        """The entrypoints, which have not got all batches yet."""
+        return [url for url in self.urls
+                if self.cursors[url] < self.__sequence]
+
+    def endpoints_state(self) -> List[dict]:
+        """The health of entrypoints (for inspection)."""
+        res = []
+        for url in self.urls:
+            state = self.health[url].as_dict()
+            state['cursor'] = self.cursors[url]
+            res.append(state)
+        return res
+
+    def __candidates(self):
+        """
+        Yield entrypoints for strategies `random` and `fallback`.
+        `random` prefers the fastest healthy entrypoint, `fallback` keeps
+        the configured order. Entrypoints with the open circuit are skipped.
+        It is generator, because the check of half-open circuit reserves
+        the probe.
+        """
+        urls = self.urls
+        if self.strategy == LOKI_DEPLOY_STRATEGY_RANDOM:
+            urls = sorted(urls, key=lambda url: self.health[url].score)
+        for url in urls:
+            if self.health[url].available():
+                yield url
+
+    def __unavailable(self):
+        return LokiServerError('All Loki entrypoints are unavailable '
+                               '(open circuit breakers).')
+
+    def __send(self, url: str, data: bytes) -> ApiResponse:
+        start = time.monotonic()
+        response = self.__send_json(url, data)
+        return self.__check_health(url, response, time.monotonic() - start)
+
+    def __send_json(self, url: str, data: bytes):
+        # The API clients without the headers support are still accepted.
+        if self.headers:
+            return self.api.send_json(url, data, headers=self.headers)
+        return self.api.send_json(url, data)
+
+    def __check_health(self, url, response, latency) -> ApiResponse:
+        if not isinstance(response, ApiResponse):
+            response = ApiResponse(*response)
+        if response.status_code == self.success_response_code:
+            self.health[url].success(latency)
+        elif response.status_code == self.rate_limit_response_code or \
+                response.status_code in self.poison_response_codes:
+            # The rate limit or the rejected content (also in the bisection)
+            # are not failures of the entrypoint.
+            self.health[url].release()
+        else:
+            self.health[url].failure(latency)
+        return response
+
+    def __error(self, responses: List[ApiResponse]) -> LokiServerError:
+        """
+        Create exception by the failed responses. 429 responses have got
+        the priority, Retry-After is the longest one.
+        """
+        if not responses:
+            return self.__unavailable()
+        retry_after = [parse_retry_after(res.headers.get('retry-after'))
+                       for res in responses]
+        retry_after = max((it for it in retry_after if it is not None),
+                          default=None)
+        limited = [res for res in responses
+                   if res.status_code == self.rate_limit_response_code]
+        response = limited[0] if limited else responses[-1]
+        msg = f'Loki API response status code: {response.status_code} ' \
+              f'"{response.msg}"'
+        if limited:
+            return LokiRateLimitError(msg, response.status_code, retry_after)
+        return LokiServerError(msg, response.status_code, retry_after)
+
+    def __pending(self, url: str, sequence: int, data: bytes):
+        """
+        Return all batches [(sequence, data)] the entrypoint has not got yet.
+        """
+        cursor = self.cursors[url]
+        return [item for item in self.__journal if item[0] > cursor] + \
+            [(sequence, data)]
+
+    def __deliver(self, url: str, pending: list):
+        """
+        Send pending batches to the entrypoint in order.
+        :return: (last delivered sequence, last response)
+        """
+        delivered, response = None, None
+        for sequence, data in pending:
+            response = self.__send(url, data)
+            if response.status_code != self.success_response_code:
+                break
+            delivered = sequence
+        return delivered, response
+
+    async def __deliver_async(self, url: str, pending: list):
+        delivered, response = None, None
+        for sequence, data in pending:
+            response = await self.__send_async(url, data)
+            if response.status_code != self.success_response_code:
+                break
+            delivered = sequence
+        return delivered, response
+
+    def __fan_out(self, targets: dict):
+        """
+        Deliver pending batches to all entrypoints in parallel
+        (strategy `all`).
+        :param targets: {url: [(sequence, data)]}
+        :return: {url: (last delivered sequence, last response)}
+        """
+        if len(targets) == 1:
+            return {url: self.__deliver(url, pending)
+                    for url, pending in targets.items()}
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=len(self.urls),
+                thread_name_prefix='loggate-fanout'
+            )
+        results = {}
+        futures = {}
+        try:
+            for url, pending in targets.items():
+                previous = self.__in_flight.get(url)
+                if previous is not None and not previous.done():
+                    # The previous send is still running (it is too slow),
+                    # the batches wait for the next turn.
+                    results[url] = (None, ApiResponse(
+                        self.timeout_response_code, 'Busy'
+                    ))
+                    continue
+                futures[url] = self.__in_flight[url] = \
+                    self.__executor.submit(self.__deliver, url, pending)
+        except RuntimeError:
+            # The interpreter is shutting down (e.g. flush at exit),
+            # the new threads can not be started.
+            return {url: self.__deliver(url, pending)
+                    for url, pending in targets.items()}
+        deadline = None
+        if self.endpoint_timeout:
+            deadline = time.monotonic() + self.endpoint_timeout * \
+                max(len(pending) for pending in targets.values())
+        for url, future in futures.items():
+            timeout = None
+            if deadline:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                results[url] = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # This entrypoint is too slow, we don't wait for it. The send
+                # is still running, it updates the health by itself.
+                results[url] = (None, ApiResponse(self.timeout_response_code,
+                                                  'Timeout'))
+            except Exception as ex:
+                results[url] = (None, ApiResponse(None,
+                                                  f'Unknown error: {ex}'))
+        return results
+
+    def __commit(self, sequence: int, data: bytes, results: dict):
+        """
+        Update cursors by results of the delivery (strategy `all`).
+        """
+        for url, (delivered, _) in results.items():
+            if delivered:
+                self.cursors[url] = delivered
+        if max(self.cursors.values()) < sequence:
+            # Nobody accepted the batch, it stays in the queue.
+            raise self.__error([res for delivered, res in results.values()
+                                if delivered != sequence])
+        self.__sequence = sequence
+        if self.lagging_entrypoints:
+            self.__journal.append((sequence, data))
+        lowest = min(self.cursors.values())
+        while self.__journal and self.__journal[0][0] <= lowest:
+            self.__journal.popleft()
+        while len(self.__journal) > self.max_journal_size:
+            dropped, _ = self.__journal.popleft()
+            self.journal_dropped += 1
+            for url, cursor in self.cursors.items():
+                self.cursors[url] = max(cursor, dropped)
+
+    def __targets(self, data: bytes) -> Tuple[int, dict]:
+        sequence = self.__sequence + 1
+        targets = {url: self.__pending(url, sequence, data)
+                   for url in self.urls if self.health[url].available()}
+        if not targets:
+            raise self.__unavailable()
+        return sequence, targets
+
+    def __accepted(self, url: str):
+        self.__sequence += 1
+        self.cursors[url] = self.__sequence
+
+    def __reject(self, record, url: str, response: ApiResponse):
+        """
+        Loki rejected this record, it is sent to the dead-letter sink.
+        """
+        if getattr(record, 'loki_rejected', None):
+            # Another entrypoint rejected it already (strategy `all`).
+            return
+        reason = f'{url}: {response.status_code} "{response.msg}"'
+        record.loki_rejected = reason
+        self.rejected += 1
+        try:
+            if self.dead_letter is None:
+                if sys.stderr:
+                    sys.stderr.write(f"[LOKI ERROR]\nThe log record was "
+                                     f"rejected {reason}: {record.msg}\n")
+            elif isinstance(self.dead_letter, logging.Handler):
+                self.dead_letter.handle(record)
+            else:
+                self.dead_letter(record, reason)
+        except Exception as ex:
+            if sys.stderr:
+                sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
+
+    def __is_poisoned(self, pending, delivered, response) -> bool:
+        """
+        Return True if the entrypoint rejected the current batch
+        (the last pending one) because of its content.
+        """
+        previous = pending[-2][0] if len(pending) > 1 else None
+        return response is not None and delivered == previous and \
+            response.status_code in self.poison_response_codes
+
+    def __halves(self, items):
+        middle = len(items) // 2
+        for part in (items[:middle], items[middle:]):
+            yield part, self.encode_payload(
+                {'streams': [entry for _, entry in part]}
+            )
+
+    def __bisect(self, url: str, items: list, response: ApiResponse) -> bool:
+        """
+        Split the rejected batch recursively until the poison records are
+        found. They are sent to the dead-letter sink, others are delivered.
+        :param items: [(record, stream entry)]
+        :return: bool - True if the whole batch is processed
+        """
+        if len(items) == 1:
+            self.__reject(items[0][0], url, response)
+            return True
+        for part, data in self.__halves(items):
+            response = self.__send(url, data)
+            if response.status_code == self.success_response_code:
+                continue
+            if response.status_code not in self.poison_response_codes or \
+                    not self.__bisect(url, part, response):
+                return False
+        return True
+
+    async def __bisect_async(self, url: str, items: list,
+                             response: ApiResponse) -> bool:
+        if len(items) == 1:
+            self.__reject(items[0][0], url, response)
+            return True
+        for part, data in self.__halves(items):
+            response = await self.__send_async(url, data)
+            if response.status_code == self.success_response_code:
+                continue
+            if response.status_code not in self.poison_response_codes or \
+                    not await self.__bisect_async(url, part, response):
+                return False
+        return True
+
+    @staticmethod
+    def __accepted_records(records):
+        return [record for record in records
+                if not getattr(record, 'loki_rejected', None)]
 
     def emit(self, records):
         """
         Send log records to Loki.
         :param records: List[LogRecord]
         """
+        records = self.__accepted_records(records)
+        if not records:
+            return
         payload = self.prepare_payload(records)
-        res = False
-        for entrypoint in self.urls:
-            status_code, msg = self.api.send_json(entrypoint, payload)
-            if status_code == self.success_response_code:
-                res |= True
-                if self.strategy != LOKI_DEPLOY_STRATEGY_ALL:
-                    break
-        if not res:
-            raise LokiServerError(f'Loki API response status code: {status_code} "{msg}"')
+        items = list(zip(records, payload['streams']))
+        data = self.encode_payload(payload)
+        if self.aggregator is not None and self.aggregator.forward(data):
+            return
+        if self.strategy == LOKI_DEPLOY_STRATEGY_ALL:
+            sequence, targets = self.__targets(data)
+            results = self.__fan_out(targets)
+            for url, (delivered, response) in results.items():
+                if self.__is_poisoned(targets[url], delivered, response) and \
+                        self.__bisect(url, items, response):
+                    results[url] = (sequence, response)
+            self.__commit(sequence, data, results)
+            return
+        responses = []
+        poisoned = None
+        for entrypoint in self.__candidates():
+            response = self.__send(entrypoint, data)
+            if response.status_code == self.success_response_code:
+                self.__accepted(entrypoint)
+                return
+            if not poisoned and \
+                    response.status_code in self.poison_response_codes:
+                poisoned = (entrypoint, response)
+            responses.append(response)
+        if poisoned and self.__bisect(poisoned[0], items, poisoned[1]):
+            self.__accepted(poisoned[0])
+            return
+        raise self.__error(responses)
+
+    async def __send_async(self, entrypoint, data: bytes):
+        start = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                self.__send_json(entrypoint, data),
+                timeout=self.endpoint_timeout
+            )
+        except asyncio.TimeoutError:
+            response = ApiResponse(self.timeout_response_code, 'Timeout')
+        return self.__check_health(entrypoint, response,
+                                   time.monotonic() - start)
 
     async def emit_async(self, records):
         """
         Asyncio send log record to Loki.
         :param records: List[LogRecord]
         """
+        records = self.__accepted_records(records)
+        if not records:
+            return
         payload = self.prepare_payload(records)
-        res = False
-        for entrypoint in self.urls:
-            status_code, msg = await self.api.send_json(entrypoint, payload)
-            if status_code == self.success_response_code:
-                res |= True
-                if self.strategy != LOKI_DEPLOY_STRATEGY_ALL:
+        items = list(zip(records, payload['streams']))
+        data = self.encode_payload(payload)
+        if self.strategy == LOKI_DEPLOY_STRATEGY_ALL:
+            sequence, targets = self.__targets(data)
+            results = await asyncio.gather(
+                *(self.__deliver_async(url, pending)
+                  for url, pending in targets.items())
+            )
+            results = dict(zip(targets, results))
+            for url, (delivered, response) in results.items():
+                if self.__is_poisoned(targets[url], delivered, response) and \
+                        await self.__bisect_async(url, items, response):
+                    results[url] = (sequence, response)
+            self.__commit(sequence, data, results)
+            return
+        responses = []
+        poisoned = None
+        for entrypoint in self.__candidates():
+            response = await self.__send_async(entrypoint, data)
+            if response.status_code == self.success_response_code:
+                self.__accepted(entrypoint)
+                return
+            if not poisoned and \
+                    response.status_code in self.poison_response_codes:
+                poisoned = (entrypoint, response)
+            responses.append(response)
+        if poisoned and \
+                await self.__bisect_async(poisoned[0], items, poisoned[1]):
+            self.__accepted(poisoned[0])
+            return
+        raise self.__error(responses)
+
+    def notify(self, urgent: bool = False):
+        """
+        The handler calls this, when a new record is in the queue.
+        :param urgent: bool - the record is sent without waiting for
+                       send_interval
+        """
+        if self.__restart is not None:
+            self.__restart_after_fork()
+        if self.reactor:
+            self.reactor.notify(self, urgent)
+        elif self.thread is not None:
+            if urgent or \
+                    self.queue.is_ready(self.handler.max_records_in_one_request):
+                # The batch is full, we don't wait for send_interval.
+                self.__thread_wakeup.set()
+        elif self.__asyncio_mode:
+            if urgent:
+                self.__urgent = True
+            task = self.__task
+            if task is None or task.done() or self.__loop.is_closed():
+                # The task is not bound yet or its loop is gone (e.g. the next
+                # `asyncio.run`), it is bound to the current loop.
+                if not self.thread_stop.is_set():
+                    self.__asyncio_bind()
+            elif self.__idle or urgent or \
+                    self.queue.is_ready(self.handler.max_records_in_one_request):
+                self.__asyncio_wakeup()
+
+    def after_fork(self):
+        """
+        Reset the emitter in the child process (after `os.fork`).
+        The inherited records are sent by the parent, the threads do not
+        exist in the child and their locks can be held. The sending is
+        restarted lazily by the first record of the child, so the fork of
+        many workers stays cheap.
+        """
+        closed = self.thread_stop.is_set()
+        self.queue.clear()
+        self.handler.shown_message_about_full_queue = 0
+        self.thread_stop = Event()
+        if closed:
+            self.thread_stop.set()
+        self.__thread_wakeup = Event()
+        self.__lock = Lock()
+        if not closed and self.thread is not None:
+            self.__restart = self.start
+        elif not closed and self.reactor is not None:
+            reactor_class = type(self.reactor)
+            self.__restart = lambda: self.reactor_start(
+                reactor_class.instance()
+            )
+        self.thread = None
+        self.reactor = None
+        self.__loop = None
+        self.__loop_thread = None
+        self.__task = None
+        self.__wakeup = None
+        self.__async_lock = None
+        self.__idle = False
+        self.__urgent = False
+        self.__executor = None
+        self.__in_flight = {}
+        self.__journal.clear()
+        self.cursors = {url: self.__sequence for url in self.urls}
+        for health in self.health.values():
+            health.reset()
+        self.backoff.reset()
+        self.throttle = 0.0
+        self.api.after_fork()
+
+    def __restart_after_fork(self):
+        with self.__lock:
+            restart, self.__restart = self.__restart, None
+        if restart:
+            restart()
+
+    def flush(self, timeout: float = None) -> int:
+        """
+        Send the backlog at full speed (send_interval is ignored).
+        :param timeout: float|None - deadline (in seconds), None = without
+                        deadline
+        :return: int - number of records still pending
+        """
+        if self.thread_stop.is_set() or timeout is not None and timeout <= 0:
+            # The emitter is closed or there is no time.
+            return self.queue.qsize()
+        if self.__asyncio_mode:
+            return self.__asyncio_flush(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = -1
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
                     break
-        if not res:
-            raise LokiServerError(f'Loki API response status code: {status_code} "{msg}"')
+            wait_sec = self.__send_batch(timeout=remaining)
+            if wait_sec is None:
+                break
+            if wait_sec:
+                if deadline is not None and \
+                        time.monotonic() + wait_sec >= deadline:
+                    break
+                time.sleep(wait_sec)
+        return self.queue.qsize()
 
     def close(self):
         """Close HTTP session."""
         self.thread_stop.set()
+        self.__thread_wakeup.set()
         if self.thread:
             self.thread.join()
+        if self.reactor:
+            self.reactor.unregister(self)
+        if self.__task is not None:
+            self.__asyncio_wakeup()
+            if not self.__loop.is_closed() and not self.__loop.is_running():
+                # The loop is stopped, we finish the task by ourselves.
+                self.__loop.run_until_complete(self.__task)
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+        if self.aggregator:
+            self.aggregator.close()
+
+    async def aclose(self):
+        """Close the asyncio emitter and wait for its task."""
+        self.thread_stop.set()
+        if self.__task is not None:
+            self.__asyncio_wakeup()
+            await asyncio.shield(self.__task)
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def __sent(self) -> float:
+        """
+        The batch was delivered.
+        :return: float - how long we should wait before the next send
+        """
+        self.queue.confirm()
+        self.backoff.reset()
+        if self.throttle:
+            # The send rate recovers gradually after 429.
+            self.throttle = self.throttle * 0.8 if self.throttle > 0.01 else 0.0
+        return self.throttle
+
+    def __failed(self, ex: LokiServerError) -> float:
+        """
+        The delivery failed, the batch stays in the queue.
+        :return: float - how long we should wait before the retry
+        """
+        if isinstance(ex, LokiRateLimitError):
+            # Multiplicative decrease of the send rate.
+            self.throttle = min(
+                self.max_throttle,
+                max(self.throttle * 2, self.handler.send_interval or 0.1)
+            )
+        return self.backoff.next(retry_after=ex.retry_after)
+
+    def process(self, records) -> float:
+        """
+        Send one batch and confirm it in the queue.
+        :return: float - how long we should wait before the next send
+        """
+        try:
+            self.emit(records)
+            return self.__sent()
+        except LokiServerError as ex:
+            return self.__failed(ex)
+        except Exception as ex:
+            from loggate.logger import getLogger
+            getLogger('loggate.loki').exception(
+                ex,
+                meta={'privileged': True}
+            )
+            if sys.stderr:
+                sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
+            # If there are problematic message we drop it.
+            self.queue.confirm()
+        return 0
+
+    async def process_async(self, records, is_full_asyncio=True) -> float:
+        """
+        Asyncio variant of `process`.
+        """
+        try:
+            if is_full_asyncio:
+                await self.emit_async(records)
+            else:
+                self.emit(records)
+            return self.__sent()
+        except LokiServerError as ex:
+            return self.__failed(ex)
+        except Exception as ex:
+            if sys.stderr:
+                sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
+            # If there are problematic message we drop it.
+            self.queue.confirm()
+        return 0
+
+    def __send_batch(self, timeout: float = -1):
+        """
+        Take one batch from the queue and send it.
+        :param timeout: float - how long we wait for the lock (-1 = forever)
+        :return: float|None - the wait before the next send,
+                              None if there is nothing to send
+        """
+        if not self.__lock.acquire(timeout=timeout):
+            return None
+        try:
+            records = self.queue.gets(
+                self.handler.max_records_in_one_request,
+                block=False
+            )
+            if not records:
+                return None
+            return self.process(records)
+        finally:
+            self.__lock.release()
 
     def start(self):
         def process():
-            wait_gen = None
             while not self.thread_stop.is_set():
-                records = self.queue.gets(
-                    number=self.handler.max_records_in_one_request,
-                    block=True,
-                    timeout=self.handler.send_interval
-                )
-                if records:
-                    try:
-                        self.emit(records)
-                        self.queue.confirm()
-                        wait_gen = None
-                    except LokiServerError:
-                        if not wait_gen:
-                            wait_gen = self.__get_new_generator()
-                        wait_sec = next(wait_gen)
-                        # from loggate.logger import getLogger
-                        # getLogger('loggate.loki').warning(
-                        #     "Sending of the log messages failed.",
-                        #     meta={
-                        #         'privileged': True,
-                        #         'max_size': self.queue.max_size,
-                        #         'queue_size': self.queue.qsize()
-                        #     }
-                        # )
-                        time.sleep(wait_sec)
-                    except Exception as ex:
-                        from loggate.logger import getLogger
-                        getLogger('loggate.loki').exception(
-                            ex,
-                            meta={'privileged': True}
-                        )
-                        if sys.stderr:
-                            sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
-                        # If there are problematic message we drop it.
-                        self.queue.confirm()
+                if self.queue.qsize() < \
+                        self.handler.max_records_in_one_request:
+                    # We wait for the full batch or send_interval.
+                    self.__thread_wakeup.wait(self.handler.send_interval)
+                    self.__thread_wakeup.clear()
+                    if self.thread_stop.is_set():
+                        break
+                wait_sec = self.__send_batch()
+                if wait_sec:
+                    self.thread_stop.wait(wait_sec)
 
         self.thread = Thread(target=process, name="loggate", daemon=True)
         self.thread.start()
 
+    def reactor_start(self, reactor):
+        """
+        Register the emitter to the shared delivery reactor
+        (instead of own thread).
+        :param reactor: LokiReactor
+        """
+        self.reactor = reactor
+        reactor.register(self)
+
+    def reactor_step(self):
+        """
+        Send one batch, the reactor calls this.
+        :return: float|None - the delay of the next service,
+                              None if the queue is empty
+        """
+        wait_sec = self.__send_batch()
+        if wait_sec is None:
+            return None
+        if wait_sec:
+            return wait_sec
+        qsize = self.queue.qsize()
+        if not qsize:
+            return None
+        if qsize >= self.handler.max_records_in_one_request:
+            return 0
+        return self.handler.send_interval
+
     def asyncio_start(self):
-        async def process(is_full_asyncio):
-            wait_gen = None
-            while not self.thread_stop.is_set():
-                records = self.queue.gets(
-                    self.handler.max_records_in_one_request,
-                    block=False,
-                )
-                if records:
-                    try:
-                        if is_full_asyncio:
-                            await self.emit_async(records)
-                        else:
-                            self.emit(records)
-                        self.queue.confirm()
-                    except LokiServerError:
-                        if not wait_gen:
-                            wait_gen = self.__get_new_generator()
-                        wait_sec = next(wait_gen)
-                        # from loggate.logger import getLogger
-                        # getLogger('loggate.loki').warning(
-                        #     "Sending of the log messages failed.",
-                        #     meta={
-                        #         'privileged': True,
-                        #         'max_size': self.queue.max_size,
-                        #         'queue_size': self.queue.qsize()
-                        #     }
-                        # )
-                        await asyncio.sleep(wait_sec)
-                    except Exception as ex:
-                        if sys.stderr:
-                            sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
-                        # If there are problematic message we drop it.
-                        self.queue.confirm()
-                else:
-                    await asyncio.sleep(self.handler.send_interval)
+        """
+        Start the asyncio emitter. The task is bound to the running loop
+        (now or by the first log record emitted in the running loop).
+        """
+        self.__asyncio_mode = True
+        self.__asyncio_bind()
+
+    def __asyncio_bind(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # There is no running loop yet, the records wait in the queue.
+            return
+        self.__loop = loop
+        self.__loop_thread = get_ident()
+        self.__wakeup = asyncio.Event()
+        self.__async_lock = asyncio.Lock()
         is_full_asyncio = asyncio.iscoroutinefunction(self.api.send_json)
-        asyncio.get_event_loop().create_task(process(is_full_asyncio))
+        self.__task = loop.create_task(self.__asyncio_process(is_full_asyncio))
+
+    def __asyncio_wakeup(self):
+        if self.__loop.is_closed():
+            return
+        if get_ident() == self.__loop_thread:
+            self.__wakeup.set()
+        else:
+            self.__loop.call_soon_threadsafe(self.__wakeup.set)
+
+    async def __asyncio_sleep(self, seconds: float):
+        """Sleep, but wake up when the emitter is closed."""
+        try:
+            await asyncio.wait_for(self.__wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self.__wakeup.clear()
+
+    async def __asyncio_send_batch(self, lock, is_full_asyncio):
+        """
+        Asyncio variant of `__send_batch`.
+        """
+        async with lock:
+            records = self.queue.gets(
+                self.handler.max_records_in_one_request,
+                block=False,
+            )
+            if not records:
+                return None
+            return await self.process_async(records, is_full_asyncio)
+
+    async def aflush(self, timeout: float = None) -> int:
+        """
+        Asyncio variant of `flush`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        lock = self.__async_lock
+        if lock is None or self.__loop is not asyncio.get_running_loop():
+            # The task (if any) runs in another (closed) loop.
+            lock = asyncio.Lock()
+        is_full_asyncio = asyncio.iscoroutinefunction(self.api.send_json)
+        while deadline is None or time.monotonic() < deadline:
+            send = self.__asyncio_send_batch(lock, is_full_asyncio)
+            try:
+                wait_sec = await asyncio.wait_for(
+                    send,
+                    None if deadline is None else deadline - time.monotonic()
+                )
+            except asyncio.TimeoutError:
+                break
+            if wait_sec is None:
+                break
+            if wait_sec:
+                if deadline is not None and \
+                        time.monotonic() + wait_sec >= deadline:
+                    break
+                await asyncio.sleep(wait_sec)
+        return self.queue.qsize()
+
+    def __asyncio_flush(self, timeout: float = None) -> int:
+        loop = self.__loop
+        if loop is not None and loop.is_running():
+            if get_ident() == self.__loop_thread:
+                # We can not block the loop, the task sends the backlog.
+                self.__asyncio_wakeup()
+                return self.queue.qsize()
+            future = asyncio.run_coroutine_threadsafe(self.aflush(timeout),
+                                                      loop)
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                return self.queue.qsize()
+        try:
+            asyncio.get_running_loop()
+            # The other loop is running in this thread, we can not block it.
+            return self.queue.qsize()
+        except RuntimeError:
+            pass
+        if not self.queue.qsize():
+            return 0
+        return asyncio.run(self.aflush(timeout))
+
+    async def __asyncio_send_backlog(self, is_full_asyncio):
+        """
+        Send the records until the queue is empty.
+        """
+        while True:
+            wait_sec = await self.__asyncio_send_batch(self.__async_lock,
+                                                       is_full_asyncio)
+            if wait_sec is None:
+                return
+            if wait_sec:
+                if self.thread_stop.is_set():
+                    # The delivery fails, we don't wait on close.
+                    return
+                await self.__asyncio_sleep(wait_sec)
+
+    async def __asyncio_process(self, is_full_asyncio):
+        while True:
+            if not self.thread_stop.is_set():
+                # The queue is empty, we wait for the notification.
+                self.__wakeup.clear()
+                self.__idle = True
+                if self.queue.qsize() == 0:
+                    await self.__wakeup.wait()
+                self.__idle = False
+                self.__wakeup.clear()
+                if not self.thread_stop.is_set() and not self.__urgent and \
+                        not self.queue.is_ready(
+                            self.handler.max_records_in_one_request):
+                    # We wait for the full batch or send_interval.
+                    await self.__asyncio_sleep(self.handler.send_interval)
+                self.__urgent = False
+            await self.__asyncio_send_backlog(is_full_asyncio)
+            if self.thread_stop.is_set():
+                break
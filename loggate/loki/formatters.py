@@ -1,20 +1,161 @@
+import dataclasses
+import datetime
+import decimal
+import enum
 import json
 import logging
+import math
+import uuid
+from collections import deque
+from collections.abc import Mapping
+from itertools import islice
+from pathlib import PurePath
+
+
+def _same(fmt, val, depth):
+    return val
+
+
+def _float(fmt, val, depth):
+    # NaN and Infinity are not valid JSON.
+    return val if math.isfinite(val) else str(val)
+
+
+def _str(fmt, val, depth):
+    if len(val) > fmt.max_length:
+        return val[:fmt.max_length] + '...'
+    return val
+
+
+def _bytes(fmt, val, depth):
+    return _str(fmt, bytes(val).decode('utf-8', errors='replace'), depth)
+
+
+def _text(fmt, val, depth):
+    return _str(fmt, str(val), depth)
+
+
+def _isoformat(fmt, val, depth):
+    return val.isoformat()
+
+
+def _timedelta(fmt, val, depth):
+    return val.total_seconds()
+
+
+def _enum(fmt, val, depth):
+    return fmt.serialize(val.value, depth)
+
+
+def _mapping(fmt, val, depth, name=None):
+    if depth >= fmt.max_depth:
+        return f'<{name or type(val).__name__}>'
+    res = {}
+    for key, it in islice(val.items(), fmt.max_items):
+        if not isinstance(key, str):
+            key = str(key)
+        res[key] = fmt.serialize(it, depth + 1)
+    if len(val) > fmt.max_items:
+        res['...'] = f'<{len(val) - fmt.max_items} more items>'
+    return res
+
+
+def _sequence(fmt, val, depth):
+    if depth >= fmt.max_depth:
+        return f'<{type(val).__name__}>'
+    res = [fmt.serialize(it, depth + 1)
+           for it in islice(val, fmt.max_items)]
+    if len(val) > fmt.max_items:
+        res.append(f'<{len(val) - fmt.max_items} more items>')
+    return res
+
+
+def _dataclass(fmt, val, depth):
+    fields = {field.name: getattr(val, field.name)
+              for field in dataclasses.fields(val)}
+    return _mapping(fmt, fields, depth, type(val).__name__)
+
+
+def _other(fmt, val, depth):
+    try:
+        return _text(fmt, val, depth)
+    except Exception:
+        return f'<{type(val).__name__}>'
+
+
+# The converters of metadata values, the first match of the type is used
+# (e.g. Enum before int for IntEnum).
+CONVERTERS = (
+    (enum.Enum, _enum),
+    (str, _str),
+    ((bool, int, type(None)), _same),
+    (float, _float),
+    ((bytes, bytearray), _bytes),
+    (Mapping, _mapping),
+    ((list, tuple, set, frozenset, deque), _sequence),
+    ((datetime.date, datetime.time), _isoformat),
+    (datetime.timedelta, _timedelta),
+    ((uuid.UUID, decimal.Decimal, PurePath), _text),
+)
+
+
+def _find_converter(val_type):
+    for types, converter in CONVERTERS:
+        if issubclass(val_type, types):
+            return converter
+    if dataclasses.is_dataclass(val_type):
+        return _dataclass
+    return _other
 
 
 class LokiLogFormatter(logging.Formatter):
     """
     Loki formatter
+    The metadata are sent as native JSON types (nested dicts and lists,
+    numbers, bools, datetimes, UUIDs, dataclasses, Enums), other values
+    as strings.
     """
 
-    @staticmethod
-    def __prep(val):
-        if isinstance(val, str):
-            return val
-        elif isinstance(val, bytes):
-            return val.decode('utf-8', errors='replace')
-        else:
-            return str(val)
+    # Limits of serialized metadata: the depth of nested structures, the
+    # number of items of one structure and the length of one string.
+    max_depth = 5
+    max_items = 100
+    max_length = 4096
+
+    # Dispatch cache: the type of value -> its converter
+    __converters = {}
+    __max_converters = 1000
+
+    def __init__(self, fmt=None, datefmt=None, style='%', validate=True,
+                 max_depth: int = None, max_items: int = None,
+                 max_length: int = None, **kwargs):
+        """
+        :param max_depth: int - max depth of nested metadata structures
+        :param max_items: int - max number of items of one structure
+        :param max_length: int - max length of one string
+        """
+        super().__init__(fmt, datefmt, style, validate, **kwargs)
+        if max_depth is not None:
+            self.max_depth = max_depth
+        if max_items is not None:
+            self.max_items = max_items
+        if max_length is not None:
+            self.max_length = max_length
+
+    def serialize(self, val, depth: int = 0):
+        """
+        Return the JSON compatible value of metadata.
+        :param val: Any
+        :param depth: int - depth of the value in the structure
+        :return: Any
+        """
+        val_type = type(val)
+        converter = self.__converters.get(val_type)
+        if converter is None:
+            converter = _find_converter(val_type)
+            if len(self.__converters) < self.__max_converters:
+                self.__converters[val_type] = converter
+        return converter(self, val, depth)
 
     def format(self, record: logging.LogRecord, handler=None) -> str:
         res = {}
@@ -30,16 +171,27 @@ class LokiLogFormatter(logging.Formatter):
         if handler:
             if hasattr(handler, 'loki_tags'):
                 loki_tags = handler.loki_tags
-            if hasattr(handler, 'meta') and handler.meta:
-                res.update({key: self.__prep(val)
-                            for key, val in handler.meta.items()
+            if getattr(handler, 'structured_metadata', None):
+                # They are sent beside the line.
+                loki_tags = list(loki_tags) + handler.structured_metadata
+            meta = None
+            if hasattr(handler, 'get_meta'):
+                meta = handler.get_meta(record)
+            elif hasattr(handler, 'meta'):
+                meta = handler.meta
+            if meta:
+                res.update({key: self.serialize(val)
+                            for key, val in meta.items()
                             if key not in loki_tags})
         if hasattr(record, 'meta') and record.meta:
-            res.update({key: self.__prep(val)
+            res.update({key: self.serialize(val)
                         for key, val in record.meta.items()
                         if key not in loki_tags})
         if record.exc_info:
             res['exception'] = "\n" + self.formatException(record.exc_info)
+        elif record.exc_text:
+            # The exception was rendered already (e.g. in another process).
+            res['exception'] = "\n" + record.exc_text
         if record.stack_info:
             res['stack'] = self.formatStack(record.stack_info)
         return json.dumps(res)
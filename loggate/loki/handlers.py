@@ -1,12 +1,63 @@
-from logging import Handler
+import atexit
+import json
+import socket
+import sys
+import threading
+import time
+import weakref
+from logging import Handler, LogRecord
+from loggate import get_level
+from loggate.meta import resolve_meta
 from loggate.loki.confirmation_queue import ConfirmatrionQueue
+from loggate.loki.sharded_queue import ShardedQueue
+from loggate.loki.backpressure import BackpressureQueue, \
+    OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK
 from typing import Dict, Any, List
 
 from .formatters import LokiLogFormatter
 from .emitters import LokiEmitterV1
 from ..http.simple_api_call import SimpleApiCall
+from ..http.asyncio_api_call import AsyncioApiCall
+from .reactor import LokiReactor
+from .aggregator import LokiAggregator
+from .offload import LokiOffloadEmitter
+from .datagram import DATAGRAM_FORMAT_RFC5424, DATAGRAM_FORMAT_JSON, \
+    DATAGRAM_FORMATS, DEFAULT_SD_ID, parse_address, encode_rfc5424, \
+    encode_json
+
+DEMOTE_TO_LINE = 'line'
+DEMOTE_TO_STRUCTURED_METADATA = 'structured_metadata'
 
 _defaultFormatter = LokiLogFormatter()
+# Living Loki handlers, their backlog is sent at exit.
+_handlers = weakref.WeakSet()
+# The backlog was sent at exit, the next flush (logging.shutdown) doesn't wait.
+_drained = False
+
+
+def _flush_at_exit():
+    """
+    Send the backlog of all living Loki handlers. The whole drain is limited
+    by the longest `flush_timeout`, so the exit can not hang on dead Loki.
+    """
+    global _drained
+    handlers = list(_handlers)
+    if not handlers:
+        return
+    deadline = time.monotonic() + max(it.flush_timeout for it in handlers)
+    for handler in handlers:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                handler.flush(min(remaining, handler.flush_timeout))
+        except Exception:
+            pass
+    _drained = True
+
+
+# The thread pools are stopped before `atexit`, the `all` strategy sends
+# to the entrypoints one by one then.
+atexit.register(_flush_at_exit)
 
 
 class LokiHandlerBase(Handler):
@@ -15,22 +66,72 @@ class LokiHandlerBase(Handler):
     """
 
     DEFAULT_LOKI_TAGS = ['logger', 'level']
+    emitter = None
     level_tag = 'level'
     logger_tag = 'logger'
 
     def __init__(self, meta: dict = None, loki_tags=None, send_interval=1,
-                 max_records_in_one_request=0, max_queue_size=0):
+                 max_records_in_one_request=0, max_queue_size=0,
+                 flush_timeout=5, sharded_queue=False, overflow_policy=None,
+                 block_timeout=1, priority_level=None, flush_level=None,
+                 structured_metadata=None, max_label_values=None,
+                 demote_labels_to='line'):
         """
         Create new Loki logging handler.
 
         :param meta: Default metadata added to every log record.
         :param loki_tags: The list of names metadata, which will be converted to
                   loki tags.
+        :param flush_timeout: max time (in seconds) for sending of the backlog
+               in `flush` (e.g. at exit)
+        :param sharded_queue: the queue has got one shard per thread and
+               the records are queued without the handler lock
+        :param overflow_policy: what happens when the queue is full
+               (drop-newest, drop-oldest, block, level-aware, downsample)
+        :param block_timeout: max wait (in seconds) of policy `block`
+        :param priority_level: the records of this and higher levels jump
+               ahead of the backlog
+        :param flush_level: the record of this or higher level is sent
+               immediately (send_interval is not waited)
+        :param structured_metadata: the list of names metadata, which are
+               sent as structured metadata of Loki 3 (not labels, not in line)
+        :param max_label_values: max number of distinct values of one label,
+               the label over the limit is demoted (default: unlimited)
+        :param demote_labels_to: `line` or `structured_metadata` - where
+               the values of demoted labels are sent
         """
         super().__init__()
-        self.queue = ConfirmatrionQueue(max_queue_size)
+        self.sharded_queue = sharded_queue
+        policy = overflow_policy or OVERFLOW_DROP_NEWEST
+        if priority_level is not None:
+            priority_level = get_level(priority_level)
+        policy_queue = policy != OVERFLOW_DROP_NEWEST or \
+            priority_level is not None
+        if sharded_queue and policy_queue:
+            raise ValueError('The sharded queue supports only overflow '
+                             'policy drop-newest without priority.')
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = policy
+        self.block_timeout = block_timeout
+        self.priority_level = priority_level
+        self.queue = self.create_queue()
         self.meta = meta
         self.loki_tags = loki_tags if loki_tags else self.DEFAULT_LOKI_TAGS
+        self.structured_metadata = [
+            key for key in (structured_metadata or [])
+            if key not in self.loki_tags
+        ]
+        if demote_labels_to not in (DEMOTE_TO_LINE,
+                                    DEMOTE_TO_STRUCTURED_METADATA):
+            raise ValueError(f'The labels can not be demoted to '
+                             f'"{demote_labels_to}".')
+        self.max_label_values = max_label_values
+        self.demote_labels_to = demote_labels_to
+        # The labels over max_label_values (they are not labels anymore)
+        self.demoted_labels = []
+        # label: distinct values (max. max_label_values)
+        self.__label_values = {}
+        self.__label_lock = threading.Lock()
         self.send_interval = send_interval
         self.max_records_in_one_request = 100
         if max_records_in_one_request > 0:
@@ -39,6 +140,43 @@ class LokiHandlerBase(Handler):
                 max_queue_size <= self.max_records_in_one_request:
             self.max_records_in_one_request = max(1, max_queue_size - 1)
         self.shown_message_about_full_queue = 0
+        self.flush_timeout = flush_timeout
+        self.flush_level = None
+        if flush_level is not None:
+            self.flush_level = get_level(flush_level)
+        _handlers.add(self)
+
+    def create_queue(self) -> ConfirmatrionQueue:
+        if self.sharded_queue:
+            return ShardedQueue(self.max_queue_size)
+        if self.overflow_policy != OVERFLOW_DROP_NEWEST or \
+                self.priority_level is not None:
+            return BackpressureQueue(self.max_queue_size, self.overflow_policy,
+                                     self.block_timeout, self.priority_level)
+        return ConfirmatrionQueue(self.max_queue_size)
+
+    def flush(self, timeout: float = None) -> int:
+        """
+        Send the backlog now (send_interval is ignored).
+        :param timeout: float - deadline in seconds (default flush_timeout)
+        :return: int - number of records which were not sent
+        """
+        if not self.emitter:
+            return 0
+        if timeout is None:
+            timeout = self.get_flush_timeout()
+        return self.emitter.flush(timeout)
+
+    def get_flush_timeout(self) -> float:
+        """
+        Return `flush_timeout`, it is 0 after the drain at exit (the backlog
+        was sent already).
+        """
+        return 0 if _drained else self.flush_timeout
+
+    def close(self) -> None:
+        _handlers.discard(self)
+        super().close()
 
     def format(self, record):
         fmt = self.formatter if self.formatter else _defaultFormatter
@@ -46,60 +184,180 @@ class LokiHandlerBase(Handler):
             return fmt.format(record, handler=self)
         return fmt.format(record)
 
+    def get_meta(self, record) -> Dict[str, Any]:
+        """
+        Return metadata of the handler, the lazy values are computed once
+        per record.
+        :param record: LogRecord
+        :return:  Dict[str, Any]
+        """
+        if not getattr(self, 'meta', None):
+            return {}
+        meta = getattr(record, 'loki_handler_meta', None)
+        if meta is None:
+            meta = resolve_meta(self.meta)
+            if meta is not self.meta:
+                record.loki_handler_meta = meta
+        return meta
+
     def build_tags(self, record) -> Dict[str, Any]:
         """
         Prepare tags
         :param record: LogRecord
         :return:  Dict[str, Any]
         """
-        meta = {}
-        if hasattr(self, 'meta') and self.meta:
-            meta = self.meta.copy()
+        meta = dict(self.get_meta(record))
         meta[self.level_tag] = record.levelname.lower()
         meta[self.logger_tag] = record.name
         meta.update(getattr(record, "meta", {}))
-        return {key: val for key, val in meta.items() if key in self.loki_tags}
+        tags = {key: val for key, val in meta.items() if key in self.loki_tags}
+        if self.max_label_values:
+            self.__check_cardinality(tags)
+        return tags
+
+    def __check_cardinality(self, tags: dict):
+        """
+        Remove the labels over the limit of distinct values from tags.
+        The built-in labels (level and logger) are not limited.
+        """
+        for key, val in list(tags.items()):
+            if key == self.level_tag or key == self.logger_tag:
+                continue
+            values = self.__label_values.get(key)
+            if values is None:
+                values = self.__label_values.setdefault(key, set())
+            try:
+                if val in values:
+                    continue
+            except TypeError:
+                val = str(val)
+                if val in values:
+                    continue
+            if len(values) < self.max_label_values:
+                values.add(val)
+                continue
+            self.demote_label(key)
+            del tags[key]
+
+    def demote_label(self, key: str):
+        """
+        The label is sent in the line (or structured metadata) from now on.
+        """
+        with self.__label_lock:
+            if key not in self.loki_tags:
+                return
+            # copy-on-write, the lists are read without the lock
+            self.loki_tags = [it for it in self.loki_tags if it != key]
+            if self.demote_labels_to == DEMOTE_TO_STRUCTURED_METADATA:
+                self.structured_metadata = self.structured_metadata + [key]
+            self.demoted_labels = self.demoted_labels + [key]
+            self.__label_values.pop(key, None)
+        from loggate.logger import getLogger
+        getLogger('loggate.loki').warning(
+            f'The Loki label "{key}" has got more than '
+            f'{self.max_label_values} values, it is sent in '
+            f'{self.demote_labels_to} from now on.',
+            meta={
+                'privileged': True,
+                'label': key,
+                'max_label_values': self.max_label_values
+            }
+        )
+
+    def build_structured_metadata(self, record) -> Dict[str, str]:
+        """
+        Prepare structured metadata (the values have to be strings).
+        The structures (e.g. dict, list) are serialized to JSON as in the line.
+        :param record: LogRecord
+        :return:  Dict[str, str]
+        """
+        res = {}
+        if not self.structured_metadata:
+            return res
+        sources = (self.get_meta(record), getattr(record, 'meta', None) or {})
+        for key in self.structured_metadata:
+            for meta in sources:
+                if key in meta:
+                    res[key] = meta[key]
+        fmt = self.formatter
+        if not isinstance(fmt, LokiLogFormatter):
+            fmt = _defaultFormatter
+        for key, val in res.items():
+            if isinstance(val, str):
+                continue
+            if isinstance(val, bytes):
+                res[key] = val.decode('utf-8', errors='replace')
+                continue
+            val = fmt.serialize(val)
+            res[key] = json.dumps(val) if isinstance(val, (dict, list)) \
+                else val if isinstance(val, str) else str(val)
+        return res
+
+    def handle(self, record):
+        """
+        The sharded queue is thread-safe without any lock, so the handler
+        lock is not used.
+        """
+        if not self.sharded_queue:
+            return super().handle(record)
+        rv = self.filter(record)
+        if isinstance(rv, LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
 
     def emit(self, record):
         """
         Save record to the queue.
         """
         try:
-            privileged = getattr(record, 'meta', {}).get('privileged', False)
-            res = self.queue.put_nowait(record, privileged=privileged)
-            if res:
-                # The queue is not full
-                if self.queue.qsize() < self.queue.max_size:
-                    self.shown_message_about_full_queue = 0
-            elif self.queue.max_size > 0:
-                from loggate.logger import getLogger
-                if not privileged and self.shown_message_about_full_queue == 0:
-                    # The queue is full, but still accept privileged messages
-                    self.shown_message_about_full_queue = 1
-                    getLogger('loggate.loki').error(
-                        "Loki Queue is full. All next non-privileged log "
-                        "records will be dropped.",
-                        meta={
-                            'privileged': True,
-                            'max_size': self.queue.max_size,
-                            'queue_size': self.queue.qsize()
-                        }
-                    )
-                elif privileged and self.shown_message_about_full_queue != 2:
-                    # The queue is really full, we don't accept any messages.
-                    self.shown_message_about_full_queue = 2
-                    getLogger('loggate.loki').critical(
-                        "Loki Queue is full. Any next log records will be "
-                        "dropped.",
-                        meta={
-                            'privileged': True,
-                            'max_size': self.queue.max_size,
-                            'queue_size': self.queue.qsize()
-                        }
-                    )
+            self.enqueue(record, self.queue, self.emitter)
         except Exception:
             self.handleError(record)
 
+    def enqueue(self, record, queue, emitter):
+        """
+        Put record to the queue and notify the emitter.
+        """
+        privileged = getattr(record, 'meta', {}).get('privileged', False)
+        res = queue.put(record, privileged=privileged)
+        if res:
+            if emitter:
+                urgent = False
+                if self.flush_level is not None:
+                    urgent = record.levelno >= self.flush_level
+                emitter.notify(urgent=urgent)
+            # The queue is not full
+            if queue.max_size and queue.qsize() < queue.max_size:
+                self.shown_message_about_full_queue = 0
+        elif queue.max_size > 0:
+            from loggate.logger import getLogger
+            if not privileged and self.shown_message_about_full_queue == 0:
+                # The queue is full, but still accept privileged messages
+                self.shown_message_about_full_queue = 1
+                getLogger('loggate.loki').error(
+                    "Loki Queue is full. All next non-privileged log "
+                    "records will be dropped.",
+                    meta={
+                        'privileged': True,
+                        'max_size': queue.max_size,
+                        'queue_size': queue.qsize()
+                    }
+                )
+            elif privileged and self.shown_message_about_full_queue != 2:
+                # The queue is really full, we don't accept any messages.
+                self.shown_message_about_full_queue = 2
+                getLogger('loggate.loki').critical(
+                    "Loki Queue is full. Any next log records will be "
+                    "dropped.",
+                    meta={
+                        'privileged': True,
+                        'max_size': queue.max_size,
+                        'queue_size': queue.qsize()
+                    }
+                )
+
 
 class LokiHandler(LokiHandlerBase):
     """
@@ -112,7 +370,8 @@ class LokiHandler(LokiHandlerBase):
     def __init__(self, urls: List[str], strategy: str = None,
                  meta: dict = None, auth=None, loki_tags=None,
                  timeout=None, ssl_verify=True, send_retry=None,
-                 max_queue_size=0):
+                 max_queue_size=0, dead_letter=None, structured_metadata=None,
+                 max_label_values=None, demote_labels_to='line'):
         """
         Create new Loki logging handler.
 
@@ -129,12 +388,22 @@ class LokiHandler(LokiHandlerBase):
         :param send_retry: list of waiting seconds
                to retry sending loki messages
         :param max_queue_size: max queue size
-
+        :param dead_letter: callable(record, reason)|logging.Handler - sink
+               of the log records rejected by Loki (4xx responses)
+        :param structured_metadata: the list of names metadata, which are
+               sent as structured metadata of Loki 3 (not labels, not in line)
+        :param max_label_values: max number of distinct values of one label,
+               the label over the limit is demoted (default: unlimited)
+        :param demote_labels_to: `line` or `structured_metadata` - where
+               the values of demoted labels are sent
         """
         super().__init__(
             meta,
             loki_tags,
-            max_queue_size=max_queue_size
+            max_queue_size=max_queue_size,
+            structured_metadata=structured_metadata,
+            max_label_values=max_label_values,
+            demote_labels_to=demote_labels_to
         )
         api = SimpleApiCall(auth=auth, timeout=timeout, ssl_verify=ssl_verify)
         self.emitter = LokiEmitterV1(
@@ -143,7 +412,8 @@ class LokiHandler(LokiHandlerBase):
             api=api,
             queue=self.queue,
             strategy=strategy,
-            send_retry=send_retry
+            send_retry=send_retry,
+            dead_letter=dead_letter
         )
 
     def emit(self, record):
@@ -167,7 +437,12 @@ class LokiThreadHandler(LokiHandlerBase):
                  meta: dict = None, auth=None, loki_tags=None,
                  timeout=None, ssl_verify=True, send_interval=1,
                  max_records_in_one_request=0, send_retry=None,
-                 max_queue_size=0):
+                 max_queue_size=0, dead_letter=None, shared_reactor=False,
+                 flush_timeout=5, aggregator_socket=None,
+                 sharded_queue=False, overflow_policy=None, block_timeout=1,
+                 priority_level=None, flush_level=None,
+                 structured_metadata=None, max_label_values=None,
+                 demote_labels_to='line'):
         """
         Create new Loki logging handler.
 
@@ -189,24 +464,74 @@ class LokiThreadHandler(LokiHandlerBase):
         :param send_retry: list of waiting seconds
                to retry sending loki messages
         :param max_queue_size: max queue size
+        :param dead_letter: callable(record, reason)|logging.Handler - sink
+               of the log records rejected by Loki (4xx responses)
+        :param shared_reactor: the sending is done by the process-wide
+               reactor (shared thread and keep-alive connections) instead of
+               own thread
+        :param flush_timeout: max time (in seconds) for sending of the backlog
+               in `flush` (e.g. at exit)
+        :param aggregator_socket: path of the Unix domain socket, the batches
+               are forwarded to the host-wide aggregator (one process of
+               the host pushes them to Loki)
+        :param sharded_queue: the queue has got one shard per thread and
+               the records are queued without the handler lock (it scales
+               with many logging threads, e.g. on free-threaded Python)
+        :param overflow_policy: what happens when the queue is full:
+               `drop-newest` (default), `drop-oldest`, `block`,
+               `level-aware` or `downsample` (the dropped records are counted
+               per level in `handler.queue.dropped`)
+        :param block_timeout: max wait (in seconds) of the logging thread
+               for the free space (policy `block`)
+        :param priority_level: the records of this and higher levels (e.g.
+               ERROR) jump ahead of the backlog
+        :param flush_level: the record of this or higher level is sent
+               immediately (send_interval is not waited)
+        :param structured_metadata: the list of names metadata, which are
+               sent as structured metadata of Loki 3 (not labels, not in line)
+        :param max_label_values: max number of distinct values of one label,
+               the label over the limit is demoted (default: unlimited)
+        :param demote_labels_to: `line` or `structured_metadata` - where
+               the values of demoted labels are sent
         """
         super().__init__(
             meta=meta,
             loki_tags=loki_tags,
             send_interval=send_interval,
             max_records_in_one_request=max_records_in_one_request,
-            max_queue_size=max_queue_size
+            max_queue_size=max_queue_size,
+            flush_timeout=flush_timeout,
+            sharded_queue=sharded_queue,
+            overflow_policy=overflow_policy,
+            block_timeout=block_timeout,
+            priority_level=priority_level,
+            flush_level=flush_level,
+            structured_metadata=structured_metadata,
+            max_label_values=max_label_values,
+            demote_labels_to=demote_labels_to
         )
-        api = SimpleApiCall(auth=auth, timeout=timeout, ssl_verify=ssl_verify)
+        if shared_reactor:
+            reactor = LokiReactor.instance()
+            api = reactor.api(SimpleApiCall, auth=auth, timeout=timeout,
+                              ssl_verify=ssl_verify, keep_alive=True)
+        else:
+            api = SimpleApiCall(auth=auth, timeout=timeout,
+                                ssl_verify=ssl_verify)
         self.emitter = LokiEmitterV1(
             self,
             urls=urls,
             api=api,
             queue=self.queue,
             strategy=strategy,
-            send_retry=send_retry
+            send_retry=send_retry,
+            dead_letter=dead_letter
         )
-        self.emitter.start()
+        if aggregator_socket:
+            self.emitter.aggregator = LokiAggregator(aggregator_socket, self)
+        if shared_reactor:
+            self.emitter.reactor_start(reactor)
+        else:
+            self.emitter.start()
 
     def close(self) -> None:
         self.emitter.close()
@@ -218,7 +543,10 @@ class LokiAsyncioHandler(LokiHandlerBase):
                  meta: dict = None, auth=None, loki_tags=None,
                  timeout=None, ssl_verify=True, send_interval=1,
                  max_records_in_one_request=0, send_retry=None,
-                 max_queue_size=0):
+                 max_queue_size=0, dead_letter=None, flush_timeout=5,
+                 overflow_policy=None, priority_level=None, flush_level=None,
+                 structured_metadata=None, max_label_values=None,
+                 demote_labels_to='line'):
         """
             Create new Loki logging handler.
 
@@ -240,30 +568,433 @@ class LokiAsyncioHandler(LokiHandlerBase):
             :param send_retry: list of waiting seconds
                 to retry sending loki messages
             :param max_queue_size: max queue size
+            :param dead_letter: callable(record, reason)|logging.Handler - sink
+                   of the log records rejected by Loki (4xx responses)
+            :param flush_timeout: max time (in seconds) for sending of the backlog
+                   in `flush` (e.g. at exit)
+            :param overflow_policy: what happens when the queue is full:
+                   `drop-newest` (default), `drop-oldest`, `level-aware` or
+                   `downsample` (`block` would block the event loop)
+            :param priority_level: the records of this and higher levels (e.g.
+                   ERROR) jump ahead of the backlog
+            :param flush_level: the record of this or higher level is sent
+                   immediately (send_interval is not waited)
+            :param structured_metadata: the list of names metadata, which are
+                   sent as structured metadata of Loki 3 (not labels, not in line)
+            :param max_label_values: max number of distinct values of one label,
+                   the label over the limit is demoted (default: unlimited)
+            :param demote_labels_to: `line` or `structured_metadata` - where
+                   the values of demoted labels are sent
         """
+        if overflow_policy == OVERFLOW_BLOCK:
+            raise ValueError('The overflow policy block is not supported by '
+                             'the asyncio handler.')
         super().__init__(
             meta=meta,
             loki_tags=loki_tags,
             send_interval=send_interval,
             max_records_in_one_request=max_records_in_one_request,
             max_queue_size=max_queue_size,
+            flush_timeout=flush_timeout,
+            overflow_policy=overflow_policy,
+            priority_level=priority_level,
+            flush_level=flush_level,
+            structured_metadata=structured_metadata,
+            max_label_values=max_label_values,
+            demote_labels_to=demote_labels_to
         )
         try:
             from ..http.aio_api_call import AIOApiCall
             api = AIOApiCall(auth=auth, timeout=timeout, ssl_verify=ssl_verify)
         except ImportError:
-            api = SimpleApiCall(auth=auth, timeout=timeout,
-                                ssl_verify=ssl_verify)
+            api = AsyncioApiCall(auth=auth, timeout=timeout,
+                                 ssl_verify=ssl_verify)
         self.emitter = LokiEmitterV1(
             self,
             urls=urls,
             api=api,
             queue=self.queue,
             strategy=strategy,
-            send_retry=send_retry
+            send_retry=send_retry,
+            dead_letter=dead_letter
         )
         self.emitter.asyncio_start()
 
     def close(self) -> None:
         self.emitter.close()
         super().close()
+
+    async def aclose(self) -> None:
+        """
+        Close the handler and wait for the end of the sending task.
+        """
+        await self.emitter.aclose()
+        super().close()
+
+
+class LokiProcessHandler(LokiHandlerBase):
+    """
+    This type of Loki handler offloads the work to the helper process.
+    The snapshots of log records (message with arguments, rendered exception
+    and metadata) are sent in batches over the pipe. The helper process
+    formats, encodes and sends them to Loki by its own `LokiThreadHandler`,
+    so the application process spends almost no CPU (and GIL) on logging.
+    """
+
+    def __init__(self, urls: List[str], strategy: str = None,
+                 meta: dict = None, auth=None, loki_tags=None,
+                 timeout=None, ssl_verify=True, send_interval=1,
+                 max_records_in_one_request=0, send_retry=None,
+                 max_queue_size=0, flush_timeout=5, overflow_policy=None,
+                 block_timeout=1, priority_level=None, flush_level=None,
+                 structured_metadata=None, max_label_values=None,
+                 demote_labels_to='line'):
+        """
+        Create new Loki logging handler.
+
+        :param urls: Endpoints used to send log entries to Loki
+                  (e.g. [`https://my-loki-instance/loki/api/v1/push`]).
+        :param strategy: to choose loki server
+                  (e.g. 'all', 'random', 'fallback')
+        :param meta: Default metadata added to every log record.
+        :param auth: Optional tuple with username and password for
+                  basic HTTP authentication.
+        :param loki_tags: The list of names metadata, which will be converted to
+                  loki tags.
+        :param timeout: connection timeout to loki server
+        :param send_interval: max period (in second) for send logs,
+               how long we should wait, if the queue is empty and
+               number messages is less than max_records_in_one_request
+        :param max_records_in_one_request: maximal number of log messages
+               in the one send
+        :param send_retry: list of waiting seconds
+               to retry sending loki messages
+        :param max_queue_size: max queue size
+        :param flush_timeout: max time (in seconds) for sending of the backlog
+               in `flush` (e.g. at exit)
+        :param overflow_policy: what happens when the queue is full:
+               `drop-newest` (default), `drop-oldest`, `block`,
+               `level-aware` or `downsample`
+        :param block_timeout: max wait (in seconds) of the logging thread
+               for the free space (policy `block`)
+        :param priority_level: the records of this and higher levels (e.g.
+               ERROR) jump ahead of the backlog
+        :param flush_level: the record of this or higher level is sent
+               immediately (send_interval is not waited)
+        :param structured_metadata: the list of names metadata, which are
+               sent as structured metadata of Loki 3 (not labels, not in line)
+        :param max_label_values: max number of distinct values of one label,
+               the label over the limit is demoted (default: unlimited)
+        :param demote_labels_to: `line` or `structured_metadata` - where
+               the values of demoted labels are sent
+        """
+        super().__init__(
+            meta=meta,
+            loki_tags=loki_tags,
+            send_interval=send_interval,
+            max_records_in_one_request=max_records_in_one_request,
+            max_queue_size=max_queue_size,
+            flush_timeout=flush_timeout,
+            overflow_policy=overflow_policy,
+            block_timeout=block_timeout,
+            priority_level=priority_level,
+            flush_level=flush_level,
+            structured_metadata=structured_metadata,
+            max_label_values=max_label_values,
+            demote_labels_to=demote_labels_to
+        )
+        self.emitter = LokiOffloadEmitter(self, self.queue, {
+            'urls': urls,
+            'strategy': strategy,
+            'meta': meta,
+            'auth': auth,
+            'loki_tags': loki_tags,
+            'timeout': timeout,
+            'ssl_verify': ssl_verify,
+            'send_interval': send_interval,
+            'max_records_in_one_request': max_records_in_one_request,
+            'send_retry': send_retry,
+            'flush_timeout': flush_timeout,
+            'priority_level': priority_level,
+            'flush_level': flush_level,
+            'structured_metadata': structured_metadata,
+            'max_label_values': max_label_values,
+            'demote_labels_to': demote_labels_to,
+        })
+        self.emitter.start()
+
+    def close(self) -> None:
+        self.emitter.close()
+        super().close()
+
+
+class LokiDatagramHandler(LokiHandlerBase):
+    """
+    This type of Loki handler writes every log record as one datagram
+    to the local log agent (Promtail, Grafana Alloy, ...) over UDP or Unix
+    datagram socket. It is fire-and-forget: there is no queue, no thread and
+    no response, a record, which can not be sent, is only counted in
+    `dropped`.
+    The default format is syslog RFC 5424 (the labels are the structured
+    data `[loki@32473 level="info" ...]`), e.g. for Promtail
+    `syslog` receiver with `label_structured_data: true`.
+    """
+
+    def __init__(self, address: str, meta: dict = None, loki_tags=None,
+                 datagram_format: str = DATAGRAM_FORMAT_RFC5424,
+                 app_name: str = None, sd_id: str = DEFAULT_SD_ID,
+                 max_datagram_size: int = 65000, max_label_values=None):
+        """
+        Create new Loki logging handler.
+
+        :param address: the local agent (e.g. `udp://127.0.0.1:1514`,
+                  `unix:///run/promtail/syslog.sock`)
+        :param meta: Default metadata added to every log record.
+        :param loki_tags: The list of names metadata, which will be converted to
+                  loki tags.
+        :param datagram_format: `rfc5424` (syslog) or `json` (the stream
+                  of Loki push API)
+        :param app_name: APP-NAME of syslog message
+        :param sd_id: SD-ID of the structured data with labels
+        :param max_datagram_size: the longer lines are truncated
+        :param max_label_values: max number of distinct values of one label,
+               the label over the limit is demoted to the line
+        """
+        super().__init__(meta=meta, loki_tags=loki_tags,
+                         max_label_values=max_label_values)
+        if datagram_format not in DATAGRAM_FORMATS:
+            raise ValueError(
+                f'The datagram format "{datagram_format}" is not supported.'
+            )
+        self.datagram_format = datagram_format
+        self.app_name = app_name
+        self.sd_id = sd_id
+        self.max_datagram_size = max_datagram_size
+        self.hostname = socket.gethostname()
+        self.family, self.address = parse_address(address)
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sent = 0
+        self.dropped = 0
+
+    def __encode(self, record, labels: dict, timestamp: int,
+                 line: str) -> bytes:
+        if self.datagram_format == DATAGRAM_FORMAT_JSON:
+            return encode_json(labels, timestamp, line)
+        return encode_rfc5424(labels, timestamp, line,
+                              levelno=record.levelno, hostname=self.hostname,
+                              app_name=self.app_name, procid=record.process,
+                              sd_id=self.sd_id)
+
+    def encode(self, record) -> bytes:
+        """
+        Return the datagram of the record.
+        """
+        labels = self.build_tags(record)
+        line = self.format(record)
+        timestamp = getattr(record, 'created_ns', None) or \
+            int(record.created * 1e9)
+        data = self.__encode(record, labels, timestamp, line)
+        while len(data) > self.max_datagram_size and line:
+            # The line is truncated, the too long datagram is refused.
+            overflow = len(data) - self.max_datagram_size
+            line = line.encode('utf-8')[:-overflow].decode('utf-8', 'ignore')
+            data = self.__encode(record, labels, timestamp, line)
+        return data
+
+    def emit(self, record):
+        """
+        Send record (fire-and-forget).
+        """
+        try:
+            data = self.encode(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.sock.sendto(data, self.address)
+            self.sent += 1
+        except OSError as ex:
+            # The agent is not running or it is overloaded.
+            self.dropped += 1
+            if self.dropped == 1 and sys.stderr:
+                sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
+
+    def close(self) -> None:
+        self.sock.close()
+        super().close()
+
+
+class LokiTenantHandler(LokiHandlerBase):
+    """
+    This type of Loki handler routes the records to the tenants of
+    multi-tenant Loki by the metadata (`tenant_key`). Every tenant has got
+    own bounded queue and emitter (batches, backoff and throttling), so one
+    throttled tenant does not block the others. The batches are sent with
+    header `X-Scope-OrgID` by the shared reactor over the shared keep-alive
+    connections (no thread per tenant).
+    """
+
+    tenant_header = 'X-Scope-OrgID'
+
+    def __init__(self, urls: List[str], tenant_key: str = 'tenant',
+                 default_tenant: str = 'fake', strategy: str = None,
+                 meta: dict = None, auth=None, loki_tags=None,
+                 timeout=None, ssl_verify=True, send_interval=1,
+                 max_records_in_one_request=0, send_retry=None,
+                 max_queue_size=0, dead_letter=None, flush_timeout=5,
+                 overflow_policy=None, priority_level=None, flush_level=None,
+                 max_tenants=100, structured_metadata=None,
+                 max_label_values=None, demote_labels_to='line'):
+        """
+        Create new Loki logging handler.
+
+        :param urls: Endpoints used to send log entries to Loki
+                  (e.g. [`https://my-loki-instance/loki/api/v1/push`]).
+        :param tenant_key: name of metadata with the tenant ID
+        :param default_tenant: the tenant of records without the tenant ID
+                  (`fake` is the tenant of single-tenant Loki), None drops
+                  these records
+        :param strategy: to choose loki server
+                  (e.g. 'all', 'random', 'fallback')
+        :param meta: Default metadata added to every log record.
+        :param auth: Optional tuple with username and password for
+                  basic HTTP authentication.
+        :param loki_tags: The list of names metadata, which will be converted to
+                  loki tags.
+        :param timeout: connection timeout to loki server
+        :param send_interval: max period (in second) for send logs,
+               how long we should wait, if the queue is empty and
+               number messages is less than max_records_in_one_request
+        :param max_records_in_one_request: maximal number of log messages
+               in the one send
+        :param send_retry: list of waiting seconds
+               to retry sending loki messages
+        :param max_queue_size: max queue size of one tenant
+        :param dead_letter: callable(record, reason)|logging.Handler - sink
+               of the log records rejected by Loki (4xx responses)
+        :param flush_timeout: max time (in seconds) for sending of the backlog
+               in `flush` (e.g. at exit)
+        :param overflow_policy: what happens when the queue of the tenant is
+               full: `drop-newest` (default), `drop-oldest`, `block`,
+               `level-aware` or `downsample`
+        :param priority_level: the records of this and higher levels (e.g.
+               ERROR) jump ahead of the backlog
+        :param flush_level: the record of this or higher level is sent
+               immediately (send_interval is not waited)
+        :param max_tenants: max number of tenants, the records of next
+               tenants are dropped (they are counted in `rejected`)
+        :param structured_metadata: the list of names metadata, which are
+               sent as structured metadata of Loki 3 (not labels, not in line)
+        :param max_label_values: max number of distinct values of one label,
+               the label over the limit is demoted (default: unlimited)
+        :param demote_labels_to: `line` or `structured_metadata` - where
+               the values of demoted labels are sent
+        """
+        super().__init__(
+            meta=meta,
+            loki_tags=loki_tags,
+            send_interval=send_interval,
+            max_records_in_one_request=max_records_in_one_request,
+            max_queue_size=max_queue_size,
+            flush_timeout=flush_timeout,
+            overflow_policy=overflow_policy,
+            priority_level=priority_level,
+            flush_level=flush_level,
+            structured_metadata=structured_metadata,
+            max_label_values=max_label_values,
+            demote_labels_to=demote_labels_to
+        )
+        self.urls = urls
+        self.tenant_key = tenant_key
+        self.default_tenant = default_tenant
+        self.strategy = strategy
+        self.send_retry = send_retry
+        self.dead_letter = dead_letter
+        self.max_tenants = max_tenants
+        # Number of records dropped, because of the missing or new tenant
+        self.rejected = 0
+        self.__api_kwargs = dict(auth=auth, timeout=timeout,
+                                 ssl_verify=ssl_verify, keep_alive=True)
+        self.tenants: Dict[str, LokiEmitterV1] = {}
+
+    @property
+    def reactor(self) -> LokiReactor:
+        """
+        The process-wide reactor, it is resolved on every use, so the new
+        tenants of the forked child use the reactor of the child.
+        """
+        return LokiReactor.instance()
+
+    @property
+    def api(self):
+        """The API client shared by the tenants (per reactor)."""
+        return self.reactor.api(SimpleApiCall, **self.__api_kwargs)
+
+    def tenant_emitter(self, tenant: str):
+        """
+        Return the emitter of the tenant, it is created by the first record.
+        :return: LokiEmitterV1|None - None if there are too many tenants
+        """
+        emitter = self.tenants.get(tenant)
+        if emitter is not None:
+            return emitter
+        with self.lock:
+            emitter = self.tenants.get(tenant)
+            if emitter is None:
+                if len(self.tenants) >= self.max_tenants:
+                    return None
+                reactor = self.reactor
+                emitter = LokiEmitterV1(
+                    self,
+                    urls=list(self.urls),
+                    api=reactor.api(SimpleApiCall, **self.__api_kwargs),
+                    queue=self.create_queue(),
+                    strategy=self.strategy,
+                    send_retry=self.send_retry,
+                    dead_letter=self.dead_letter
+                )
+                emitter.headers = {self.tenant_header: str(tenant)}
+                emitter.reactor_start(reactor)
+                # copy-on-write, the emitters are read without the lock
+                tenants = dict(self.tenants)
+                tenants[tenant] = emitter
+                self.tenants = tenants
+            return emitter
+
+    def emit(self, record):
+        """
+        Save record to the queue of its tenant.
+        """
+        try:
+            tenant = getattr(record, 'meta', {}).get(self.tenant_key,
+                                                     self.default_tenant)
+            emitter = None
+            if tenant is not None:
+                emitter = self.tenant_emitter(str(tenant))
+            if emitter is None:
+                self.rejected += 1
+                return
+            self.enqueue(record, emitter.queue, emitter)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, timeout: float = None) -> int:
+        """
+        Send the backlogs of all tenants now (send_interval is ignored).
+        :param timeout: float - deadline in seconds (default flush_timeout)
+        :return: int - number of records which were not sent
+        """
+        if timeout is None:
+            timeout = self.get_flush_timeout()
+        deadline = time.monotonic() + timeout
+        pending = 0
+        for emitter in self.tenants.values():
+            remaining = max(0, deadline - time.monotonic())
+            pending += emitter.flush(remaining)
+        return pending
+
+    def close(self) -> None:
+        for emitter in self.tenants.values():
+            emitter.close()
+        super().close()
@@ -0,0 +1,135 @@
+import time
+from threading import Lock
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+
+class EndpointHealth:
+    """
+    Health of one Loki entrypoint.
+    It tracks latency (EWMA), error rate (EWMA) and the circuit breaker:
+      - closed: the entrypoint is used
+      - open: the entrypoint is skipped (until `reset_timeout` expires)
+      - half-open: only one probe request is allowed, its result closes or
+                   opens the circuit again (with doubled `reset_timeout`)
+    """
+
+    def __init__(self, url: str, failure_threshold: int = 2,
+                 reset_timeout: float = 5, max_reset_timeout: float = 60,
+                 alpha: float = 0.3):
+        """
+        :param url: str - loki entrypoint
+        :param failure_threshold: number of consecutive failures, which open
+                                  the circuit
+        :param reset_timeout: how long (in seconds) the circuit stays open
+        :param max_reset_timeout: limit of `reset_timeout` doubling
+        :param alpha: smoothing factor of EWMA
+        """
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = None
+        self.__probing = False
+        self.__lock = Lock()
+
+    def reset(self):
+        """Forget the collected state (e.g. in the child after fork)."""
+        self.reset_timeout = self.base_reset_timeout
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = None
+        self.__probing = False
+        self.__lock = Lock()
+
+    @property
+    def score(self) -> float:
+        """
+        Lower is better. Unknown entrypoints have got the best score,
+        so they are tried.
+        """
+        if self.latency is None:
+            return 0.0
+        return self.latency / max(0.05, 1.0 - self.error_rate)
+
+    def available(self) -> bool:
+        """
+        Return True if we can send request to the entrypoint.
+        The open circuit moves to half-open after `reset_timeout`, and only
+        one caller gets the probe.
+        """
+        with self.__lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and \
+                    time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = CIRCUIT_HALF_OPEN
+                self.__probing = False
+            if self.state == CIRCUIT_HALF_OPEN and not self.__probing:
+                self.__probing = True
+                return True
+            return False
+
+    def __ewma(self, old, value):
+        if old is None:
+            return value
+        return old + self.alpha * (value - old)
+
+    def success(self, latency: float):
+        with self.__lock:
+            self.latency = self.__ewma(self.latency, latency)
+            self.error_rate = self.__ewma(self.error_rate, 0.0)
+            self.failures = 0
+            self.state = CIRCUIT_CLOSED
+            self.reset_timeout = self.base_reset_timeout
+            self.__probing = False
+
+    def failure(self, latency: float = None):
+        with self.__lock:
+            if latency is not None:
+                self.latency = self.__ewma(self.latency, latency)
+            self.error_rate = self.__ewma(self.error_rate, 1.0)
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN:
+                # The probe failed
+                self.reset_timeout = min(self.reset_timeout * 2,
+                                         self.max_reset_timeout)
+                self.__open()
+            elif self.state == CIRCUIT_CLOSED and \
+                    self.failures >= self.failure_threshold:
+                self.__open()
+
+    def release(self):
+        """
+        The probe got the answer, which is not success nor failure of
+        the entrypoint (e.g. 429), the circuit is open again (without
+        doubling of `reset_timeout`), so the next probe is allowed later.
+        """
+        with self.__lock:
+            if self.state == CIRCUIT_HALF_OPEN:
+                self.__open()
+
+    def __open(self):
+        self.state = CIRCUIT_OPEN
+        self.opened_at = time.monotonic()
+        self.__probing = False
+
+    def as_dict(self) -> dict:
+        return {
+            'url': self.url,
+            'state': self.state,
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'failures': self.failures,
+            'reset_timeout': self.reset_timeout,
+        }
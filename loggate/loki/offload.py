@@ -0,0 +1,341 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import signal
+import sys
+import time
+import weakref
+from collections.abc import Mapping
+from threading import Thread, Event, Lock
+
+from loggate.logger import LogRecord
+from loggate.loki.confirmation_queue import ConfirmatrionQueue
+from loggate.meta import resolve_value
+
+# Messages between the process and its helper process
+MSG_RECORDS = 'records'
+MSG_FLUSH = 'flush'
+MSG_CLOSE = 'close'
+
+# The attributes of the log record sent to the helper process
+# (the message is the first item of the snapshot)
+RECORD_FIELDS = ('name', 'levelno', 'pathname', 'lineno', 'funcName',
+                 'created_ns', 'thread', 'threadName', 'process',
+                 'exc_text', 'stack_info', 'meta')
+_META_FIELD = RECORD_FIELDS.index('meta')
+
+_exception_formatter = logging.Formatter()
+
+# Living emitters, they are reset in the child process after fork.
+_emitters = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for emitter in list(_emitters):
+        emitter.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def record_snapshot(record, formatter, meta: Mapping = None) -> tuple:
+    """
+    Return the picklable snapshot of the log record: the message is merged
+    with its arguments and the exception is rendered to the text.
+    The `meta` (e.g. metadata of the handler) are merged with metadata of
+    the record, the record has got the priority.
+    """
+    if record.exc_info and not record.exc_text:
+        record.exc_text = formatter.formatException(record.exc_info)
+    msg = record.msg
+    if not isinstance(msg, (dict, bytes)):
+        msg = record.getMessage()
+    fields = [getattr(record, key, None) for key in RECORD_FIELDS]
+    if meta:
+        merged = dict(meta)
+        merged.update(fields[_META_FIELD] or {})
+        fields[_META_FIELD] = merged
+    return (msg, *fields)
+
+
+def _picklable(val):
+    # The lazy values are computed in this process.
+    val = resolve_value(val)
+    if isinstance(val, Mapping):
+        return {key: _picklable(it) for key, it in val.items()}
+    if isinstance(val, (list, tuple)):
+        return type(val)(_picklable(it) for it in val)
+    try:
+        pickle.dumps(val)
+        return val
+    except Exception:
+        return repr(val)
+
+
+def _record(snapshot) -> LogRecord:
+    msg, *values = snapshot
+    fields = dict(zip(RECORD_FIELDS, values))
+    record = LogRecord(fields['name'], fields['levelno'], fields['pathname'],
+                       fields['lineno'], msg, None, None,
+                       func=fields['funcName'], sinfo=fields['stack_info'],
+                       meta=fields['meta'])
+    record.__dict__.update(fields)
+    if fields['created_ns']:
+        record.created = fields['created_ns'] / 1e9
+        record.msecs = (fields['created_ns'] % 1_000_000_000) // 1_000_000 \
+            + 0.0
+    return record
+
+
+def _helper_main(conn, handler_class, handler_kwargs, formatter):
+    """
+    The helper process: it formats, encodes and sends records to Loki.
+    """
+    # Ctrl+C is for the application, the helper ends with it (by EOF).
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handler = handler_class(**handler_kwargs)
+    if formatter:
+        handler.setFormatter(formatter)
+    try:
+        while True:
+            try:
+                kind, payload = pickle.loads(conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            if kind == MSG_RECORDS:
+                for snapshot in payload:
+                    handler.handle(_record(snapshot))
+                continue
+            # The answer has got the id of the request.
+            request_id, timeout = payload
+            try:
+                conn.send_bytes(pickle.dumps(
+                    (request_id, handler.flush(timeout))
+                ))
+            except OSError:
+                # The application does not wait for the answer anymore.
+                break
+            if kind == MSG_CLOSE:
+                break
+    finally:
+        handler.close()
+
+
+class LokiOffloadEmitter:
+    """
+    It sends the snapshots of log records to the helper process, which
+    does all the rest (formatting, encoding and HTTP delivery) by its own
+    `LokiThreadHandler`. The snapshots are sent in batches (pickle over
+    the pipe) by the thread, which holds the GIL only for a short time.
+    The helper process is started by the first batch.
+    """
+
+    def __init__(self, handler, queue: ConfirmatrionQueue, handler_kwargs):
+        """
+        :param handler: LokiProcessHandler
+        :param queue: ConfirmatrionQueue - the queue of log records
+        :param handler_kwargs: dict - params of `LokiThreadHandler`
+                               of the helper process
+        """
+        self.handler = handler
+        self.queue = queue
+        meta = handler_kwargs.get('meta') or {}
+        # The lazy metadata of the handler are computed in this process
+        # (they are sent with the records), not by the helper.
+        self.lazy_meta = any(callable(val) for val in meta.values())
+        if self.lazy_meta:
+            handler_kwargs = dict(handler_kwargs, meta={
+                key: val for key, val in meta.items() if not callable(val)
+            })
+        self.handler_kwargs = handler_kwargs
+        self.process = None
+        self.thread = None
+        self.thread_stop = Event()
+        # Number of records dropped, because they could not be sent
+        # to the helper process.
+        self.dropped = 0
+        self.__wakeup = Event()
+        self.__conn = None
+        self.__lock = Lock()
+        self.__restart = False
+        self.__request_id = 0
+        _emitters.add(self)
+
+    def notify(self, urgent: bool = False):
+        if self.__restart:
+            self.__restart = False
+            self.start()
+        if urgent or \
+                self.queue.is_ready(self.handler.max_records_in_one_request):
+            self.__wakeup.set()
+
+    def __start_process(self):
+        from loggate.loki.handlers import LokiThreadHandler
+        ctx = multiprocessing.get_context('spawn')
+        conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_helper_main,
+            args=(child_conn, LokiThreadHandler, self.handler_kwargs,
+                  self.handler.formatter),
+            name='loggate-offload',
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.__conn = conn
+
+    def __send(self, kind, payload):
+        if self.__conn is None:
+            self.__start_process()
+        self.__conn.send_bytes(pickle.dumps((kind, payload)))
+
+    def __request(self, kind, payload, timeout):
+        """
+        Send the request to the helper process and wait for the answer.
+        The late answers of the previous requests are skipped.
+        :return: answer|None - None if the helper did not answer in time
+        """
+        self.__request_id += 1
+        request_id = self.__request_id
+        self.__send(kind, (request_id, payload))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+            if not self.__conn.poll(remaining):
+                return None
+            answer_id, answer = pickle.loads(self.__conn.recv_bytes())
+            if answer_id == request_id:
+                return answer
+
+    def __send_batch(self, timeout: float = -1):
+        """
+        Send one batch of snapshots to the helper process.
+        :return: bool - False if there is nothing to send
+        """
+        if not self.__lock.acquire(timeout=timeout):
+            return False
+        try:
+            records = self.queue.gets(
+                self.handler.max_records_in_one_request,
+                block=False
+            )
+            if not records:
+                return False
+            fmt = self.handler.formatter or _exception_formatter
+            get_meta = self.handler.get_meta if self.lazy_meta else None
+            batch = [record_snapshot(record, fmt,
+                                     get_meta(record) if get_meta else None)
+                     for record in records]
+            try:
+                data = pickle.dumps((MSG_RECORDS, batch))
+            except Exception:
+                data = pickle.dumps((MSG_RECORDS, _picklable(batch)))
+            try:
+                if self.__conn is None:
+                    self.__start_process()
+                self.__conn.send_bytes(data)
+            except Exception as ex:
+                # The helper is gone, the batch is dropped and the next one
+                # starts new helper.
+                if sys.stderr:
+                    sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
+                self.__conn = None
+                self.dropped += len(records)
+            self.queue.confirm()
+            return True
+        finally:
+            self.__lock.release()
+
+    def start(self):
+        def process():
+            while not self.thread_stop.is_set():
+                if self.queue.qsize() < \
+                        self.handler.max_records_in_one_request:
+                    self.__wakeup.wait(self.handler.send_interval)
+                    self.__wakeup.clear()
+                self.__send_batch()
+
+        self.thread = Thread(target=process, name="loggate-offload",
+                             daemon=True)
+        self.thread.start()
+
+    def flush(self, timeout: float = None) -> int:
+        """
+        Send the backlog to the helper process and wait until it sends
+        all records to Loki.
+        :return: int - number of records still pending (or dropped during
+                 the flush)
+        """
+        if self.thread_stop.is_set():
+            return self.queue.qsize()
+        dropped = self.dropped
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = -1
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self.queue.qsize() + self.dropped - dropped
+            if not self.__send_batch(remaining):
+                break
+        if self.__conn is None:
+            return self.queue.qsize() + self.dropped - dropped
+        with self.__lock:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+            try:
+                pending = self.__request(MSG_FLUSH, remaining, remaining)
+            except (OSError, EOFError):
+                pending = None
+        if pending is None:
+            # The helper did not answer, something is still pending.
+            return self.queue.qsize() + 1
+        return self.queue.qsize() + pending
+
+    def close(self):
+        """Send the backlog and stop the helper process."""
+        if self.thread_stop.is_set():
+            return
+        self.thread_stop.set()
+        self.__wakeup.set()
+        if self.thread:
+            self.thread.join()
+        while self.__send_batch():
+            pass
+        if self.__conn is None:
+            return
+        timeout = self.handler.get_flush_timeout()
+        try:
+            self.__request(MSG_CLOSE, timeout, timeout)
+        except (OSError, EOFError):
+            pass
+        self.__conn.close()
+        self.__conn = None
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def after_fork(self):
+        """
+        The helper process belongs to the parent. The child starts its own
+        helper (and the thread) by the first record.
+        """
+        self.queue.clear()
+        closed = self.thread_stop.is_set()
+        self.thread_stop = Event()
+        if closed:
+            self.thread_stop.set()
+        self.__wakeup = Event()
+        self.__lock = Lock()
+        self.__restart = not closed and self.thread is not None
+        self.thread = None
+        self.process = None
+        if self.__conn is not None:
+            # It closes only the copy of the child.
+            self.__conn.close()
+            self.__conn = None
@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+from threading import Thread, Condition, Lock
+
+
+class _Slot:
+    """Scheduling state of one emitter in the reactor."""
+    __slots__ = ('due', 'busy')
+
+    def __init__(self):
+        # Monotonic time of the next service, None = idle (empty queue).
+        self.due = None
+        self.busy = False
+
+
+class LokiReactor:
+    """
+    The process-wide delivery reactor.
+    One worker thread (or a small pool) services queues of all registered
+    Loki emitters. The emitters are serviced fairly (round-robin, one batch
+    per turn) and the API clients are shared, so adding a handler costs
+    almost nothing (no thread, no extra connections).
+    """
+
+    # Number of worker threads of the shared reactor
+    workers = 1
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @classmethod
+    def instance(cls) -> 'LokiReactor':
+        """Return the process-wide reactor."""
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls(workers=cls.workers)
+            return cls.__instance
+
+    @classmethod
+    def after_fork(cls):
+        """
+        The threads of the reactor do not exist in the child process,
+        the child gets new reactor on the first use.
+        """
+        cls.__instance = None
+        cls.__instance_lock = Lock()
+
+    def __init__(self, workers: int = 1):
+        self.__workers_number = max(1, workers)
+        self.__workers = []
+        self.__cond = Condition()
+        self.__slots = {}
+        self.__ring = []
+        self.__cursor = 0
+        self.__apis = {}
+        self.__apis_lock = Lock()
+
+    def api(self, api_class, **kwargs):
+        """
+        Return the API client shared by all handlers with the same setup.
+        """
+        key = (api_class, tuple(sorted(
+            (name, tuple(val) if isinstance(val, list) else val)
+            for name, val in kwargs.items()
+        )))
+        with self.__apis_lock:
+            if key not in self.__apis:
+                self.__apis[key] = api_class(**kwargs)
+            return self.__apis[key]
+
+    @property
+    def emitters(self) -> list:
+        with self.__cond:
+            return list(self.__ring)
+
+    def register(self, emitter):
+        with self.__cond:
+            if emitter in self.__slots:
+                return
+            slot = _Slot()
+            if emitter.queue.qsize():
+                slot.due = time.monotonic()
+            self.__slots[emitter] = slot
+            self.__ring.append(emitter)
+            self.__start()
+            self.__cond.notify()
+
+    def unregister(self, emitter):
+        with self.__cond:
+            if self.__slots.pop(emitter, None) is not None:
+                self.__ring.remove(emitter)
+
+    def notify(self, emitter, urgent: bool = False):
+        """
+        The new record is in the queue of the emitter. This is called from
+        the logging hot path, the lock is taken only when the state changes.
+        The urgent record is sent immediately.
+        """
+        slot = self.__slots.get(emitter)
+        if slot is None or slot.busy:
+            return
+        if urgent and slot.due != 0:
+            with self.__cond:
+                if not slot.busy:
+                    slot.due = 0
+                    self.__cond.notify()
+        elif slot.due is None:
+            with self.__cond:
+                if slot.due is None and not slot.busy:
+                    slot.due = time.monotonic() + \
+                        emitter.handler.send_interval
+                    self.__cond.notify()
+        elif slot.due and emitter.queue.is_ready(
+                emitter.handler.max_records_in_one_request):
+            # The batch is full, it is sent immediately.
+            with self.__cond:
+                if not slot.busy:
+                    slot.due = 0
+                    self.__cond.notify()
+
+    def __start(self):
+        self.__workers = [it for it in self.__workers if it.is_alive()]
+        while len(self.__workers) < self.__workers_number:
+            worker = Thread(target=self.__run, daemon=True,
+                            name=f'loggate-reactor-{len(self.__workers)}')
+            self.__workers.append(worker)
+            worker.start()
+
+    def __next_ready(self, now: float):
+        """
+        Return the next emitter ready for service (round-robin)
+        or the time to wait.
+        """
+        wait = None
+        size = len(self.__ring)
+        for ix in range(size):
+            emitter = self.__ring[(self.__cursor + ix) % size]
+            slot = self.__slots[emitter]
+            if slot.busy or slot.due is None:
+                continue
+            if slot.due <= now:
+                self.__cursor = (self.__cursor + ix + 1) % size
+                return emitter, None
+            wait = slot.due - now if wait is None else min(wait,
+                                                           slot.due - now)
+        return None, wait
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while True:
+                    emitter, wait = self.__next_ready(time.monotonic())
+                    if emitter:
+                        slot = self.__slots[emitter]
+                        slot.busy = True
+                        break
+                    self.__cond.wait(wait)
+            delay = None
+            try:
+                delay = emitter.reactor_step()
+            except Exception as ex:
+                if sys.stderr:
+                    sys.stderr.write(f"[LOKI ERROR]\n{ex}\n")
+            finally:
+                with self.__cond:
+                    slot.busy = False
+                    if delay is None and emitter.queue.qsize():
+                        # The records came during the service.
+                        delay = emitter.handler.send_interval
+                    slot.due = None if delay is None else \
+                        time.monotonic() + delay
+                    if delay is not None:
+                        self.__cond.notify()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=LokiReactor.after_fork)
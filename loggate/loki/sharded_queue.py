@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+
+from loggate.loki.confirmation_queue import ConfirmatrionQueue
+
+
+class _Shard:
+    """The buffer of one producer thread."""
+    __slots__ = ('items', 'thread')
+
+    def __init__(self, thread):
+        self.items = deque()
+        self.thread = thread
+
+
+class ShardedQueue(ConfirmatrionQueue):
+    """
+    The confirmation queue with one shard (deque) per producer thread.
+    The producers do not share any lock or counter, the shard is registered
+    only by the first record of the thread. The consumer (emitter) drains
+    the shards round-robin, the order of records of one thread is kept.
+    The max-size and privileged limits are the same as in
+    `ConfirmatrionQueue`, but each shard gets only its part of them
+    (limit / number of shards), so the producer checks only its own shard
+    and the sum of the shards stays bounded.
+    """
+
+    def __init__(self, queue_size=0):
+        super().__init__(queue_size)
+        self.__local = threading.local()
+        self.__shards = []
+        self.__shards_lock = threading.Lock()
+        self.__cursor = 0
+        self.__waiting = False
+        self.__wakeup = threading.Event()
+
+    def __shard(self) -> _Shard:
+        try:
+            return self.__local.shard
+        except AttributeError:
+            shard = _Shard(threading.current_thread())
+            with self.__shards_lock:
+                # copy-on-write, the consumer iterates the old list
+                self.__shards = self.__shards + [shard]
+            self.__local.shard = shard
+            return shard
+
+    def put(self, item, privileged=False, block=True):
+        qs = self._queue_privileged_size if privileged else self._queue_size
+        shard = self.__shard()
+        if qs > 0 and len(shard.items) * len(self.__shards) >= qs:
+            self._drop(item)
+            return False
+        shard.items.append(item)
+        if self.__waiting:
+            self.__wakeup.set()
+        return True
+
+    def __drain(self, number: int):
+        shards = self.__shards
+        if not shards:
+            return
+        chunk = max(1, number // len(shards))
+        start = self.__cursor % len(shards)
+        self.__cursor = start + 1
+        while len(self._in_process) < number:
+            taken = False
+            for ix in range(len(shards)):
+                items = shards[(start + ix) % len(shards)].items
+                for _ in range(min(chunk, number - len(self._in_process))):
+                    try:
+                        self._in_process.append(items.popleft())
+                        taken = True
+                    except IndexError:
+                        break
+            if not taken:
+                break
+
+    def __forget_dead_shards(self):
+        with self.__shards_lock:
+            self.__shards = [
+                it for it in self.__shards
+                if it.items or it.thread.is_alive()
+            ]
+
+    def gets(self, number: int = 1, block: bool = True,
+             timeout: bool = None) -> list:
+        if self._in_process:
+            return self._in_process.copy()
+        self.__drain(number)
+        if not self._in_process and block:
+            deadline = None if timeout is None else \
+                time.monotonic() + timeout
+            self.__waiting = True
+            try:
+                while not self._in_process:
+                    self.__wakeup.clear()
+                    self.__drain(number)
+                    if self._in_process:
+                        break
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                    self.__wakeup.wait(remaining)
+            finally:
+                self.__waiting = False
+        if not self._in_process:
+            self.__forget_dead_shards()
+        return self._in_process.copy()
+
+    def clear(self):
+        # The lock can be held by a thread, which does not exist after fork.
+        self.__shards_lock = threading.Lock()
+        self.__shards = []
+        self.__local = threading.local()
+        self.__wakeup = threading.Event()
+        self._in_process = []
+
+    def is_ready(self, number: int) -> bool:
+        """
+        The estimate by the shard of the current thread, so the producer
+        does not read all shards (the emitter is woken up by send_interval
+        anyway).
+        """
+        try:
+            items = self.__local.shard.items
+        except AttributeError:
+            return False
+        return len(items) * len(self.__shards) >= number
+
+    def qsize(self):
+        return sum(len(it.items) for it in self.__shards) + \
+            len(self._in_process)
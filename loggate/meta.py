@@ -0,0 +1,236 @@
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+
+EMPTY_META = MappingProxyType({})
+
+
+def freeze_meta(meta) -> Mapping:
+    """Return the read-only copy of metadata."""
+    if not meta:
+        return EMPTY_META
+    return MappingProxyType(dict(meta))
+
+
+class MetaLayer(MutableMapping):
+    """
+    The metadata of logger (or of all loggers). It acts as dict, but every
+    change creates new read-only snapshot (`frozen`), so the records keep
+    the layer which was valid when they were created (no copies per record).
+    """
+    __slots__ = ('frozen',)
+
+    def __init__(self, meta=None):
+        self.frozen = freeze_meta(meta)
+
+    def __getitem__(self, key):
+        return self.frozen[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        meta = dict(self.frozen)
+        del meta[key]
+        self.frozen = freeze_meta(meta)
+
+    def __iter__(self):
+        return iter(self.frozen)
+
+    def __len__(self):
+        return len(self.frozen)
+
+    def __repr__(self):
+        return repr(dict(self.frozen))
+
+    def update(self, *args, **kwargs):
+        meta = dict(self.frozen)
+        meta.update(*args, **kwargs)
+        self.frozen = freeze_meta(meta)
+
+    def clear(self):
+        self.frozen = EMPTY_META
+
+    def copy(self) -> dict:
+        return dict(self.frozen)
+
+
+class LazyMeta:
+    """
+    The value of metadata, which is computed only when the record is
+    serialized (e.g. `meta={'rss': LazyMeta(get_rss)}`). Any zero-argument
+    callable is lazy value as well.
+    """
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self):
+        return self.func()
+
+    def __repr__(self):
+        return f'LazyMeta({self.func!r})'
+
+
+def resolve_value(val):
+    """Return the value of metadata, the lazy value is computed."""
+    if not callable(val):
+        return val
+    try:
+        return val()
+    except Exception as ex:
+        return f'<{type(ex).__name__}: {ex}>'
+
+
+def resolve_meta(meta: Mapping) -> Mapping:
+    """Return metadata with computed lazy values (or the same mapping)."""
+    if not meta or not any(callable(val) for val in meta.values()):
+        return meta
+    return {key: resolve_value(val) for key, val in meta.items()}
+
+
+def _is_layer(layer) -> bool:
+    # The identity only, `len` (or `==`) of context layer merges its chain.
+    return layer is not None and layer is not EMPTY_META
+
+
+class _ContextLayer(Mapping):
+    """
+    One layer of `meta_context`, it is linked to the outer layer.
+    Entering of the context only creates the layer (no copies).
+    """
+    __slots__ = ('meta', 'parent')
+
+    def __init__(self, meta: Mapping, parent: '_ContextLayer' = None):
+        self.meta = meta
+        self.parent = parent
+
+    def __getitem__(self, key):
+        layer = self
+        while layer is not None:
+            if key in layer.meta:
+                return layer.meta[key]
+            layer = layer.parent
+        raise KeyError(key)
+
+    def __flatten(self) -> dict:
+        layers = []
+        layer = self
+        while layer is not None:
+            layers.append(layer.meta)
+            layer = layer.parent
+        res = {}
+        for meta in reversed(layers):
+            res.update(meta)
+        return res
+
+    def __iter__(self):
+        return iter(self.__flatten())
+
+    def __len__(self):
+        return len(self.__flatten())
+
+
+_context_meta: ContextVar = ContextVar('loggate_meta', default=None)
+
+
+@contextmanager
+def meta_context(**meta):
+    """
+    Add metadata to all records logged in this context (thread or asyncio
+    task), e.g. `with meta_context(request_id=...)`. The contexts can be
+    nested, the inner values have got the priority.
+    """
+    token = _context_meta.set(
+        _ContextLayer(freeze_meta(meta), _context_meta.get())
+    )
+    try:
+        yield
+    finally:
+        _context_meta.reset(token)
+
+
+def current_meta() -> Mapping:
+    """Return metadata of the current `meta_context`."""
+    return _context_meta.get() or EMPTY_META
+
+
+class MetaView(MutableMapping):
+    """
+    The metadata of the log record: the read-only layers (e.g. metadata of
+    the call, context, logger and manager, the first has got the priority)
+    and own top layer for the changes. Nothing is merged when the record is
+    created, the layers are merged only once, when the metadata are
+    iterated (e.g. by the formatter).
+    The lazy values are computed by the first read, the result is saved
+    to the top layer, so it is shared by all handlers (the copies of
+    the record share the view).
+    """
+    __slots__ = ('__top', '__layers', '__flat')
+
+    def __init__(self, *layers, top: dict = None):
+        self.__top = top if top is not None else {}
+        self.__layers = tuple(filter(_is_layer, layers))
+        self.__flat = None
+
+    def __getitem__(self, key):
+        if key in self.__top:
+            val = self.__top[key]
+        else:
+            for layer in self.__layers:
+                if key in layer:
+                    val = layer[key]
+                    break
+            else:
+                raise KeyError(key)
+        if callable(val):
+            val = resolve_value(val)
+            self[key] = val
+        return val
+
+    def __contains__(self, key):
+        if key in self.__top:
+            return True
+        return any(key in layer for layer in self.__layers)
+
+    def __setitem__(self, key, value):
+        self.__top[key] = value
+        if self.__flat is not None:
+            self.__flat[key] = value
+
+    def __delitem__(self, key):
+        # The key can be in the read-only layer, the view is merged.
+        flat = self.__flatten()
+        del flat[key]
+        self.__top = flat
+        self.__layers = ()
+
+    def __flatten(self) -> dict:
+        if self.__flat is None:
+            flat = {}
+            for layer in reversed(self.__layers):
+                flat.update(layer)
+            flat.update(self.__top)
+            for key, val in flat.items():
+                if callable(val):
+                    flat[key] = self.__top[key] = resolve_value(val)
+            self.__flat = flat
+        return self.__flat
+
+    def __iter__(self):
+        return iter(self.__flatten())
+
+    def __len__(self):
+        return len(self.__flatten())
+
+    def __repr__(self):
+        return repr(self.__flatten())
+
+    def __reduce__(self):
+        # The copy (e.g. pickle) is the plain dict.
+        return dict, (dict(self.__flatten()),)
+
+    def copy(self) -> dict:
+        return dict(self.__flatten())
@@ -0,0 +1,118 @@
+"""
+Latency benchmark of LokiAsyncioHandler.
+
+It measures the time between the log call and the start of the Loki push
+(the HTTP call itself is replaced by the fake asyncio API without network):
+- sparse records wait for `send_interval` (they are sent in one batch),
+- sparse records of `flush_level` are sent immediately,
+- bursts are sent in full batches (`max_records_in_one_request`).
+Every phase waits for the delivery of its own records, so nothing is left
+for the next phase.
+
+    python tests/benchmarks/bench_asyncio_latency.py
+"""
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0,
+                os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../..')))
+
+from loggate import get_logger                      # noqa: E402
+from loggate.http import HttpApiCallInterface       # noqa: E402
+from loggate.loki import LokiAsyncioHandler         # noqa: E402
+
+
+class FakeAsyncApi(HttpApiCallInterface):
+
+    def __init__(self, auth=None, timeout=None, ssl_verify=True):
+        self.timeout = 5
+        self.latencies = []
+        self.sent = 0
+
+    async def send_json(self, url, data, method='POST'):
+        now = time.perf_counter()
+        count = sum(len(stream['values'])
+                    for stream in json.loads(data)['streams'])
+        sent = BenchHandler.pending[:count]
+        del BenchHandler.pending[:count]
+        self.latencies.extend(now - it for it in sent)
+        self.sent += count
+        return 204, ''
+
+
+class BenchHandler(LokiAsyncioHandler):
+    pending = []
+
+    def emit(self, record):
+        BenchHandler.pending.append(time.perf_counter())
+        super().emit(record)
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    print(f'{name:<45} n={len(latencies):<6} '
+          f'p50={statistics.median(latencies) * 1e3:8.3f}ms '
+          f'p99={latencies[int(len(latencies) * .99) - 1] * 1e3:8.3f}ms '
+          f'max={latencies[-1] * 1e3:8.3f}ms')
+
+
+async def delivered(api, number, timeout):
+    deadline = time.perf_counter() + timeout
+    while api.sent < number and time.perf_counter() < deadline:
+        await asyncio.sleep(.001)
+    if api.sent < number:
+        print(f'{number - api.sent} records were not delivered')
+
+
+async def bench(send_interval, sparse=50, burst=10000):
+    handler = BenchHandler(urls=['http://loki'], send_interval=send_interval,
+                           flush_level=logging.ERROR)
+    api = FakeAsyncApi()
+    handler.emitter.api = api
+    logger = get_logger(f'bench{send_interval}')
+    logger.propagate = False
+    logger.addHandler(handler)
+    name = f'(send_interval={send_interval}s)'
+
+    for _ in range(sparse):
+        logger.warning('Sparse record')
+        await asyncio.sleep(.005)
+    await delivered(api, sparse, send_interval + 5)
+    report(f'sparse {name}', api.latencies)
+
+    api.latencies.clear()
+    api.sent = 0
+    for _ in range(sparse):
+        logger.error('Sparse record of flush_level')
+        await asyncio.sleep(.005)
+    await delivered(api, sparse, 5)
+    report(f'sparse flush_level {name}', api.latencies)
+
+    api.latencies.clear()
+    api.sent = 0
+    start = time.perf_counter()
+    for it in range(burst):
+        logger.warning('Burst record')
+        if it % 100 == 0:
+            await asyncio.sleep(0)
+    await delivered(api, burst, send_interval + 5)
+    duration = time.perf_counter() - start
+    report(f'burst {name}', api.latencies)
+    print(f'{"":<45} {burst / duration:,.0f} records/s')
+    await handler.aclose()
+    logger.removeHandler(handler)
+
+
+async def main():
+    for send_interval in (0.1, 1, 5):
+        await bench(send_interval)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Cost of one log call (in the application thread) of the datagram transport
+(`LokiDatagramHandler` to the local receiver) vs HTTP push
+(`LokiHandler` sends every record, `LokiThreadHandler` sends batches
+by its thread, the formatting is done there too).
+The datagrams, which the receiver does not read in time, are dropped.
+
+    python tests/benchmarks/bench_datagram.py
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,
+                os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../..')))
+
+from loggate.logger import LogRecord                            # noqa: E402
+from loggate.loki import LokiDatagramHandler, LokiHandler, \
+    LokiThreadHandler                                           # noqa: E402
+from loggate.loki.datagram import LocalDatagramReceiver         # noqa: E402
+from tests.benchmarks.bench_offload import serve                # noqa: E402
+
+RECORDS = int(os.environ.get('RECORDS', 20000))
+
+
+def bench(name, handler, records=RECORDS):
+    record = LogRecord('bench', 20, __file__, 1, 'Request done', (), None,
+                       meta={'path': '/api/items', 'status': 200})
+    start = time.perf_counter()
+    for _ in range(records):
+        handler.handle(record)
+    duration = time.perf_counter() - start
+    pending = handler.flush(60)
+    print(f'{name:<24} {duration / records * 1e6:8.1f}us/record '
+          f'{records / duration:12,.0f} records/s pending={pending} '
+          f'dropped={getattr(handler, "dropped", 0)}')
+    handler.close()
+
+
+def main():
+    port = 32000 + os.getpid() % 1000
+    server = multiprocessing.Process(target=serve, args=(port,), daemon=True)
+    server.start()
+    time.sleep(.5)
+    url = f'http://127.0.0.1:{port}/loki/api/v1/push'
+
+    udp = LocalDatagramReceiver(keep_entries=False)
+    bench('datagram (udp)', LokiDatagramHandler(udp.address))
+    udp.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        unix = LocalDatagramReceiver(f'unix://{tmp}/agent.sock',
+                                     keep_entries=False)
+        bench('datagram (unix)', LokiDatagramHandler(unix.address))
+        unix.close()
+    bench('http (LokiThreadHandler)', LokiThreadHandler(urls=[url]))
+    bench('http (LokiHandler)', LokiHandler(urls=[url]), RECORDS // 10)
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
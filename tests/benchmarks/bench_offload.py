@@ -0,0 +1,107 @@
+"""
+Throughput benchmark of the application threads: in-process Loki handler
+(`LokiThreadHandler`) vs offloaded one (`LokiProcessHandler`).
+
+The application threads do a small CPU work and log one record per
+iteration for the fixed time. The fake Loki server runs in another process,
+so only the logging competes with the application for the GIL.
+The helper process needs own CPU core, on one core machine it competes
+with the application for the CPU (but the CPU time of the application
+process per record is still lower).
+
+    THREADS=4 python tests/benchmarks/bench_offload.py
+"""
+import multiprocessing
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+sys.path.insert(0,
+                os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../..')))
+
+from loggate import get_logger                                  # noqa: E402
+from loggate.loki import LokiThreadHandler, LokiProcessHandler  # noqa: E402
+
+DURATION = 3
+THREADS = int(os.environ.get("THREADS", 4))
+
+
+class LokiRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port):
+    ThreadingHTTPServer(('127.0.0.1', port),
+                        LokiRequestHandler).serve_forever()
+
+
+def app_thread(logger, counter, stop_at):
+    iterations = 0
+    while time.perf_counter() < stop_at:
+        sum(range(200))
+        logger.info('Request %s done', iterations,
+                    meta={'path': '/api/items', 'status': 200})
+        iterations += 1
+    counter.append(iterations)
+
+
+def bench(name, handler):
+    logger = get_logger(f'bench.{name}')
+    logger.propagate = False
+    logger.setLevel('DEBUG')
+    if handler:
+        logger.addHandler(handler)
+    counter = []
+    stop_at = time.perf_counter() + DURATION
+    threads = [Thread(target=app_thread, args=(logger, counter, stop_at))
+               for _ in range(THREADS)]
+    cpu = time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = sum(counter)
+    start = time.perf_counter()
+    pending = handler.flush(60) if handler else 0
+    drain = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    print(f'{name:<12} {total / DURATION:12,.0f} iterations/s '
+          f'drain={drain:6.2f}s pending={pending} '
+          f'process CPU={cpu:6.2f}s ({cpu / total * 1e6:5.1f}us/iteration)')
+    if handler:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def main():
+    port = 31000 + os.getpid() % 1000
+    server = multiprocessing.Process(target=serve, args=(port,), daemon=True)
+    server.start()
+    time.sleep(.5)
+    url = f'http://127.0.0.1:{port}/loki/api/v1/push'
+    params = {'urls': [url], 'send_interval': .1,
+              'max_records_in_one_request': 1000, 'loki_tags': ['logger']}
+    print(f'{THREADS} application threads, {DURATION}s')
+    bench('no handler', None)
+    bench('in-process', LokiThreadHandler(**params))
+    offloaded = LokiProcessHandler(**params)
+    # The helper process is started by the first batch, not by the bench.
+    offloaded.handle(get_logger('bench').makeRecord(
+        'bench', 20, __file__, 1, 'start', (), None))
+    offloaded.flush(30)
+    bench('offloaded', offloaded)
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Scaling benchmark of the Loki handler queue: `ConfirmatrionQueue` (one
+`SimpleQueue` and the handler lock) vs `ShardedQueue` (one shard per thread,
+without the handler lock).
+
+The producer threads call `handler.handle` as fast as they can, the emitter
+thread drains the queue (the delivery is replaced by the fake API without
+network). Run it on the GIL and on the free-threaded (no-GIL) build:
+
+    python tests/benchmarks/bench_sharded_queue.py
+    python3.13t tests/benchmarks/bench_sharded_queue.py
+"""
+import os
+import sys
+import time
+from threading import Thread, Barrier
+
+sys.path.insert(0,
+                os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../..')))
+
+from loggate.http import HttpApiCallInterface       # noqa: E402
+from loggate.logger import LogRecord                # noqa: E402
+from loggate.loki import LokiThreadHandler          # noqa: E402
+
+RECORDS = int(os.environ.get('RECORDS', 200000))
+THREADS = (1, 8, 32, 64)
+
+
+class FakeApi(HttpApiCallInterface):
+
+    def __init__(self, auth=None, timeout=None, ssl_verify=True):
+        self.timeout = 5
+
+    def send_json(self, url, data, method='POST'):
+        return 204, ''
+
+
+class CountingHandler(LokiThreadHandler):
+    """The formatting is not measured."""
+
+    def format(self, record):
+        return ''
+
+
+def bench(threads, sharded):
+    handler = CountingHandler(urls=['http://loki'], send_interval=.1,
+                              max_records_in_one_request=1000,
+                              sharded_queue=sharded)
+    handler.emitter.api = FakeApi()
+    record = LogRecord('bench', 20, __file__, 1, 'msg', (), None)
+    per_thread = RECORDS // threads
+    barrier = Barrier(threads + 1)
+
+    def produce():
+        barrier.wait()
+        for _ in range(per_thread):
+            handler.handle(record)
+
+    workers = [Thread(target=produce) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    duration = time.perf_counter() - start
+    handler.close()
+    return per_thread * threads / duration
+
+
+def main():
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f'Python {sys.version.split()[0]}, GIL {"on" if gil else "off"}, '
+          f'{os.cpu_count()} CPUs, {RECORDS} records')
+    print(f'{"threads":>8} {"simple queue":>16} {"sharded queue":>16}')
+    for threads in THREADS:
+        simple = bench(threads, sharded=False)
+        sharded = bench(threads, sharded=True)
+        print(f'{threads:>8} {simple:>12,.0f} r/s {sharded:>12,.0f} r/s')
+
+
+if __name__ == '__main__':
+    main()
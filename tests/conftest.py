@@ -4,6 +4,8 @@ import urllib
 import aiohttp
 import pytest
 
+from tests.helpers import FakeLokiServer
+
 
 @pytest.fixture
 def make_profile():
@@ -123,3 +125,10 @@ def async_session(monkeypatch):
     __session = MockAsyncSession()
     monkeypatch.setattr(aiohttp, 'ClientSession', __session.get_client)
     return __session
+
+
+@pytest.fixture
+def loki_server():
+    server = FakeLokiServer()
+    yield server
+    server.close()
@@ -0,0 +1,83 @@
+"""
+The helpers shared by tests (the fixtures are in conftest).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loggate.logger import LogRecord
+
+
+def make_record(msg, *args, level=20, name='component', meta=None,
+                exc_info=None):
+    """Create the log record (without logger)."""
+    return LogRecord(name, level, __file__, 1, msg, args, exc_info,
+                     meta=meta)
+
+
+class FakeLokiServer:
+    """
+    The local HTTP server, which acts as Loki push API.
+    The responses are taken from `responses` [(status, headers)],
+    the default response is 204.
+    Without `content_length` the responses have not got Content-Length
+    (like Loki), the body of other than 204 response is delimited by
+    closing of the connection.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.delay = 0
+        self.content_length = True
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if server.delay:
+                    time.sleep(server.delay)
+                server.requests.append({
+                    'time': time.monotonic(),
+                    'client': self.client_address,
+                    'path': self.path,
+                    'headers': dict(self.headers),
+                    'json': json.loads(body),
+                })
+                status, headers = 204, {}
+                if server.responses:
+                    status, headers = server.responses.pop(0)
+                self.send_response(status)
+                for key, val in headers.items():
+                    self.send_header(key, val)
+                if server.content_length:
+                    self.send_header('Content-Length', '0')
+                elif status != 204:
+                    self.close_connection = True
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://%s:%s/loki/api/v1/push' % self.httpd.server_address
+
+    def wait_for(self, number, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.requests) < number and time.monotonic() < deadline:
+            time.sleep(.01)
+        return len(self.requests) >= number
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
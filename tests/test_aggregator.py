@@ -0,0 +1,82 @@
+import fcntl
+import os
+import time
+
+from loggate.loki import LokiThreadHandler
+from tests.helpers import make_record
+
+
+def messages(server) -> list:
+    return sorted(
+        val[1]
+        for req in server.requests
+        for stream in req['json']['streams']
+        for val in stream['values']
+    )
+
+
+def wait_until(fce, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if fce():
+            return True
+        time.sleep(.01)
+    return False
+
+
+def test_aggregation(loki_server, tmp_path):
+    path = str(tmp_path / 'loki.sock')
+    handlers = [
+        LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                          aggregator_socket=path)
+        for _ in range(3)
+    ]
+    try:
+        server, *workers = [it.emitter.aggregator for it in handlers]
+        # The first sender is elected.
+        handlers[0].handle(make_record('msg0'))
+        assert handlers[0].flush(2) == 0
+        assert server.is_server
+        assert len(loki_server.requests) == 1
+        for it, handler in enumerate(handlers[1:], 1):
+            handler.handle(make_record(f'msg{it}'))
+            assert handler.flush(2) == 0
+        assert all(it.forwarded == 1 and not it.is_server for it in workers)
+        assert wait_until(lambda: server.received == 2)
+        # The aggregator pushes the records of all in one batch.
+        assert handlers[0].flush(2) == 0
+        assert len(loki_server.requests) == 2
+        assert len(loki_server.requests[1]['json']['streams']) == 2
+        assert all(f'msg{it}' in msg for it, msg in
+                   enumerate(messages(loki_server)))
+
+        # The aggregator is gone, another worker takes over.
+        handlers[0].close()
+        handlers[1].handle(make_record('msg3'))
+        assert handlers[1].flush(2) == 0
+        assert workers[0].is_server
+        assert len(loki_server.requests) == 3
+        handlers[2].handle(make_record('msg4'))
+        assert handlers[2].flush(2) == 0
+        assert workers[1].forwarded == 2
+    finally:
+        for handler in handlers:
+            handler.close()
+    assert not os.path.exists(path)
+
+
+def test_fallback_to_direct_push(loki_server, tmp_path):
+    path = str(tmp_path / 'loki.sock')
+    # Another process holds the election lock, but it does not listen.
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                    aggregator_socket=path)
+        try:
+            handler.handle(make_record('msg'))
+            assert handler.flush(2) == 0
+            assert len(loki_server.requests) == 1
+            assert not handler.emitter.aggregator.is_server
+            assert handler.emitter.aggregator.forwarded == 0
+        finally:
+            handler.close()
@@ -3,7 +3,8 @@ import asyncio
 import pytest
 import json
 
-from loggate import setup_logging, get_logger
+from loggate import setup_logging, get_logger, Logger
+from loggate.loki import LokiAsyncioHandler
 
 
 def check_call(request: dict, *args, headers=None, url='http://loki'):
@@ -11,7 +12,10 @@ def check_call(request: dict, *args, headers=None, url='http://loki'):
     assert request['url'] == url, \
         f"Wrong loki url {request['url']} != {url}"
     # print(request)
-    data = request['json']
+    if 'json' in request:
+        data = request['json']
+    else:
+        data = json.loads(request['data'])
     # check labels
     assert len(data['streams']) > 0
     # headers
@@ -187,8 +191,87 @@ async def test_loki_with_auth(make_profile, async_session, capsys):
     logger = get_logger('component')
     logger.critical('Critical')
 
-    await asyncio.sleep(.1)
+    # The record waits for send_interval (0.1s).
+    await asyncio.sleep(.2)
 
     check_call(async_session.requests.pop(0),
                ({'logger': 'component', 'level': 'critical'},
                 {"msg": "Critical"}))
+
+
+@pytest.mark.asyncio
+async def test_event_driven_delivery(make_profile, async_session):
+    """
+    The records are batched for send_interval, the full batch and the urgent
+    record (flush_level) are sent immediately. The close waits for the rest
+    of records.
+    """
+    profiles = make_profile({
+        'default.handlers.loki.class': 'loggate.loki.LokiAsyncioHandler',
+        'default.handlers.loki.send_interval': 10,
+        'default.handlers.loki.max_records_in_one_request': 3,
+        'default.handlers.loki.flush_level': 'ERROR'
+    })
+    setup_logging(profiles=profiles)
+    logger = get_logger('component')
+    logger.info('Info')
+    await asyncio.sleep(.05)
+    logger.info('Info')
+    await asyncio.sleep(.05)
+    assert len(async_session.requests) == 0
+
+    logger.info('Full')
+    await asyncio.sleep(.05)
+    assert len(async_session.requests) == 1
+
+    logger.error('Urgent')
+    await asyncio.sleep(.05)
+    assert len(async_session.requests) == 2
+
+    logger.info('Last')
+    await Logger.manager.get_handler('loki').aclose()
+    assert len(async_session.requests) == 3
+
+
+def test_rebind_to_next_loop(async_session):
+    """
+    The task is bound again, when the loop of the previous task is closed.
+    """
+    handler = LokiAsyncioHandler(urls=['http://loki'], send_interval=.01)
+    logger = get_logger('rebind')
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    async def main(msg):
+        logger.warning(msg)
+        await asyncio.sleep(.1)
+
+    try:
+        asyncio.run(main('First'))
+        asyncio.run(main('Second'))
+    finally:
+        logger.removeHandler(handler)
+    assert len(async_session.requests) == 2
+    assert handler.queue.qsize() == 0
+    handler.close()
+
+
+def test_lazy_loop_binding(async_session):
+    """
+    The handler is created without running loop, the sending task is bound
+    to the loop of the first log record.
+    """
+    handler = LokiAsyncioHandler(urls=['http://loki'])
+
+    async def main():
+        logger = get_logger('lazy')
+        logger.addHandler(handler)
+        try:
+            logger.warning('Warning')
+            await handler.aclose()
+        finally:
+            logger.removeHandler(handler)
+
+    asyncio.run(main())
+    check_call(async_session.requests.pop(0),
+               ({'logger': 'lazy', 'level': 'warning'}, {"msg": "Warning"}))
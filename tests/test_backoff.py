@@ -0,0 +1,126 @@
+import socket
+import time
+from email.utils import formatdate
+
+import pytest
+
+from loggate.loki import LokiHandler, LokiThreadHandler
+from loggate.loki.backoff import Backoff, parse_retry_after
+from loggate.loki.emitters import LokiServerError
+from tests.helpers import make_record
+
+
+def unused_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return 'http://%s:%s/loki/api/v1/push' % sock.getsockname()
+
+
+def test_backoff_full_jitter():
+    backoff = Backoff(base=1, cap=8)
+    for ceiling in [1, 2, 4, 8, 8]:
+        assert 0 <= backoff.next() <= ceiling
+    assert backoff.next(retry_after=20) == 20
+    backoff.reset()
+    assert backoff.ceiling() == 1
+    assert Backoff(schedule=[5, 10]).ceiling() == 5
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('nonsense') is None
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10,
+                                             usegmt=True)) <= 10
+
+
+def test_rate_limit_retry_after(loki_server):
+    """
+    429 + Retry-After: the handler waits and reduces its send rate,
+    the entrypoint is not marked as unhealthy.
+    """
+    loki_server.responses = [(429, {'Retry-After': '1'})]
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=.05,
+                                send_retry='0.01')
+    try:
+        handler.handle(make_record('Limited'))
+        assert loki_server.wait_for(2)
+        first, second = loki_server.requests
+        assert second['time'] - first['time'] >= 1
+        assert second['json'] == first['json']
+        assert handler.emitter.throttle > 0
+        assert handler.emitter.health[loki_server.url].failures == 0
+    finally:
+        handler.close()
+
+
+def test_server_error_backoff(loki_server):
+    loki_server.responses = [(503, {}), (500, {})]
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=.05,
+                                send_retry='0.05,0.1')
+    # The circuit breaker would skip the only entrypoint.
+    handler.emitter.health[loki_server.url].failure_threshold = 5
+    try:
+        handler.handle(make_record('Retried'))
+        assert loki_server.wait_for(3)
+        time.sleep(.1)
+        assert handler.queue.qsize() == 0
+        assert handler.emitter.backoff.attempt == 0
+    finally:
+        handler.close()
+
+
+def test_network_error_fallback(loki_server):
+    dead_url = unused_url()
+    handler = LokiThreadHandler(urls=[dead_url, loki_server.url],
+                                strategy='fallback', send_interval=.05)
+    try:
+        handler.handle(make_record('Fallback'))
+        assert loki_server.wait_for(1)
+        assert handler.emitter.health[dead_url].failures == 1
+    finally:
+        handler.close()
+
+
+def open_circuit(loki_server, responses):
+    """
+    Return the blocking emitter with the open circuit (two 500 responses),
+    the next probe gets `responses`.
+    """
+    loki_server.responses = [(500, {}), (500, {})] + responses
+    emitter = LokiHandler(urls=[loki_server.url]).emitter
+    for it in range(2):
+        with pytest.raises(LokiServerError):
+            emitter.emit([make_record(f'failed {it}')])
+    health = emitter.health[loki_server.url]
+    assert health.state == 'open'
+    health.reset_timeout = 0
+    return emitter
+
+
+def test_rate_limited_probe(loki_server):
+    """
+    429 of the half-open probe opens the circuit again, the next probe
+    is allowed.
+    """
+    emitter = open_circuit(loki_server, [(429, {})])
+    with pytest.raises(LokiServerError):
+        emitter.emit([make_record('limited')])
+    emitter.emit([make_record('delivered')])
+    assert len(loki_server.requests) == 4
+    assert emitter.health[loki_server.url].state == 'closed'
+
+
+def test_poisoned_probe(loki_server):
+    """
+    The poison records of the half-open probe (and of its bisection) do not
+    disable the entrypoint.
+    """
+    rejected = []
+    emitter = open_circuit(loki_server, [(400, {})] * 3)
+    emitter.dead_letter = lambda record, reason: rejected.append(record.msg)
+    emitter.emit([make_record('poison 1'), make_record('poison 2')])
+    assert rejected == ['poison 1', 'poison 2']
+    emitter.emit([make_record('delivered')])
+    assert len(loki_server.requests) == 6
+    assert emitter.health[loki_server.url].state == 'closed'
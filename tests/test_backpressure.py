@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from loggate.loki import LokiThreadHandler, LokiAsyncioHandler
+from loggate.loki.backpressure import BackpressureQueue, \
+    OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK, OVERFLOW_LEVEL_AWARE, \
+    OVERFLOW_DOWNSAMPLE
+from loggate.loki.confirmation_queue import ConfirmatrionQueue
+from tests.helpers import make_record
+
+
+def messages(items):
+    return [it.msg for it in items]
+
+
+def test_drop_newest():
+    queue = ConfirmatrionQueue(2)
+    assert queue.put(make_record('a'))
+    assert queue.put(make_record('b'))
+    assert not queue.put(make_record('c', level=40))
+    assert queue.dropped == {'ERROR': 1}
+
+
+def test_drop_oldest():
+    queue = BackpressureQueue(3, OVERFLOW_DROP_OLDEST)
+    for it in 'abcde':
+        assert queue.put(make_record(it))
+    assert queue.qsize() == 3
+    assert messages(queue.gets(10, block=False)) == ['c', 'd', 'e']
+    assert queue.dropped == {'INFO': 2}
+
+
+def test_drop_oldest_keeps_privileged():
+    queue = BackpressureQueue(3, OVERFLOW_DROP_OLDEST)
+    assert queue.put(make_record('p'), privileged=True)
+    for it in 'abc':
+        assert queue.put(make_record(it))
+    assert messages(queue.gets(10, block=False)) == ['p', 'b', 'c']
+
+
+def test_level_aware():
+    queue = BackpressureQueue(3, OVERFLOW_LEVEL_AWARE)
+    assert queue.put(make_record('info', level=20))
+    assert queue.put(make_record('debug', level=10))
+    assert queue.put(make_record('error', level=40))
+    # The DEBUG record is evicted first, then the INFO record.
+    assert queue.put(make_record('warning', level=30))
+    assert queue.put(make_record('critical', level=50))
+    # Nothing lower than DEBUG.
+    assert not queue.put(make_record('debug2', level=10))
+    assert messages(queue.gets(10, block=False)) == \
+        ['error', 'warning', 'critical']
+    assert queue.dropped == {'DEBUG': 2, 'INFO': 1}
+
+
+def test_downsample():
+    queue = BackpressureQueue(100, OVERFLOW_DOWNSAMPLE)
+    for it in range(80):
+        assert queue.put(make_record(it))
+    accepted = sum(queue.put(make_record(it)) for it in range(100))
+    assert accepted == 10
+    # WARNING and higher are not sampled.
+    assert queue.put(make_record('warning', level=30))
+    assert queue.dropped == {'INFO': 90}
+
+
+def test_block():
+    queue = BackpressureQueue(2, OVERFLOW_BLOCK, block_timeout=.05)
+    assert queue.put(make_record('a'))
+    assert queue.put(make_record('b'))
+    start = time.monotonic()
+    assert not queue.put(make_record('c'))
+    assert time.monotonic() - start >= .05
+    assert queue.dropped == {'INFO': 1}
+
+    queue.block_timeout = 5
+    assert len(queue.gets(2, block=False)) == 2
+    threading.Timer(.05, queue.confirm).start()
+    assert queue.put(make_record('d'))
+    assert messages(queue.gets(2, block=False)) == ['d']
+
+
+def test_blocking_gets():
+    queue = BackpressureQueue(10, OVERFLOW_DROP_OLDEST)
+    assert queue.gets(1, block=True, timeout=.01) == []
+    threading.Timer(.05, queue.put, args=(make_record('a'),)).start()
+    assert messages(queue.gets(1, block=True, timeout=2)) == ['a']
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        BackpressureQueue(10, 'drop-random')
+    with pytest.raises(ValueError):
+        LokiThreadHandler(urls=['http://loki'], sharded_queue=True,
+                          overflow_policy=OVERFLOW_DROP_OLDEST)
+    with pytest.raises(ValueError):
+        LokiAsyncioHandler(urls=['http://loki'],
+                           overflow_policy=OVERFLOW_BLOCK)
+
+
+def test_handler_drop_oldest(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                max_queue_size=5,
+                                overflow_policy=OVERFLOW_DROP_OLDEST)
+    try:
+        for it in range(20):
+            handler.handle(make_record(f'msg {it}'))
+        assert handler.flush(2) == 0
+        lines = [line for req in loki_server.requests
+                 for stream in req['json']['streams']
+                 for _, line in stream['values']]
+        # The emitter thread can take a batch before the queue is full.
+        assert len(lines) + handler.queue.dropped['INFO'] == 20
+        assert len(lines) < 20
+        assert 'msg 19' in lines[-1]
+    finally:
+        handler.close()
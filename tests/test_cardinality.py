@@ -0,0 +1,85 @@
+import json
+import logging.handlers
+
+import pytest
+
+from loggate import get_logger
+from loggate.loki import LokiThreadHandler
+from tests.helpers import make_record
+
+
+def test_demote_to_line(loki_server):
+    warnings = logging.handlers.BufferingHandler(100)
+    logger = get_logger('loggate.loki')
+    logger.addHandler(warnings)
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                loki_tags=['logger', 'level', 'user'],
+                                max_label_values=3)
+    try:
+        for it in range(5):
+            handler.handle(make_record(f'msg {it}', meta={'user': it % 4}))
+        assert handler.flush(2) == 0
+        assert handler.demoted_labels == ['user']
+        assert handler.loki_tags == ['logger', 'level']
+        entries = [(stream['stream'], json.loads(line))
+                   for req in loki_server.requests
+                   for stream in req['json']['streams']
+                   for _, line in stream['values']]
+        users = [str(stream.get('user', line.get('user')))
+                 for stream, line in entries]
+        assert users == ['0', '1', '2', '3', '0']
+        assert 'user' in entries[2][0]
+        assert all('user' not in stream for stream, line in entries[3:])
+        # The warning is logged only once.
+        handler.handle(make_record('next', meta={'user': 5}))
+        assert [it.meta['label'] for it in warnings.buffer] == ['user']
+    finally:
+        logger.removeHandler(warnings)
+        handler.close()
+
+
+def test_demote_to_structured_metadata(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                loki_tags=['logger', 'level', 'trace'],
+                                max_label_values=1,
+                                demote_labels_to='structured_metadata')
+    try:
+        handler.handle(make_record('first', meta={'trace': 'a'}))
+        handler.handle(make_record('second', meta={'trace': 'b'}))
+        assert handler.flush(2) == 0
+        values = {json.loads(value[1])['msg']: (stream['stream'], value)
+                  for req in loki_server.requests
+                  for stream in req['json']['streams']
+                  for value in stream['values']}
+        assert values['first'][0]['trace'] == 'a'
+        stream, value = values['second']
+        assert 'trace' not in stream
+        assert value[2] == {'trace': 'b'}
+    finally:
+        handler.close()
+
+
+def test_wrong_demotion():
+    with pytest.raises(ValueError):
+        LokiThreadHandler(urls=['http://loki'], demote_labels_to='label')
+
+
+def test_builtin_labels_are_not_limited(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                loki_tags=['logger', 'level', 'user'],
+                                max_label_values=2)
+    try:
+        for it in range(5):
+            handler.handle(make_record('msg', level=10 * (it + 1),
+                                       name=f'component.{it}',
+                                       meta={'user': 'u1'}))
+        assert handler.flush(2) == 0
+        assert handler.demoted_labels == []
+        streams = [stream['stream']
+                   for req in loki_server.requests
+                   for stream in req['json']['streams']]
+        assert sorted(it['logger'] for it in streams) == \
+            [f'component.{it}' for it in range(5)]
+        assert len({it['level'] for it in streams}) == 5
+    finally:
+        handler.close()
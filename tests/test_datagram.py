@@ -0,0 +1,69 @@
+import pytest
+
+from loggate.loki import LokiDatagramHandler
+from loggate.loki.datagram import LocalDatagramReceiver, decode_datagram, \
+    encode_rfc5424
+from tests.helpers import make_record
+
+
+@pytest.fixture
+def receiver():
+    receiver = LocalDatagramReceiver()
+    yield receiver
+    receiver.close()
+
+
+def test_rfc5424(receiver):
+    handler = LokiDatagramHandler(receiver.address, app_name='myapp',
+                                  meta={'env': 'prod'},
+                                  loki_tags=['logger', 'level', 'env'])
+    try:
+        record = make_record('Hello "world"]', level=40)
+        handler.handle(record)
+        assert receiver.wait_for(1)
+        labels, timestamp, line = receiver.entries[0]
+        assert labels == {'env': 'prod', 'level': 'error',
+                          'logger': 'component'}
+        assert timestamp == record.created_ns // 1000 * 1000
+        assert 'Hello \\"world\\"]' in line
+        assert handler.sent == 1
+    finally:
+        handler.close()
+
+
+def test_rfc5424_format():
+    data = encode_rfc5424({'level': 'info', 'path': 'a"b\\c]'},
+                          1700000000123456789, 'msg', levelno=20,
+                          hostname='host', app_name='app', procid=42)
+    assert data == b'<14>1 2023-11-14T22:13:20.123456Z host app 42 - ' \
+                   b'[loki@32473 level="info" path="a\\"b\\\\c\\]"] msg'
+    assert decode_datagram(data) == ({'level': 'info', 'path': 'a"b\\c]'},
+                                     1700000000123456000, 'msg')
+
+
+def test_json_and_truncation(tmp_path):
+    receiver = LocalDatagramReceiver(f'unix://{tmp_path}/agent.sock')
+    handler = LokiDatagramHandler(receiver.address, datagram_format='json',
+                                  max_datagram_size=200)
+    try:
+        record = make_record('x' * 1000)
+        handler.handle(record)
+        assert receiver.wait_for(1)
+        labels, timestamp, line = receiver.entries[0]
+        assert labels == {'level': 'info', 'logger': 'component'}
+        assert timestamp == record.created_ns
+        assert 100 < len(line) < 200
+    finally:
+        handler.close()
+        receiver.close()
+
+
+def test_agent_is_down(tmp_path, capsys):
+    handler = LokiDatagramHandler(f'unix://{tmp_path}/missing.sock')
+    try:
+        handler.handle(make_record('msg'))
+        handler.handle(make_record('msg'))
+        assert handler.dropped == 2
+        assert capsys.readouterr().err.count('LOKI ERROR') == 1
+    finally:
+        handler.close()
@@ -0,0 +1,229 @@
+import json
+import threading
+import time
+
+from loggate.http import HttpApiCallInterface
+from loggate.loki import LokiHandler
+from loggate.loki.emitters import LokiServerError
+from tests.helpers import make_record
+
+
+class FakeApi(HttpApiCallInterface):
+    """
+    The fake Loki API, the response code is chosen by the url.
+    """
+
+    def __init__(self, auth=None, timeout=None, ssl_verify=True):
+        self.timeout = timeout
+        self.responses = {}
+        self.requests = []
+        self.poison = None
+
+    def send_json(self, url, data, method='POST'):
+        self.requests.append((url, json.loads(data)))
+        if self.poison and self.poison in messages(self.requests[-1]):
+            return 400, 'entry too far behind'
+        codes = self.responses.get(url, 204)
+        if isinstance(codes, list):
+            codes = codes.pop(0)
+        return codes, ''
+
+
+def make_emitter(urls, strategy, **kwargs):
+    handler = LokiHandler(urls=urls, strategy=strategy, **kwargs)
+    handler.emitter.api = FakeApi()
+    return handler.emitter
+
+
+def messages(request):
+    return [json.loads(stream['values'][0][1])['msg']
+            for stream in request[1]['streams']]
+
+
+def test_all_strategy_partial_failure():
+    """
+    The batch is not sent again to entrypoints, which have accepted it.
+    """
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'all')
+    emitter.api.responses['http://loki2'] = [500, 204, 204]
+    emitter.emit([make_record('first')])
+    assert emitter.lagging_entrypoints == ['http://loki2']
+    emitter.api.requests.clear()
+
+    emitter.emit([make_record('second')])
+    requests = sorted(emitter.api.requests, key=lambda req: req[0])
+    assert [(req[0], messages(req)) for req in requests] == [
+        ('http://loki1', ['second']),
+        ('http://loki2', ['first']),
+        ('http://loki2', ['second']),
+    ]
+    assert emitter.lagging_entrypoints == []
+    assert emitter.cursors == {'http://loki1': 2, 'http://loki2': 2}
+
+
+def test_all_strategy_total_failure():
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'all')
+    emitter.api.responses = {'http://loki1': 500, 'http://loki2': 500}
+    try:
+        emitter.emit([make_record('first')])
+        assert False, 'LokiServerError expected'
+    except LokiServerError:
+        pass
+    assert emitter.cursors == {'http://loki1': 0, 'http://loki2': 0}
+    assert emitter.lagging_entrypoints == []
+
+
+def test_all_strategy_slow_entrypoint():
+    """
+    The send, which is still running, is not counted as failure and
+    the entrypoint gets no other send until it finishes.
+    """
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'all')
+    emitter.api.timeout = .1
+    gate = threading.Event()
+    send_json = emitter.api.send_json
+
+    def slow_send_json(url, data, method='POST'):
+        if url == 'http://loki2':
+            gate.wait(5)
+        return send_json(url, data, method)
+
+    emitter.api.send_json = slow_send_json
+    try:
+        emitter.emit([make_record('first')])
+        emitter.emit([make_record('second')])
+        assert emitter.health['http://loki2'].failures == 0
+        assert emitter.cursors == {'http://loki1': 2, 'http://loki2': 0}
+    finally:
+        gate.set()
+    # The late send records its own result.
+    while emitter.health['http://loki2'].latency is None:
+        time.sleep(.01)
+    assert emitter.health['http://loki2'].failures == 0
+    emitter.api.requests.clear()
+
+    emitter.emit([make_record('third')])
+    requests = sorted(emitter.api.requests, key=lambda req: req[0])
+    assert [(req[0], messages(req)) for req in requests] == [
+        ('http://loki1', ['third']),
+        ('http://loki2', ['first']),
+        ('http://loki2', ['second']),
+        ('http://loki2', ['third']),
+    ]
+    assert emitter.cursors == {'http://loki1': 3, 'http://loki2': 3}
+
+
+def test_fallback_skips_open_circuit():
+    """
+    The failing entrypoint is skipped without waiting for its response.
+    """
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'fallback')
+    emitter.api.responses['http://loki1'] = 500
+    emitter.emit([make_record('first')])
+    emitter.emit([make_record('second')])
+    assert emitter.health['http://loki1'].state == 'open'
+    emitter.api.requests.clear()
+    emitter.emit([make_record('third')])
+    assert [req[0] for req in emitter.api.requests] == ['http://loki2']
+
+
+def test_circuit_half_open_probe():
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'fallback')
+    emitter.api.responses['http://loki1'] = [500, 500, 204]
+    emitter.emit([make_record('first')])
+    emitter.emit([make_record('second')])
+    health = emitter.health['http://loki1']
+    health.reset_timeout = 0
+    emitter.api.requests.clear()
+    # The probe is successful, the circuit is closed again.
+    emitter.emit([make_record('third')])
+    assert [req[0] for req in emitter.api.requests] == ['http://loki1']
+    states = {it['url']: it['state'] for it in emitter.endpoints_state()}
+    assert states == {'http://loki1': 'closed', 'http://loki2': 'closed'}
+
+
+def test_random_prefers_fastest_entrypoint():
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'random')
+    emitter.health['http://loki1'].success(1.0)
+    emitter.health['http://loki2'].success(0.1)
+    emitter.emit([make_record('first')])
+    assert [req[0] for req in emitter.api.requests] == ['http://loki2']
+
+
+def test_all_unavailable():
+    emitter = make_emitter(['http://loki1'], 'all')
+    emitter.health['http://loki1'].failure()
+    emitter.health['http://loki1'].failure()
+    emitter.api.requests.clear()
+    try:
+        emitter.emit([make_record('first')])
+        assert False, 'LokiServerError expected'
+    except LokiServerError:
+        pass
+    assert emitter.api.requests == []
+
+
+def test_bisection_of_poison_records():
+    """
+    The rejected batch is split, the poison record goes to the dead-letter
+    sink and the rest of the batch is delivered.
+    """
+    rejected = []
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'fallback',
+                           dead_letter=lambda rec, reason:
+                           rejected.append((rec.msg, reason)))
+    emitter.api.poison = 'poison'
+    names = ['a', 'b', 'poison', 'c', 'd']
+    emitter.emit([make_record(name) for name in names])
+    delivered = [msg for req in emitter.api.requests
+                 if 'poison' not in messages(req) for msg in messages(req)]
+    assert sorted(delivered) == ['a', 'b', 'c', 'd']
+    assert rejected == [
+        ('poison', 'http://loki1: 400 "entry too far behind"')
+    ]
+    assert emitter.rejected == 1
+    # The poison record is not sent again.
+    emitter.api.requests.clear()
+    emitter.emit([make_record('e')])
+    assert [messages(req) for req in emitter.api.requests] == [['e']]
+
+
+def test_bisection_all_strategy():
+    rejected = []
+    emitter = make_emitter(['http://loki1', 'http://loki2'], 'all',
+                           dead_letter=lambda rec, reason:
+                           rejected.append(rec.msg))
+    emitter.api.poison = 'poison'
+    emitter.emit([make_record(name) for name in ['a', 'poison']])
+    assert rejected == ['poison']
+    assert emitter.lagging_entrypoints == []
+    assert emitter.health['http://loki1'].failures == 0
+
+
+def test_timestamps_in_stream_strictly_increase():
+    emitter = make_emitter(['http://loki1'], 'fallback')
+    records = [make_record(f'msg{it}') for it in range(3)]
+    records.append(make_record('other', name='other'))
+    for record in records:
+        record.created_ns = 1_000_000_000_000_000_123
+    records.insert(0, make_record('old'))
+    records[0].created_ns = 1_000_000_000_000_000_000
+    payload = emitter.prepare_payload(records)
+    timestamps = [stream['values'][0][0] for stream in payload['streams']]
+    assert timestamps == [
+        '1000000000000000000',
+        '1000000000000000123',
+        '1000000000000000124',
+        '1000000000000000125',
+        # the other stream
+        '1000000000000000123',
+    ]
+    # The entry is prepared only once.
+    assert emitter.prepare_payload(records) == payload
+
+
+def test_record_nanoseconds():
+    record = make_record('msg')
+    assert record.created == record.created_ns / 1e9
+    assert isinstance(record.created_ns, int)
+    assert record.msecs == (record.created_ns // 1_000_000) % 1000
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from loggate import setup_logging, get_logger, RateLimitFilter, \
+    SamplingFilter
+from loggate.logger import Logger
+from tests.helpers import make_record
+
+
+def setup_memory(logger_attrs: dict):
+    setup_logging(profiles={
+        'default': {
+            'disable_existing_loggers': True,
+            'filters': {
+                'repeats': {
+                    'class': 'loggate.RepeatSuppressionFilter'
+                }
+            },
+            'handlers': {
+                'memory': {
+                    'class': 'logging.handlers.BufferingHandler',
+                    'capacity': 100000
+                }
+            },
+            'loggers': {
+                'root': {
+                    'handlers': ['memory'],
+                    'level': 'DEBUG'
+                },
+                'component': logger_attrs
+            }
+        }
+    })
+    return Logger.manager.get_handler('memory').buffer
+
+
+def test_rate_limit():
+    flt = RateLimitFilter(rate=100, burst=5)
+    accepted = [flt.filter(make_record('msg')) for _ in range(20)]
+    assert sum(accepted) == 5
+    # Other logger has got own bucket.
+    assert flt.filter(make_record('msg', name='other'))
+    time.sleep(.05)
+    record = make_record('msg')
+    assert flt.filter(record)
+    assert record.meta['suppressed'] == 15
+
+
+def test_rate_limit_template_and_level():
+    flt = RateLimitFilter(rate=1, burst=1, key='template', level='ERROR')
+    assert flt.filter(make_record('first %s', 1))
+    assert not flt.filter(make_record('first %s', 2))
+    assert flt.filter(make_record('second'))
+    assert flt.filter(make_record('first %s', level=40))
+    with pytest.raises(ValueError):
+        RateLimitFilter(key='thread')
+
+
+def test_sampling():
+    flt = SamplingFilter(rates={'DEBUG': 0.1, 'INFO': 0})
+    accepted = sum(flt.filter(make_record('msg', level=10)) for _ in range(10000))
+    assert 700 < accepted < 1300
+    assert not flt.filter(make_record('msg', level=20))
+    assert flt.filter(make_record('msg', level=30))
+
+
+def test_sampling_by_key():
+    flt = SamplingFilter(rates={'DEBUG': 0.5}, key='trace_id')
+    for trace in range(100):
+        decisions = {
+            flt.filter(make_record('msg', level=10, meta={'trace_id': trace}))
+            for _ in range(5)
+        }
+        assert len(decisions) == 1
+
+
+def test_repeat_suppression():
+    buffer = setup_memory({'filters': ['repeats']})
+    logger = get_logger('component')
+    for _ in range(50):
+        logger.info('Connection to %s failed', 'db')
+    logger.info('Connection to %s failed', 'cache')
+    logger.info('Done')
+    assert [it.getMessage() for it in buffer] == [
+        'Connection to db failed',
+        'Last message repeated 49 times',
+        'Connection to cache failed',
+        'Done'
+    ]
+    assert buffer[1].meta['repeated'] == 49
+
+
+def test_logger_filters_from_profile():
+    buffer = setup_memory({
+        'filters': [{
+            'class': 'loggate.RateLimitFilter',
+            'rate': 1,
+            'burst': 3
+        }]
+    })
+    logger = get_logger('component')
+    for it in range(100):
+        logger.info('Record %s', it)
+    get_logger('other').info('Other')
+    assert [it.getMessage() for it in buffer] == \
+        ['Record 0', 'Record 1', 'Record 2', 'Other']
+    # The filters are removed by the next profile.
+    buffer = setup_memory({})
+    logger = get_logger('component')
+    for it in range(10):
+        logger.info('Record %s', it)
+    assert len(buffer) == 10
@@ -0,0 +1,103 @@
+import logging.handlers
+
+from loggate import setup_logging, get_logger, FlightRecorderHandler
+from loggate.logger import Logger
+
+
+def setup_recorder(**attrs):
+    setup_logging(profiles={
+        'default': {
+            'disable_existing_loggers': True,
+            'handlers': {
+                'recorder': {
+                    'class': 'loggate.FlightRecorderHandler',
+                    'target': 'memory',
+                    **attrs
+                },
+                'memory': {
+                    'class': 'logging.handlers.BufferingHandler',
+                    'capacity': 100000
+                }
+            },
+            'loggers': {
+                'root': {
+                    'handlers': ['recorder'],
+                    'level': 'DEBUG'
+                }
+            }
+        }
+    })
+    return Logger.manager.get_handler('recorder'), \
+        Logger.manager.get_handler('memory').buffer
+
+
+def test_trigger():
+    recorder, buffer = setup_recorder(capacity=3)
+    logger = get_logger('component')
+    for it in range(5):
+        logger.debug('Step %s', it)
+    get_logger('other').info('Other')
+    assert buffer == []
+    assert recorder.buffered() == 4
+    logger.error('Failed')
+    assert [it.getMessage() for it in buffer] == \
+        ['Step 2', 'Step 3', 'Step 4', 'Failed']
+    assert recorder.buffered() == 1
+
+
+def test_key():
+    recorder, buffer = setup_recorder(key='request_id', max_keys=2,
+                                      trigger_level='WARNING')
+    logger = get_logger('component')
+    for request in range(3):
+        logger.info('Start', meta={'request_id': request})
+    logger.info('Done', meta={'request_id': 2})
+    # The ring of the first request was forgotten.
+    assert recorder.buffered() == 3
+    logger.warning('Slow', meta={'request_id': 2})
+    assert [(it.getMessage(), it.meta['request_id']) for it in buffer] == \
+        [('Start', 2), ('Done', 2), ('Slow', 2)]
+
+
+def test_target_instance():
+    target = logging.handlers.BufferingHandler(100)
+    recorder = FlightRecorderHandler(target, trigger_level=logging.ERROR)
+    logger = get_logger('flight.instance')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(recorder)
+    try:
+        logger.debug('Context')
+        logger.critical('Crash')
+        assert [it.getMessage() for it in target.buffer] == \
+            ['Context', 'Crash']
+    finally:
+        logger.removeHandler(recorder)
+        recorder.close()
+
+
+def test_compact_snapshots_and_byte_budget():
+    recorder, buffer = setup_recorder(capacity=100, key='request_id',
+                                      max_bytes=3000)
+    size = FlightRecorderHandler.record_overhead + len('Request 0 step 0')
+    logger = get_logger('component')
+    for request in range(2):
+        for step in range(3):
+            logger.debug('Request %s step %s', request, step,
+                         meta={'request_id': request})
+    # The oldest records of the least recently used ring are forgotten.
+    assert recorder.buffered() == 5
+    assert recorder.buffered_bytes() == 5 * size
+    try:
+        raise ValueError('Boom')
+    except ValueError:
+        logger.info('Caught', exc_info=True, meta={'request_id': 0})
+    logger.error('Failed', meta={'request_id': 0})
+    assert [it.getMessage() for it in buffer] == \
+        ['Request 0 step 1', 'Request 0 step 2', 'Caught', 'Failed']
+    # The traceback needed the space of the other ring.
+    assert recorder.buffered() == 2
+    # The snapshots do not keep the arguments and the traceback.
+    assert buffer[0].args is None
+    assert buffer[2].exc_info is None
+    assert 'ValueError: Boom' in buffer[2].exc_text
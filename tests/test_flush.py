@@ -0,0 +1,112 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from loggate.loki import LokiThreadHandler, LokiAsyncioHandler
+from loggate.loki import handlers as loki_handlers
+from tests.helpers import FakeLokiServer, make_record
+
+
+def test_flush_ignores_send_interval(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                max_records_in_one_request=2)
+    try:
+        for it in range(5):
+            handler.handle(make_record(f'msg{it}'))
+        assert handler.flush(timeout=2) == 0
+        assert sum(len(req['json']['streams'])
+                   for req in loki_server.requests) == 5
+    finally:
+        handler.close()
+
+
+def test_thread_handler_sends_full_batch_immediately(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                max_records_in_one_request=3)
+    try:
+        for it in range(3):
+            handler.handle(make_record(f'msg{it}'))
+        assert loki_server.wait_for(1, timeout=2)
+    finally:
+        handler.close()
+
+
+def test_flush_deadline(loki_server):
+    loki_server.responses = [(503, {})] * 100
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                send_retry='0.5')
+    try:
+        for it in range(3):
+            handler.handle(make_record(f'msg{it}'))
+        start = time.monotonic()
+        assert handler.flush(timeout=.3) == 3
+        assert time.monotonic() - start < 1
+    finally:
+        handler.close()
+
+
+def test_flush_at_exit(loki_server, monkeypatch):
+    monkeypatch.setattr(loki_handlers, '_drained', False)
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60)
+    try:
+        handler.handle(make_record('msg'))
+        assert handler in loki_handlers._handlers
+        loki_handlers._flush_at_exit()
+        assert len(loki_server.requests) == 1
+        # The configuration is kept, only the next flush doesn't wait.
+        assert handler.flush_timeout == 5
+        assert handler.get_flush_timeout() == 0
+    finally:
+        handler.close()
+    assert handler not in loki_handlers._handlers
+
+
+def test_flush_at_interpreter_exit(loki_server):
+    """
+    The thread pools are stopped before the drain at exit, the `all`
+    strategy sends to the entrypoints one by one.
+    """
+    other = FakeLokiServer()
+    code = (
+        'import sys\n'
+        'from loggate.loki import LokiThreadHandler\n'
+        'from tests.helpers import make_record\n'
+        'handler = LokiThreadHandler(urls=sys.argv[1:], strategy="all", '
+        'send_interval=60)\n'
+        'handler.handle(make_record("At exit"))\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        subprocess.run([sys.executable, '-c', code, loki_server.url,
+                        other.url], cwd=root, check=True, timeout=30)
+        assert len(loki_server.requests) == 1
+        assert len(other.requests) == 1
+    finally:
+        other.close()
+
+
+def test_asyncio_flush_without_loop(loki_server):
+    handler = LokiAsyncioHandler(urls=[loki_server.url], send_interval=60)
+    try:
+        handler.handle(make_record('msg'))
+        # There is no running loop, flush runs its own.
+        assert handler.flush(timeout=2) == 0
+        assert len(loki_server.requests) == 1
+    finally:
+        handler.close()
+
+
+def test_asyncio_aflush(loki_server):
+    async def main():
+        handler = LokiAsyncioHandler(urls=[loki_server.url],
+                                     send_interval=60)
+        for it in range(3):
+            handler.handle(make_record(f'msg{it}'))
+        assert await handler.emitter.aflush(timeout=2) == 0
+        await handler.aclose()
+
+    asyncio.run(main())
+    assert sum(len(req['json']['streams'])
+               for req in loki_server.requests) == 3
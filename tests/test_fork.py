@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from loggate.loki import LokiTenantHandler, LokiThreadHandler
+from tests.helpers import make_record
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'register_at_fork'),
+                                reason='fork is not supported')
+
+
+def run_in_child(fce) -> int:
+    """
+    Run the function in the forked process, return the exit code.
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = 0 if fce() else 2
+        finally:
+            os._exit(code)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def messages(server) -> list:
+    return sorted(
+        val[1]
+        for req in server.requests
+        for stream in req['json']['streams']
+        for val in stream['values']
+    )
+
+
+@pytest.mark.parametrize('shared_reactor', [False, True])
+def test_fork(loki_server, shared_reactor):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                shared_reactor=shared_reactor)
+    try:
+        handler.handle(make_record('parent'))
+
+        def child():
+            # The records of the parent are not sent again.
+            if handler.queue.qsize():
+                return False
+            if handler.emitter.thread or handler.emitter.reactor:
+                return False
+            # The sending is restarted by the first record.
+            handler.handle(make_record('child'))
+            if not (handler.emitter.thread or handler.emitter.reactor):
+                return False
+            return handler.flush(2) == 0
+
+        assert run_in_child(child) == 0
+        assert loki_server.wait_for(1, timeout=2)
+        assert handler.flush(2) == 0
+        assert len(loki_server.requests) == 2
+        assert 'child' in messages(loki_server)[0]
+        assert 'parent' in messages(loki_server)[1]
+    finally:
+        handler.close()
+
+
+def test_fork_new_tenant(loki_server):
+    handler = LokiTenantHandler(urls=[loki_server.url], send_interval=60)
+    try:
+        handler.handle(make_record('parent', meta={'tenant': 'team-a'}))
+        parent_reactor = handler.tenants['team-a'].reactor
+
+        def child():
+            # The new tenant is serviced by the reactor of the child.
+            handler.handle(make_record('child', meta={'tenant': 'team-b'}))
+            reactor = handler.tenants['team-b'].reactor
+            if reactor is None or reactor is parent_reactor:
+                return False
+            return handler.flush(2) == 0
+
+        assert run_in_child(child) == 0
+        assert loki_server.wait_for(1, timeout=2)
+        assert handler.flush(2) == 0
+        assert [req['headers']['X-Scope-OrgID']
+                for req in loki_server.requests] == ['team-b', 'team-a']
+    finally:
+        handler.close()
@@ -0,0 +1,74 @@
+import dataclasses
+import datetime
+import enum
+import json
+import uuid
+
+from loggate.loki import LokiLogFormatter
+from tests.helpers import make_record
+
+
+class Color(enum.Enum):
+    RED = 'red'
+
+
+class Priority(enum.IntEnum):
+    HIGH = 1
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+def format_meta(formatter, meta):
+    record = make_record('Msg', meta=meta)
+    return json.loads(formatter.format(record))
+
+
+def test_native_types():
+    ident = uuid.uuid4()
+    res = format_meta(LokiLogFormatter(), {
+        'nested': {'ids': [1, 2.5, None, True], 'name': b'bytes'},
+        'tuple': (1, 'a'),
+        'created': datetime.datetime(2024, 1, 2, 3, 4, 5),
+        'duration': datetime.timedelta(seconds=90),
+        'id': ident,
+        'color': Color.RED,
+        'priority': Priority.HIGH,
+        'point': Point(1, 2),
+        'nan': float('nan'),
+        'object': object,
+    })
+    assert res == {
+        'msg': 'Msg',
+        'nested': {'ids': [1, 2.5, None, True], 'name': 'bytes'},
+        'tuple': [1, 'a'],
+        'created': '2024-01-02T03:04:05',
+        'duration': 90.0,
+        'id': str(ident),
+        'color': 'red',
+        'priority': 1,
+        'point': {'x': 1, 'y': 2},
+        'nan': 'nan',
+        'object': "<class 'object'>",
+    }
+
+
+def test_limits():
+    formatter = LokiLogFormatter(max_depth=2, max_items=3, max_length=5)
+    cycle = []
+    cycle.append(cycle)
+    res = format_meta(formatter, {
+        'deep': {'a': {'b': {'c': 1}}},
+        'long': 'x' * 10,
+        'list': list(range(10)),
+        'dict': {it: it for it in range(5)},
+        'cycle': cycle,
+    })
+    assert res['deep'] == {'a': {'b': '<dict>'}}
+    assert res['long'] == 'xxxxx...'
+    assert res['list'] == [0, 1, 2, '<7 more items>']
+    assert res['dict'] == {'0': 0, '1': 1, '2': 2, '...': '<2 more items>'}
+    assert res['cycle'] == [['<list>']]
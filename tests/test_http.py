@@ -0,0 +1,70 @@
+import asyncio
+import base64
+import time
+
+from loggate.http.asyncio_api_call import AsyncioApiCall
+
+
+def test_asyncio_api_call(loki_server):
+    """
+    The dependency-free asyncio client: POST, basic auth and keep-alive.
+    """
+    api = AsyncioApiCall(auth=('user', 'password'))
+
+    async def main():
+        res1 = await api.send_json(loki_server.url, {'streams': [1]})
+        res2 = await api.send_json(loki_server.url, b'{"streams": [2]}')
+        api.close()
+        return res1, res2
+
+    res1, res2 = asyncio.run(main())
+    assert tuple(res1) == (204, '')
+    assert res2.status_code == 204
+    first, second = loki_server.requests
+    assert [first['json'], second['json']] == [{'streams': [1]},
+                                               {'streams': [2]}]
+    assert first['headers']['Authorization'] == \
+        'Basic ' + base64.b64encode(b'user:password').decode()
+    # The connection is reused.
+    assert first['client'] == second['client']
+
+
+def test_asyncio_api_call_response_headers(loki_server):
+    loki_server.responses = [(429, {'Retry-After': '7'})]
+    api = AsyncioApiCall()
+    res = asyncio.run(api.send_json(loki_server.url, {}))
+    assert res.status_code == 429
+    assert res.headers['retry-after'] == '7'
+
+
+def test_asyncio_api_call_without_content_length(loki_server):
+    """
+    Loki responds 204 without Content-Length, the body of other responses
+    is read until the connection is closed.
+    """
+    loki_server.content_length = False
+    loki_server.responses = [(204, {}), (204, {}), (200, {})]
+    api = AsyncioApiCall(timeout=2)
+
+    async def main():
+        return [await api.send_json(loki_server.url, {}) for _ in range(4)]
+
+    started = time.monotonic()
+    res = asyncio.run(main())
+    assert time.monotonic() - started < 1
+    assert [it.status_code for it in res] == [204, 204, 200, 204]
+    clients = [it['client'] for it in loki_server.requests]
+    # The connection is reused after 204, not after the body until close.
+    assert clients[0] == clients[1] == clients[2] != clients[3]
+
+
+def test_asyncio_api_call_timeout(loki_server):
+    loki_server.delay = .5
+    api = AsyncioApiCall(timeout=.1)
+    assert asyncio.run(api.send_json(loki_server.url, {}))[0] == 1000
+
+
+def test_asyncio_api_call_connection_error():
+    api = AsyncioApiCall(timeout=1)
+    res = asyncio.run(api.send_json('http://127.0.0.1:1/loki', {}))
+    assert res.status_code == 1000
@@ -0,0 +1,62 @@
+import itertools
+import json
+import logging.handlers
+
+from loggate import get_logger, LazyMeta, MetaView
+from loggate.loki import LokiThreadHandler
+from tests.helpers import make_record
+
+
+def test_resolved_once():
+    counter = itertools.count(1)
+    view = MetaView({'calls': LazyMeta(lambda: next(counter))},
+                    top={'static': 1, 'broken': lambda: 1 / 0})
+    assert view['calls'] == 1
+    assert view['calls'] == 1
+    assert dict(view) == {'calls': 1, 'static': 1,
+                          'broken': '<ZeroDivisionError: division by zero>'}
+    assert next(counter) == 2
+
+
+def test_not_resolved_for_filtered_records():
+    calls = []
+    buffer = logging.handlers.BufferingHandler(10)
+    logger = get_logger('lazy.test', meta={'rss': lambda: calls.append(1)})
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(buffer)
+    try:
+        logger.debug('Filtered', meta={'stats': lambda: calls.append(2)})
+        logger.info('Accepted')
+        assert calls == []
+        assert dict(buffer.buffer[0].meta) == {'rss': None}
+        assert calls == [1]
+    finally:
+        logger.removeHandler(buffer)
+        logger.meta = None
+
+
+def test_shared_by_handlers(loki_server):
+    counter = itertools.count(1)
+    handlers = [
+        LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                          meta={'handler': LazyMeta(lambda: 'lazy')},
+                          loki_tags=['logger', 'handler'])
+        for _ in range(2)
+    ]
+    record = make_record('Msg',
+                         meta=MetaView(top={'seq': lambda: next(counter)}))
+    try:
+        for handler in handlers:
+            handler.handle(record)
+            assert handler.flush(2) == 0
+        for request in loki_server.requests:
+            stream = request['json']['streams'][0]
+            assert stream['stream'] == {'logger': 'component',
+                                        'handler': 'lazy'}
+            assert json.loads(stream['values'][0][1]) == \
+                {'msg': 'Msg', 'seq': 1}
+        assert len(loki_server.requests) == 2
+    finally:
+        for handler in handlers:
+            handler.close()
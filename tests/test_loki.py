@@ -1,4 +1,5 @@
 import json
+import time
 from urllib.request import Request
 
 from loggate import setup_logging, get_logger
@@ -126,11 +127,42 @@ def test_loki_all_strategy(make_profile, session):
 
     session.closed.wait(.2)
     rec = ({'logger': 'component', 'level': 'critical'}, {"msg": "Critical"})
+    # The servers are called in parallel, the order is not guaranteed.
+    session.requests.sort(key=lambda req: req.full_url)
     check_call(session.requests.pop(0), rec, url=servers.pop(0))
     check_call(session.requests.pop(0), rec, url=servers.pop(0))
     check_call(session.requests.pop(0), rec, url=servers.pop(0))
 
 
+def test_loki_all_strategy_parallel(make_profile, session, monkeypatch):
+    """
+    Test strategy all. The slow server does not delay the others.
+    """
+    servers = ['http://loki1', 'http://loki2', 'http://loki3']
+    profiles = make_profile({
+        'default.handlers.loki.strategy': 'all',
+        'default.handlers.loki.urls': servers
+    })
+    delivered = {}
+    _send = session.send
+
+    def send(request, **kwargs):
+        time.sleep(.3)
+        delivered[request.full_url] = time.monotonic()
+        return _send(request, **kwargs)
+
+    monkeypatch.setattr('urllib.request.urlopen', send)
+    setup_logging(profiles=profiles)
+    start = time.monotonic()
+    get_logger('component').critical('Critical')
+
+    session.closed.wait(.7)
+    assert sorted(delivered) == servers
+    assert max(delivered.values()) - start < .6
+    # The payload is encoded only once and shared.
+    assert len({id(req.data) for req in session.requests}) == 1
+
+
 def test_loki_fallback_strategy(make_profile, session, capsys):
     """
     Test strategy fallback. The log message is send to first server,
@@ -0,0 +1,95 @@
+import asyncio
+import logging.handlers
+import pickle
+import threading
+
+import pytest
+
+from loggate import get_logger, meta_context, current_meta, MetaView
+
+
+@pytest.fixture
+def records():
+    buffer = logging.handlers.BufferingHandler(1000)
+    logger = get_logger('context.test')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(buffer)
+    yield buffer.buffer
+    logger.removeHandler(buffer)
+
+
+def test_layers(records):
+    logger = get_logger('context.test')
+    logger.meta = {'service': 'api', 'stage': 'dev'}
+    try:
+        with meta_context(request_id='r1', stage='prod'):
+            with meta_context(user='u1'):
+                assert dict(current_meta()) == \
+                    {'request_id': 'r1', 'stage': 'prod', 'user': 'u1'}
+                logger.info('Inner', meta={'user': 'u2'})
+            logger.info('Outer')
+        logger.info('Without')
+    finally:
+        logger.meta = None
+    assert [dict(it.meta) for it in records] == [
+        {'service': 'api', 'stage': 'prod', 'request_id': 'r1',
+         'user': 'u2'},
+        {'service': 'api', 'stage': 'prod', 'request_id': 'r1'},
+        {'service': 'api', 'stage': 'dev'},
+    ]
+
+
+def test_isolation(records):
+    logger = get_logger('context.test')
+
+    def worker(name):
+        with meta_context(worker=name):
+            logger.info(name)
+
+    async def task(name):
+        with meta_context(task=name):
+            await asyncio.sleep(.01)
+            logger.info(name)
+
+    async def main():
+        await asyncio.gather(task('t1'), task('t2'))
+
+    with meta_context(request_id='main'):
+        thread = threading.Thread(target=worker, args=('w1',))
+        thread.start()
+        thread.join()
+        asyncio.run(main())
+    metas = {it.msg: dict(it.meta) for it in records}
+    assert metas['w1'] == {'worker': 'w1'}
+    assert metas['t1'] == {'request_id': 'main', 'task': 't1'}
+    assert metas['t2'] == {'request_id': 'main', 'task': 't2'}
+
+
+def test_logger_meta_snapshots(records):
+    logger = get_logger('context.test')
+    logger.meta = {'a': 1}
+    try:
+        logger.info('First')
+        logger.meta['b'] = 2
+        logger.meta.update(c=3)
+        logger.info('Second')
+        del logger.meta['a']
+        assert logger.meta == {'b': 2, 'c': 3}
+    finally:
+        logger.meta = None
+    assert dict(logger.meta) == {}
+    # The records keep the metadata of the time of logging.
+    assert [dict(it.meta) for it in records] == \
+        [{'a': 1}, {'a': 1, 'b': 2, 'c': 3}]
+
+
+def test_meta_view():
+    view = MetaView({'a': 1, 'b': 1}, {'a': 0, 'c': 0}, top={'d': 2})
+    assert view['a'] == 1 and view['c'] == 0 and 'd' in view
+    assert len(view) == 4
+    view['c'] = 3
+    assert view == {'a': 1, 'b': 1, 'c': 3, 'd': 2}
+    del view['b']
+    assert 'b' not in view
+    assert pickle.loads(pickle.dumps(view)) == {'a': 1, 'c': 3, 'd': 2}
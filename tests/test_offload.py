@@ -0,0 +1,84 @@
+import os
+from threading import Lock
+
+from loggate.loki import LokiProcessHandler, LokiLogFormatter
+from tests.helpers import make_record
+
+
+def test_offload(loki_server):
+    handler = LokiProcessHandler(urls=[loki_server.url], send_interval=.05,
+                                 loki_tags=['logger', 'level', 'app'])
+    try:
+        handler.handle(make_record('Hello %s', 'world', level=40,
+                                   meta={'app': 'a'}))
+        try:
+            raise ValueError('Boom')
+        except ValueError as ex:
+            exc_info = (type(ex), ex, ex.__traceback__)
+            handler.handle(make_record('Failed', level=40, exc_info=exc_info,
+                                       meta={'unpicklable': Lock(),
+                                             'lazy': lambda: 'computed'}))
+        assert handler.flush(10) == 0
+        streams = [stream
+                   for req in loki_server.requests
+                   for stream in req['json']['streams']]
+        assert len(streams) == 2
+        assert streams[0]['stream'] == {'logger': 'component',
+                                        'level': 'error', 'app': 'a'}
+        assert 'Hello world' in streams[0]['values'][0][1]
+        assert 'ValueError: Boom' in streams[1]['values'][0][1]
+        assert '_thread.lock' in streams[1]['values'][0][1]
+        assert '"lazy": "computed"' in streams[1]['values'][0][1]
+    finally:
+        handler.close()
+    assert not handler.emitter.process.is_alive()
+
+
+def test_offload_lazy_handler_meta(loki_server):
+    handler = LokiProcessHandler(urls=[loki_server.url], send_interval=.05,
+                                 meta={'pid': lambda: os.getpid(),
+                                       'app': 'a'},
+                                 loki_tags=['logger', 'app', 'pid'])
+    try:
+        handler.handle(make_record('Hello', meta={'app': 'b'}))
+        assert handler.flush(10) == 0
+        stream = loki_server.requests[0]['json']['streams'][0]
+        # The value is computed in the application process.
+        assert stream['stream'] == {'logger': 'component', 'app': 'b',
+                                    'pid': os.getpid()}
+    finally:
+        handler.close()
+
+
+def test_offload_helper_can_not_start(loki_server):
+    handler = LokiProcessHandler(urls=[loki_server.url], send_interval=60)
+    # The formatter can not be sent to the helper process.
+    handler.setFormatter(LokiLogFormatter())
+    handler.formatter.unpicklable = Lock()
+    try:
+        for it in range(3):
+            handler.handle(make_record('Record %s', it))
+        assert handler.flush(5) == 3
+        assert handler.emitter.dropped == 3
+        assert loki_server.requests == []
+    finally:
+        handler.close()
+
+
+def test_offload_late_answer(loki_server):
+    """
+    The late answer of the timed out flush is not taken as the answer
+    of the next request.
+    """
+    loki_server.delay = .5
+    handler = LokiProcessHandler(urls=[loki_server.url], send_interval=60,
+                                 max_records_in_one_request=1)
+    try:
+        for it in range(3):
+            handler.handle(make_record('Record %s', it))
+        assert handler.flush(.3) > 0
+        assert handler.flush(5) == 0
+        assert len(loki_server.requests) == 3
+    finally:
+        handler.close()
+    assert handler.emitter.process.exitcode == 0
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from loggate.loki import LokiThreadHandler
+from loggate.loki.backpressure import BackpressureQueue
+from tests.helpers import make_record
+
+
+def lines(loki_server):
+    return [line for req in loki_server.requests
+            for stream in req['json']['streams']
+            for _, line in stream['values']]
+
+
+def test_priority_lanes():
+    queue = BackpressureQueue(priority_level=40)
+    for it in range(5):
+        queue.put(make_record(f'info {it}'))
+    queue.put(make_record('error', level=40))
+    queue.put(make_record('warning', level=30))
+    queue.put(make_record('critical', level=50))
+    queue.put(make_record('privileged'), privileged=True)
+    assert [it.msg for it in queue.gets(4, block=False)] == \
+        ['error', 'critical', 'privileged', 'info 0']
+    queue.confirm()
+    assert [it.msg for it in queue.gets(10, block=False)] == \
+        ['info 1', 'info 2', 'info 3', 'info 4', 'warning']
+
+
+@pytest.mark.parametrize('shared_reactor', [False, True])
+def test_flush_level(loki_server, shared_reactor):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                flush_level='ERROR', priority_level='ERROR',
+                                shared_reactor=shared_reactor)
+    try:
+        handler.handle(make_record('info'))
+        assert not loki_server.wait_for(1, timeout=.2)
+        handler.handle(make_record('error', level=40))
+        assert loki_server.wait_for(1, timeout=2)
+        # The error jumped ahead of the backlog.
+        assert [json.loads(it)['msg'] for it in lines(loki_server)] == \
+            ['error', 'info']
+    finally:
+        handler.close()
+
+
+def test_sharded_queue_without_priority():
+    with pytest.raises(ValueError):
+        LokiThreadHandler(urls=['http://loki'], sharded_queue=True,
+                          priority_level='ERROR')
@@ -0,0 +1,54 @@
+import threading
+
+from loggate.loki import LokiThreadHandler
+from loggate.loki.reactor import LokiReactor
+from tests.helpers import make_record
+
+
+def reactor_threads():
+    return [it for it in threading.enumerate()
+            if it.name.startswith('loggate-reactor')]
+
+
+def test_shared_reactor(loki_server):
+    """
+    More handlers are serviced by one reactor thread and they share
+    the API client and keep-alive connections.
+    """
+    threads_before = threading.active_count()
+    handlers = [
+        LokiThreadHandler(urls=[loki_server.url], send_interval=.05,
+                          meta={'tenant': str(it)}, shared_reactor=True,
+                          loki_tags=['tenant'])
+        for it in range(3)
+    ]
+    try:
+        assert len(reactor_threads()) == 1
+        assert threading.active_count() <= threads_before + 1
+        assert len({id(it.emitter.api) for it in handlers}) == 1
+        for it, handler in enumerate(handlers):
+            handler.handle(make_record(f'msg{it}'))
+        assert loki_server.wait_for(3)
+        tenants = sorted(
+            req['json']['streams'][0]['stream']['tenant']
+            for req in loki_server.requests
+        )
+        assert tenants == ['0', '1', '2']
+        assert len({req['client'] for req in loki_server.requests}) == 1
+    finally:
+        for handler in handlers:
+            handler.close()
+    assert not LokiReactor.instance().emitters
+
+
+def test_reactor_sends_full_batch_immediately(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=10,
+                                max_records_in_one_request=5,
+                                shared_reactor=True)
+    try:
+        for it in range(5):
+            handler.handle(make_record(f'msg{it}'))
+        assert loki_server.wait_for(1, timeout=2)
+        assert len(loki_server.requests[0]['json']['streams']) == 5
+    finally:
+        handler.close()
@@ -0,0 +1,76 @@
+import threading
+
+from loggate.loki import LokiThreadHandler
+from loggate.loki.sharded_queue import ShardedQueue
+from tests.helpers import make_record
+
+
+def put_in_thread(queue, items):
+    thread = threading.Thread(target=lambda: [queue.put(it) for it in items])
+    thread.start()
+    thread.join()
+
+
+def test_round_robin():
+    queue = ShardedQueue()
+    put_in_thread(queue, ['a1', 'a2', 'a3', 'a4'])
+    put_in_thread(queue, ['b1', 'b2'])
+    assert queue.qsize() == 6
+    batch = queue.gets(4, block=False)
+    assert sorted(batch) == ['a1', 'a2', 'b1', 'b2']
+    # The batch is not confirmed yet.
+    assert queue.gets(4, block=False) == batch
+    queue.confirm()
+    assert queue.gets(4, block=False) == ['a3', 'a4']
+    queue.confirm()
+    assert queue.gets(4, block=False) == []
+    assert queue.qsize() == 0
+
+
+def test_limits():
+    queue = ShardedQueue(10)
+    for it in range(10):
+        assert queue.put_nowait(it)
+    assert not queue.put_nowait(10)
+    assert queue.put_nowait(10, privileged=True)
+    assert queue.qsize() == 11
+
+
+def test_limits_per_shard():
+    """
+    The producer checks only its own shard: it gets its part of the limit.
+    """
+    queue = ShardedQueue(10)
+    put_in_thread(queue, range(3))
+    accepted = sum(queue.put_nowait(it) for it in range(10))
+    assert accepted == 5
+    assert queue.qsize() == 8
+
+
+def test_blocking_gets():
+    queue = ShardedQueue()
+    assert queue.gets(1, block=True, timeout=.01) == []
+    timer = threading.Timer(.05, queue.put, args=('item',))
+    timer.start()
+    assert queue.gets(1, block=True, timeout=2) == ['item']
+
+
+def test_sharded_handler(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60,
+                                sharded_queue=True)
+    try:
+        threads = [
+            threading.Thread(target=lambda th=th: [
+                handler.handle(make_record(f'{th}-{it}')) for it in range(50)
+            ])
+            for th in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert handler.flush(5) == 0
+        assert sum(len(req['json']['streams'])
+                   for req in loki_server.requests) == 400
+    finally:
+        handler.close()
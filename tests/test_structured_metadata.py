@@ -0,0 +1,64 @@
+import json
+
+from loggate.loki import LokiThreadHandler
+from tests.helpers import make_record
+
+
+def test_structured_metadata(loki_server):
+    handler = LokiThreadHandler(
+        urls=[loki_server.url], send_interval=60,
+        meta={'stage': 'dev', 'region': 'eu'},
+        loki_tags=['logger', 'level', 'stage'],
+        structured_metadata=['trace_id', 'user_id', 'region', 'stage']
+    )
+    try:
+        handler.handle(make_record('With', meta={'trace_id': 'abc',
+                                                 'user_id': 7,
+                                                 'path': '/api'}))
+        handler.handle(make_record('Without'))
+        assert handler.flush(2) == 0
+        streams = loki_server.requests[0]['json']['streams']
+        # The labels have got the priority.
+        assert streams[0]['stream'] == \
+            {'logger': 'component', 'level': 'info', 'stage': 'dev'}
+        timestamp, line, metadata = streams[0]['values'][0]
+        assert metadata == {'trace_id': 'abc', 'user_id': '7',
+                            'region': 'eu'}
+        assert json.loads(line) == {'msg': 'With', 'path': '/api'}
+        timestamp, line, metadata = streams[1]['values'][0]
+        assert metadata == {'region': 'eu'}
+    finally:
+        handler.close()
+
+
+def test_without_structured_metadata(loki_server):
+    handler = LokiThreadHandler(urls=[loki_server.url], send_interval=60)
+    try:
+        handler.handle(make_record('Plain', meta={'trace_id': 'abc'}))
+        assert handler.flush(2) == 0
+        value = loki_server.requests[0]['json']['streams'][0]['values'][0]
+        assert len(value) == 2
+        assert json.loads(value[1]) == {'msg': 'Plain', 'trace_id': 'abc'}
+    finally:
+        handler.close()
+
+
+def test_structured_values(loki_server):
+    handler = LokiThreadHandler(
+        urls=[loki_server.url], send_interval=60,
+        structured_metadata=['inputs', 'tags', 'raw', 'ok']
+    )
+    try:
+        handler.handle(make_record('Msg', meta={'inputs': {'A': 1, 'B': [2]},
+                                                'tags': ('a', 'b'),
+                                                'raw': b'data',
+                                                'ok': True}))
+        assert handler.flush(2) == 0
+        stream = loki_server.requests[0]['json']['streams'][0]
+        timestamp, line, metadata = stream['values'][0]
+        assert metadata == {'inputs': '{"A": 1, "B": [2]}',
+                            'tags': '["a", "b"]',
+                            'raw': 'data', 'ok': 'True'}
+        assert json.loads(metadata['inputs']) == {'A': 1, 'B': [2]}
+    finally:
+        handler.close()
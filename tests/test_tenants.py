@@ -0,0 +1,68 @@
+import json
+
+from loggate.loki import LokiTenantHandler
+from tests.helpers import make_record
+
+
+def tenant_lines(loki_server) -> dict:
+    result = {}
+    for req in loki_server.requests:
+        tenant = req['headers'].get('X-Scope-OrgID')
+        for stream in req['json']['streams']:
+            result.setdefault(tenant, []).extend(
+                json.loads(line)['msg'] for _, line in stream['values']
+            )
+    return result
+
+
+def test_routing(loki_server):
+    handler = LokiTenantHandler(urls=[loki_server.url], send_interval=60,
+                                max_tenants=2)
+    try:
+        handler.handle(make_record('a1', meta={'tenant': 'team-a'}))
+        handler.handle(make_record('b1', meta={'tenant': 'team-b'}))
+        handler.handle(make_record('a2', meta={'tenant': 'team-a'}))
+        # The third tenant is over the limit.
+        handler.handle(make_record('c1', meta={'tenant': 'team-c'}))
+        assert handler.flush(2) == 0
+        assert tenant_lines(loki_server) == {
+            'team-a': ['a1', 'a2'],
+            'team-b': ['b1'],
+        }
+        assert handler.rejected == 1
+    finally:
+        handler.close()
+
+
+def test_default_tenant(loki_server):
+    handler = LokiTenantHandler(urls=[loki_server.url], send_interval=60)
+    try:
+        handler.handle(make_record('default'))
+        assert handler.flush(2) == 0
+        assert tenant_lines(loki_server) == {'fake': ['default']}
+    finally:
+        handler.close()
+    handler = LokiTenantHandler(urls=[loki_server.url], send_interval=60,
+                                default_tenant=None)
+    try:
+        handler.handle(make_record('dropped'))
+        assert handler.flush(2) == 0
+        assert handler.rejected == 1
+    finally:
+        handler.close()
+
+
+def test_throttled_tenant(loki_server):
+    handler = LokiTenantHandler(urls=[loki_server.url], send_interval=.05,
+                                send_retry=[60])
+    try:
+        # The first request (tenant a) is rate limited.
+        loki_server.responses = [(429, {'Retry-After': '60'})]
+        handler.handle(make_record('a1', meta={'tenant': 'team-a'}))
+        assert loki_server.wait_for(1, timeout=2)
+        handler.handle(make_record('b1', meta={'tenant': 'team-b'}))
+        assert loki_server.wait_for(2, timeout=2)
+        assert tenant_lines(loki_server)['team-b'] == ['b1']
+        assert handler.tenants['team-a'].queue.qsize() == 1
+    finally:
+        handler.close()